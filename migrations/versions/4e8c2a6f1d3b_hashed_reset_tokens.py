@@ -0,0 +1,39 @@
+"""hashed reset tokens
+
+Revision ID: 4e8c2a6f1d3b
+Revises: 9d4e1a7b3c2f
+Create Date: 2026-10-18 11:02:15.418263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e8c2a6f1d3b'
+down_revision = '9d4e1a7b3c2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Los tokens pendientes caducan a los 15 minutos: se descartan en lugar de recalcular su huella
+    # (el usuario puede volver a pedir el enlace)
+    op.execute('DELETE FROM "passwordResetTokens"')
+
+    with op.batch_alter_table('passwordResetTokens', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('token_hash', sa.String(length=64), nullable=False))
+        batch_op.drop_column('token')
+        batch_op.create_index(batch_op.f('ix_passwordResetTokens_token_hash'), ['token_hash'], unique=True)
+        batch_op.create_index(batch_op.f('ix_passwordResetTokens_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.execute('DELETE FROM "passwordResetTokens"')
+
+    with op.batch_alter_table('passwordResetTokens', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_passwordResetTokens_expires_at'))
+        batch_op.drop_index(batch_op.f('ix_passwordResetTokens_token_hash'))
+        batch_op.add_column(sa.Column('token', sa.String(length=500), nullable=False))
+        batch_op.drop_column('token_hash')
+        batch_op.create_unique_constraint('passwordResetTokens_token_key', ['token'])
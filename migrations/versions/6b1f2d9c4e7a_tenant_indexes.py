@@ -0,0 +1,38 @@
+"""tenant indexes
+
+Revision ID: 6b1f2d9c4e7a
+Revises: 399c6813982a
+Create Date: 2026-10-18 09:05:12.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b1f2d9c4e7a'
+down_revision = '399c6813982a'
+branch_labels = None
+depends_on = None
+
+
+# Índices compuestos (company_id, created_at, id) para los listados paginados por compañía
+TENANT_INDEXES = (
+    ('addresses', 'ix_addresses_company_created'),
+    ('clients', 'ix_clients_company_created'),
+    ('partners', 'ix_partners_company_created'),
+    ('users', 'ix_users_company_created'),
+    ('vehicles', 'ix_vehicles_company_created'),
+)
+
+
+def upgrade():
+    for table, index in TENANT_INDEXES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(index, ['company_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    for table, index in reversed(TENANT_INDEXES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(index)
@@ -0,0 +1,71 @@
+"""search indexes
+
+Revision ID: 7a3f5c9e2b1d
+Revises: 4e8c2a6f1d3b
+Create Date: 2026-10-18 11:40:03.274910
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3f5c9e2b1d'
+down_revision = '4e8c2a6f1d3b'
+branch_labels = None
+depends_on = None
+
+
+# Columnas indexadas para la búsqueda ?q= (deben coincidir con api/search.py)
+SEARCH_COLUMNS = {
+    'addresses': ('name', 'address'),
+    'clients': ('first_name', 'last_name', 'nif', 'address'),
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+        # CONCURRENTLY no bloquea las escrituras mientras se construye el índice
+        with op.get_context().autocommit_block():
+            for table, columns in SEARCH_COLUMNS.items():
+                document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_search_trgm ON {table} "
+                           f"USING gin (company_id, (lower({document})) gin_trgm_ops)")
+
+    elif dialect == 'sqlite':
+        for table, columns in SEARCH_COLUMNS.items():
+            search = f"{table}_search"
+            names = ', '.join(columns)
+            new_values = ', '.join(f"new.{column}" for column in columns)
+            old_values = ', '.join(f"old.{column}" for column in columns)
+            op.execute(f"CREATE VIRTUAL TABLE {search} USING fts5({names}, content='{table}', "
+                       f"content_rowid='id', tokenize='trigram')")
+            op.execute(f"CREATE TRIGGER {search}_ai AFTER INSERT ON {table} BEGIN "
+                       f"INSERT INTO {search}(rowid, {names}) VALUES (new.id, {new_values}); END")
+            op.execute(f"CREATE TRIGGER {search}_ad AFTER DELETE ON {table} BEGIN "
+                       f"INSERT INTO {search}({search}, rowid, {names}) VALUES ('delete', old.id, {old_values}); END")
+            op.execute(f"CREATE TRIGGER {search}_au AFTER UPDATE ON {table} BEGIN "
+                       f"INSERT INTO {search}({search}, rowid, {names}) VALUES ('delete', old.id, {old_values}); "
+                       f"INSERT INTO {search}(rowid, {names}) VALUES (new.id, {new_values}); END")
+            # Indexa las filas existentes
+            op.execute(f"INSERT INTO {search}({search}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            for table in SEARCH_COLUMNS:
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_search_trgm")
+
+    elif dialect == 'sqlite':
+        for table in SEARCH_COLUMNS:
+            search = f"{table}_search"
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f"DROP TRIGGER IF EXISTS {search}_{suffix}")
+            op.execute(f"DROP TABLE IF EXISTS {search}")
@@ -0,0 +1,199 @@
+from jwt.exceptions import ExpiredSignatureError, PyJWTError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags, quote_etag
+from api.models import User, Company, Address, Client, Partner, Vehicle
+from api.pagination import keyset_page
+from api.search import search_page
+from api.serializers import dumps
+from api.cache import get_cache, SharedCache, MISSING
+from api.versioning import collection_etag, collection_cache_key, get_collection_version_async
+from api.identity import claims_identity, company_for_request, decode_access_token, public_profile, user_claims
+from api.utils import APIException
+
+# Endpoints de lectura del servidor ASGI (ver src/asgi.py): mismas rutas, parámetros y respuestas
+# que los de routes.py, pero las consultas van por el engine asíncrono y mientras esperan a la base
+# de datos el proceso sigue atendiendo otras peticiones. La paginación y la búsqueda son las mismas
+# funciones, ejecutadas con session.run_sync sobre la conexión asíncrona
+
+ACCESS_COOKIE_NAME = 'access_token_cookie'
+NO_COMPANY_ERROR = "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status_code=status, media_type='application/json')
+
+
+def with_etag(response, etag):
+    response.headers['ETag'] = quote_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# Parámetros de la query string como MultiDict de Werkzeug: los usan tal cual keyset_page, search_page
+# y collection_etag
+def query_args(request):
+    return MultiDict(request.query_params.multi_items())
+
+
+# Claims del token de acceso de la cookie (None si no hay cookie). Los errores del token se propagan
+def token_claims(request):
+    token = request.cookies.get(ACCESS_COOKIE_NAME)
+    if not token:
+        return None
+    return decode_access_token(token, request.app.state.jwt_secret_key)
+
+
+# Igual que api.identity.current_identity: las claims del token o, para tokens antiguos, la base de datos
+async def token_identity(session, claims):
+    user_id = int(claims['sub'])
+    identity = claims_identity(claims)
+    if identity is None:
+        user = await session.get(User, user_id)
+        if not user:
+            return None
+        identity = user_claims(user, await session.get(Company, user.company_id))
+    identity['user_id'] = user_id
+    return identity
+
+
+# Identidad del JWT de la cookie si viene y es válido (None en otro caso)
+async def optional_identity(request, session):
+    try:
+        claims = token_claims(request)
+    except PyJWTError:
+        return None
+    if claims is None:
+        return None
+    return await token_identity(session, claims)
+
+
+# Igual que api.identity.resolve_company_id: con JWT manda la compañía del token (403 si se pide otra)
+async def resolve_company_id(request, session, args, allow_query=False):
+    identity = await optional_identity(request, session)
+    return company_for_request(identity, args.get('company_id', type=int), allow_query)
+
+
+# Igual que api.cache.cached() con un loader asíncrono: la consulta no bloquea el bucle de eventos
+# El cliente de la caché compartida (redis) es síncrono: sus llamadas van al pool de hilos. La caché
+# en memoria responde sin esperas y se usa directamente
+async def cached_async(key, loader, index=None):
+    cache = get_cache()
+    if cache is None:
+        return await loader()
+
+    blocking = isinstance(cache, SharedCache)
+    value = await run_in_threadpool(cache.get, key) if blocking else cache.get(key)
+    if value is not MISSING:
+        return value
+
+    value = await loader()
+    if blocking:
+        await run_in_threadpool(cache.set, key, value, index=index)
+    else:
+        cache.set(key, value, index=index)
+    return value
+
+
+# Página de un listado por compañía con ETag y caché (las mismas claves que el servidor WSGI)
+async def collection_page(request, session, args, model, collection, company_id, searchable=False):
+    version = await get_collection_version_async(session, company_id, collection)
+    etag = collection_etag(company_id, collection, version, args)
+    if parse_etags(request.headers.get('if-none-match')).contains(etag):
+        return with_etag(Response(status_code=304), etag)
+
+    if searchable and args.get('q') is not None:
+        loader = lambda: session.run_sync(search_page, model, args, company_id)
+    else:
+        loader = lambda: session.run_sync(keyset_page, model, args, company_id=company_id)
+    key, index = collection_cache_key(company_id, collection, etag)
+    page = await cached_async(key, loader, index=index)
+    return with_etag(json_response(page), etag)
+
+
+async def get_addresses(request):
+    try:
+        async with request.app.state.sessions() as session:
+            args = query_args(request)
+            company_id = await resolve_company_id(request, session, args, allow_query=True)
+            if not company_id:
+                return json_response({"error": NO_COMPANY_ERROR}, 405)
+            return await collection_page(request, session, args, Address, 'addresses', company_id, searchable=True)
+
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/addresses: {e}")
+        return json_response({"error": f"Ocurrió un error en el servidor: {str(e)}"}, 500)
+
+
+async def get_clients(request):
+    try:
+        async with request.app.state.sessions() as session:
+            args = query_args(request)
+            company_id = await resolve_company_id(request, session, args, allow_query=True)
+            if not company_id:
+                return json_response({"error": NO_COMPANY_ERROR}, 405)
+            return await collection_page(request, session, args, Client, 'clients', company_id, searchable=True)
+
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/clients: {e}")
+        return json_response({"error": f"Ocurrió un error en el servidor: {str(e)}"}, 500)
+
+
+async def get_vehicles(request):
+    try:
+        async with request.app.state.sessions() as session:
+            # Como en el servidor WSGI: la compañía del JWT o, sin sesión iniciada, la de la query string
+            args = query_args(request)
+            company_id = await resolve_company_id(request, session, args, allow_query=True)
+            if not company_id:
+                return json_response({"error": NO_COMPANY_ERROR}, 405)
+            return await collection_page(request, session, args, Vehicle, 'vehicles', company_id)
+
+    except APIException:
+        raise
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_partners(request):
+    try:
+        async with request.app.state.sessions() as session:
+            args = query_args(request)
+            company_id = await resolve_company_id(request, session, args, allow_query=True)
+            if not company_id:
+                return json_response({"error": "Falta el parámetro 'company_id'"}, 400)
+            return await collection_page(request, session, args, Partner, 'partners', company_id)
+
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/partners: {e}")
+        return json_response({"error": f"Ocurrió un error en el servidor: {str(e)}"}, 500)
+
+
+# Requiere el JWT de la cookie; sin él responde lo mismo que @jwt_required
+async def get_current_user(request):
+    try:
+        claims = token_claims(request)
+    except ExpiredSignatureError:
+        return json_response({"msg": "Token has expired"}, 401)
+    except PyJWTError as e:
+        return json_response({"msg": str(e)}, 422)
+    if claims is None:
+        return json_response({"msg": f'Missing cookie "{ACCESS_COOKIE_NAME}"'}, 401)
+
+    async with request.app.state.sessions() as session:
+        identity = await token_identity(session, claims)
+    if not identity:
+        return json_response({"error": "Usuario no encontrado."}, 404)
+    return json_response(public_profile(identity))
+
+
+def handle_api_exception(request, error):
+    return json_response(error.to_dict(), error.status_code)
+
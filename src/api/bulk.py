@@ -0,0 +1,144 @@
+import csv
+import io
+import json
+from sqlalchemy import func
+from api.models import db
+from api.utils import APIException
+
+# Filas por lote en las inserciones masivas
+BULK_BATCH_SIZE = 1000
+
+# Número máximo de errores por fila que se devuelven en el informe
+MAX_REPORTED_ERRORS = 1000
+
+CSV_MIMETYPES = ('text/csv', 'application/csv')
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines')
+
+
+# Lee el cuerpo de la petición fila a fila sin cargarlo entero en memoria
+# Devuelve tuplas (número de línea, registro, error de formato)
+def iter_records(stream, mimetype):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if mimetype in CSV_MIMETYPES:
+        reader = csv.DictReader(text)
+        for row in reader:
+            # line_num apunta a la última línea leída (los campos pueden ocupar varias)
+            yield reader.line_num, row, None
+        return
+
+    if mimetype in NDJSON_MIMETYPES:
+        for line_number, line in enumerate(text, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_number, None, "La línea no es un JSON válido."
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "Cada línea debe ser un objeto JSON."
+                continue
+            yield line_number, record, None
+        return
+
+    raise ValueError(f"Formato no soportado: {mimetype}")
+
+
+# Comprueba los campos de texto de un registro contra las columnas del modelo
+# Devuelve (valores limpios, lista de errores)
+def clean_record(model, record, required, optional):
+    values = {}
+    errors = []
+
+    for field in required + optional:
+        value = record.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ''):
+            if field in required:
+                errors.append(f"'{field}' es obligatorio.")
+            values[field] = None
+            continue
+
+        value = str(value)
+        max_length = getattr(model.__table__.c[field].type, 'length', None)
+        if max_length and len(value) > max_length:
+            errors.append(f"'{field}' supera los {max_length} caracteres.")
+        values[field] = value
+
+    return values, errors
+
+
+# Inserta las filas en lotes. En PostgreSQL se usa COPY y en el resto executemany
+def insert_in_batches(table, rows, batch_size=BULK_BATCH_SIZE):
+    inserted = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            inserted += _insert_batch(table, batch)
+            batch = []
+    if batch:
+        inserted += _insert_batch(table, batch)
+    return inserted
+
+
+def _insert_batch(table, batch):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        _copy_batch(table, batch)
+    else:
+        db.session.execute(table.insert(), batch)
+    return len(batch)
+
+
+def _copy_value(value):
+    # En formato CSV de COPY un campo vacío sin comillas es NULL y uno entre comillas es texto
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_batch(table, batch):
+    columns = list(batch[0].keys())
+    buffer = io.StringIO()
+    for row in batch:
+        buffer.write(','.join(_copy_value(row[column]) for column in columns) + '\n')
+    buffer.seek(0)
+
+    # COPY comparte la conexión (y la transacción) de la sesión
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+# INSERT ... ON CONFLICT del dialecto activo (PostgreSQL y SQLite lo soportan)
+# Con otra base de datos la petición responde 500 con un mensaje claro en lugar de un error genérico
+def dialect_insert(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise APIException(f"La base de datos configurada ({dialect}) no admite INSERT ... ON CONFLICT. "
+                           "Utilice PostgreSQL o SQLite.", status_code=500)
+    return insert(table)
+
+
+# Inserta o actualiza filas en lotes sobre la restricción única `conflict_columns`
+# Los campos que llegan a None no pisan el valor guardado
+def upsert_in_batches(table, rows, conflict_columns, update_columns, batch_size=BULK_BATCH_SIZE):
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={column: func.coalesce(stmt.excluded[column], table.c[column]) for column in update_columns}
+    )
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(stmt, rows[start:start + batch_size])
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from api.serializers import dumps, loads
+
+# Valor centinela: distingue "no está en caché" de un valor None guardado
+MISSING = object()
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = round(counters['hits'] / lookups, 4) if lookups else 0.0
+        return counters
+
+
+# Caché en memoria del proceso: LRU con caducidad (TTL) por entrada
+class LRUTTLCache:
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.incr('misses')
+                return MISSING
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.stats.incr('expirations')
+                self.stats.incr('misses')
+                return MISSING
+            self._entries.move_to_end(key)
+            self.stats.incr('hits')
+            return value
+
+    # `index` sólo lo usa la caché compartida: aquí la invalidación recorre las claves por prefijo
+    def set(self, key, value, ttl=None, index=None):
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            self.stats.incr('sets')
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.incr('evictions')
+
+    # Borra todas las entradas cuya clave empieza por `prefix`
+    def delete_prefix(self, prefix):
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+        self.stats.incr('invalidations', len(keys))
+
+    def info(self):
+        with self._lock:
+            size = len(self._entries)
+        return {'backend': 'memory', 'entries': size, 'max_entries': self.max_entries, 'ttl_s': self.ttl, **self.stats.snapshot()}
+
+
+# Caché compartida entre procesos sobre un cliente compatible con Redis
+# (get, set con ex, delete, sadd, smembers, expire). Los valores se guardan como JSON
+class SharedCache:
+    def __init__(self, client, ttl=300, namespace='rutatrack'):
+        self.client = client
+        self.ttl = ttl
+        self.namespace = namespace
+        self.stats = CacheStats()
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    # Índice de claves por prefijo de invalidación (colección y compañía)
+    def _index_key(self, prefix):
+        return f"{self.namespace}:index:{prefix}"
+
+    def get(self, key):
+        raw = self.client.get(self._key(key))
+        if raw is None:
+            self.stats.incr('misses')
+            return MISSING
+        self.stats.incr('hits')
+        return loads(raw)
+
+    def set(self, key, value, ttl=None, index=None):
+        ttl = ttl or self.ttl
+        self.client.set(self._key(key), dumps(value), ex=ttl)
+        if index:
+            self.client.sadd(self._index_key(index), self._key(key))
+            self.client.expire(self._index_key(index), ttl)
+        self.stats.incr('sets')
+
+    def delete_prefix(self, prefix):
+        index_key = self._index_key(prefix)
+        keys = list(self.client.smembers(index_key))
+        if keys:
+            self.client.delete(*keys)
+        self.client.delete(index_key)
+        self.stats.incr('invalidations', len(keys))
+
+    def info(self):
+        # Redis gestiona sus propias expulsiones: aquí sólo se cuentan las operaciones de este proceso
+        return {'backend': 'shared', 'ttl_s': self.ttl, **self.stats.snapshot()}
+
+
+# Backend configurado por variables de entorno:
+#   CACHE_BACKEND=memory|redis|none, CACHE_URL, CACHE_MAX_ENTRIES, CACHE_TTL
+def create_cache():
+    backend = os.getenv('CACHE_BACKEND', 'memory').lower()
+    ttl = int(os.getenv('CACHE_TTL', 300))
+
+    if backend == 'none':
+        return None
+    if backend == 'redis':
+        import redis  # Dependencia opcional: sólo necesaria con la caché compartida
+        return SharedCache(redis.Redis.from_url(os.getenv('CACHE_URL', 'redis://localhost:6379/0')), ttl=ttl)
+    return LRUTTLCache(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 2048)), ttl=ttl)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_cache() or False
+    return _cache or None
+
+
+# Lectura a través de la caché: si la clave no está se calcula con loader() y se guarda
+# `index` es el prefijo común de las claves que se invalidan juntas
+def cached(key, loader, index=None):
+    cache = get_cache()
+    if cache is None:
+        return loader()
+
+    value = cache.get(key)
+    if value is not MISSING:
+        return value
+
+    value = loader()
+    cache.set(key, value, index=index)
+    return value
+
+
+def invalidate(prefix):
+    cache = get_cache()
+    if cache is not None:
+        cache.delete_prefix(prefix)
+
+
+def cache_info():
+    cache = get_cache()
+    return cache.info() if cache is not None else {'backend': 'none'}
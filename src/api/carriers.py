@@ -0,0 +1,128 @@
+import numpy as np
+from api.utils import APIException
+from api.geo import AVERAGE_SPEED_KMH, parse_non_negative
+
+# Comparación del coste de subcontratar cada ruta a un colaborador (Partner) frente a hacerla con
+# un vehículo propio. Se calcula la matriz rutas x transportistas en una sola pasada con NumPy
+
+# Tipos de precio de los colaboradores (mismos valores que el formulario de Autonomos.js)
+PRICE_PER_KM = 'Por kilometraje'
+PRICE_PER_WEIGHT = 'Por peso'
+PRICE_PER_CONTAINER = 'Por contenedores'
+PRICE_PER_DAY = 'Por días'
+PRICE_TYPES = (PRICE_PER_KM, PRICE_PER_WEIGHT, PRICE_PER_CONTAINER, PRICE_PER_DAY)
+
+# Horas de conducción que cuentan como una jornada en las tarifas por días
+WORKING_HOURS_PER_DAY = 9.0
+
+# Máximo de rutas por petición y de transportistas de cada tipo que se comparan
+MAX_CARRIER_ROUTES = 1000
+MAX_CARRIERS = 500
+
+
+# Tarifas de los transportistas en columnas. Cada transportista cobra:
+#   per_km * km + per_weight * toneladas + per_container * contenedores + per_day * jornadas
+#   + per_hour * horas + waiting * horas de espera + peajes (salvo que su precio ya los incluya)
+# y no puede llevar rutas con más peso que su capacidad
+class CarrierRates:
+    def __init__(self):
+        self.carriers = []
+        self.columns = {key: [] for key in ('per_km', 'per_weight', 'per_container', 'per_day', 'per_hour',
+                                            'waiting', 'tolls_included', 'capacity')}
+
+    def _add(self, carrier, **rates):
+        self.carriers.append(carrier)
+        for key, column in self.columns.items():
+            column.append(rates.get(key, 0.0))
+
+    # Colaborador: el precio se aplica según price_type; waiting_periods es lo que cobra por hora de espera
+    # Los colaboradores con un tipo de precio desconocido no se pueden valorar y se omiten
+    def add_partner(self, partner):
+        rate_key = {PRICE_PER_KM: 'per_km', PRICE_PER_WEIGHT: 'per_weight',
+                    PRICE_PER_CONTAINER: 'per_container', PRICE_PER_DAY: 'per_day'}.get(partner.price_type)
+        if rate_key is None:
+            return False
+        self._add({"type": "partner", "id": partner.id, "name": partner.name, "price_type": partner.price_type},
+                  **{rate_key: partner.price or 0.0}, waiting=partner.waiting_periods or 0.0,
+                  tolls_included=bool(partner.include_tolls), capacity=np.inf)
+        return True
+
+    # Vehículo propio: coste por km y por hora (conduciendo o esperando); sin peso máximo no tiene límite
+    def add_vehicle(self, vehicle):
+        cost_hour = vehicle.cost_hour or 0.0
+        self._add({"type": "vehicle", "id": vehicle.id, "name": vehicle.name, "plate": vehicle.plate},
+                  per_km=vehicle.cost_km or 0.0, per_hour=cost_hour, waiting=cost_hour, tolls_included=False,
+                  capacity=vehicle.weight if vehicle.weight is not None else np.inf)
+        return True
+
+    def arrays(self):
+        return {key: np.array(column, dtype=bool if key == 'tolls_included' else np.float64)
+                for key, column in self.columns.items()}
+
+
+# Valida las rutas candidatas y las separa en columnas
+# Cada ruta: {"id", "distance_km", "duration_hours" (opcional), "weight", "containers", "waiting_hours", "tolls"}
+def parse_carrier_routes(items, average_speed_kmh=AVERAGE_SPEED_KMH):
+    if not isinstance(items, list) or not items:
+        raise APIException("'routes' debe ser una lista de rutas no vacía.", status_code=400)
+    if len(items) > MAX_CARRIER_ROUTES:
+        raise APIException(f"Como máximo se admiten {MAX_CARRIER_ROUTES} rutas por petición.", status_code=400)
+
+    columns = {key: [] for key in ('distance_km', 'duration_hours', 'weight', 'containers', 'waiting_hours', 'tolls')}
+    for index, item in enumerate(items):
+        name = f"routes[{index}]"
+        if not isinstance(item, dict):
+            raise APIException(f"{name}: se esperaba un objeto JSON.", status_code=400)
+        if item.get('distance_km') is None:
+            raise APIException(f"{name}: falta el campo 'distance_km'.", status_code=400)
+
+        distance_km = parse_non_negative(item, 'distance_km', None, name)
+        columns['distance_km'].append(distance_km)
+        columns['duration_hours'].append(parse_non_negative(item, 'duration_hours', distance_km / average_speed_kmh, name))
+        columns['weight'].append(parse_non_negative(item, 'weight', 0.0, name))
+        columns['containers'].append(parse_non_negative(item, 'containers', 1.0, name))
+        columns['waiting_hours'].append(parse_non_negative(item, 'waiting_hours', 0.0, name))
+        columns['tolls'].append(parse_non_negative(item, 'tolls', 0.0, name))
+    return {key: np.array(column, dtype=np.float64) for key, column in columns.items()}
+
+
+# Matriz de costes (rutas x transportistas). Las combinaciones imposibles (exceso de peso) valen inf
+def carrier_costs(routes, rates):
+    # Columnas (R, 1) de las rutas contra filas (C,) de tarifas -> (R, C)
+    km, hours, weight = routes['distance_km'][:, None], routes['duration_hours'][:, None], routes['weight'][:, None]
+    # Las tarifas por días cobran jornadas completas, como mínimo una
+    days = np.maximum(np.ceil(hours / WORKING_HOURS_PER_DAY), 1.0)
+
+    costs = (km * rates['per_km']
+             + weight * rates['per_weight']
+             + routes['containers'][:, None] * rates['per_container']
+             + days * rates['per_day']
+             + hours * rates['per_hour']
+             + routes['waiting_hours'][:, None] * rates['waiting']
+             + np.where(rates['tolls_included'], 0.0, routes['tolls'][:, None]))
+    return np.where(weight > rates['capacity'], np.inf, costs)
+
+
+# Ordena los transportistas de cada ruta de más barato a más caro (los inviables se omiten)
+# Devuelve, por ruta, una lista de (índice del transportista, coste); `limit` recorta cada lista
+def rank_carriers(costs, limit=None):
+    order = np.argsort(costs, axis=1, kind='stable')
+    if limit is not None:
+        order = order[:, :limit]
+    ranked_costs = np.take_along_axis(costs, order, axis=1)
+    feasible = np.isfinite(ranked_costs)
+    ranked_costs = np.round(np.where(feasible, ranked_costs, 0.0), 2)
+
+    rankings = []
+    for indexes, values, valid in zip(order.tolist(), ranked_costs.tolist(), feasible.tolist()):
+        rankings.append([(index, value) for index, value, ok in zip(indexes, values, valid) if ok])
+    return rankings
+
+
+def parse_limit(data):
+    limit = data.get('limit')
+    if limit is None:
+        return None
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+        raise APIException("'limit' debe ser un entero mayor que cero.", status_code=400)
+    return limit
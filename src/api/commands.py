@@ -1,6 +1,28 @@
 
+import asyncio
 import click
-from api.models import db, User
+import http.client
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from flask import jsonify
+from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from api.models import db, User, Company, Address, Client, Partner, Vehicle, PasswordResetToken
+from api.pagination import keyset_select
+from api.geocoding import geocode_pending, requeue_not_found, GEOCODE_BATCH_SIZE
+from api.jobs import JobRunner, recover_stale_jobs, JOB_WORKERS
+from api.serializers import row_encoder, json_response, orjson
+
+# Directorio src/ (desde donde se arrancan gunicorn y uvicorn en bench-read-path)
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 """
 In this file, you can add as many commands as you want using the @app.cli.command decorator
@@ -31,4 +53,364 @@ def setup_commands(app):
 
     @app.cli.command("insert-test-data")
     def insert_test_data():
-        pass
\ No newline at end of file
+        pass
+
+    """
+    Comprueba que los listados paginados por compañía usan su índice ix_<tabla>_company_created.
+    Siembra datos de prueba dentro de una transacción, ejecuta EXPLAIN sobre cada consulta
+    y deshace todo al terminar. Sale con código 1 si algún plan no usa ese índice:
+    $ flask check-query-plans --rows 2000
+    """
+    @app.cli.command("check-query-plans")
+    @click.option("--rows", default=2000, help="Filas sembradas por tabla")
+    def check_query_plans(rows):
+        dialect = db.engine.dialect.name
+        failures = []
+
+        try:
+            company_id = _seed_plan_check_data(rows)
+
+            if dialect == 'postgresql':
+                # Con pocas filas sembradas el planificador podría preferir un Seq Scan aunque el índice sirva
+                db.session.execute(text("SET LOCAL enable_seqscan = off"))
+
+            cursor = (datetime.utcnow() - timedelta(days=1), rows // 2)
+            for model in (Address, Client, Partner, Vehicle, User):
+                for label, page_cursor in (("primera página", None), ("con cursor", cursor)):
+                    stmt = keyset_select(model, model.public_fields, company_id, page_cursor)
+                    plan = _explain(stmt, dialect)
+                    if not _uses_index(plan, f"ix_{model.__tablename__}_company_created"):
+                        failures.append(model.__tablename__)
+                        click.echo(f"FALLO {model.__tablename__} ({label}):")
+                        for line in plan:
+                            click.echo(f"    {line}")
+                    else:
+                        click.echo(f"OK    {model.__tablename__} ({label})")
+        finally:
+            db.session.rollback()
+
+        if failures:
+            raise SystemExit(1)
+        click.echo("Todas las consultas de listado usan su índice por compañía")
+
+    """
+    Compara serialize() + jsonify con los encoders compilados + orjson para cada modelo:
+    $ flask bench-serializers --rows 10000 --repeat 5
+    """
+    @app.cli.command("bench-serializers")
+    @click.option("--rows", default=10000, help="Filas por modelo")
+    @click.option("--repeat", default=5, help="Repeticiones (se toma la mejor)")
+    def bench_serializers(rows, repeat):
+        click.echo(f"Codificador JSON: {'orjson' if orjson else 'json (librería estándar)'}")
+        click.echo(f"{'modelo':<10} {'serialize+jsonify':>18} {'encoder+orjson':>16} {'mejora':>8}")
+
+        for model in (Address, Client, Partner, Vehicle, User):
+            instances = _bench_instances(model, rows)
+            fields = model.public_fields
+            tuples = [tuple(getattr(instance, field) for field in fields) for instance in instances]
+            encode_rows = row_encoder(model, fields)
+
+            with app.test_request_context():
+                baseline = _best_of(repeat, lambda: jsonify([instance.serialize() for instance in instances]).get_data())
+                compiled = _best_of(repeat, lambda: json_response(encode_rows(tuples)).get_data())
+
+            click.echo(f"{model.__tablename__:<10} {baseline * 1000:>15.1f} ms {compiled * 1000:>13.1f} ms {baseline / compiled:>7.1f}x")
+
+    """
+    Mide cuántas verificaciones de contraseña por segundo hace un núcleo con cada coste,
+    para elegir PASSWORD_HASH_METHOD según los picos de inicio de sesión:
+    $ flask bench-password-hashing --seconds 2
+    """
+    @app.cli.command("bench-password-hashing")
+    @click.option("--methods", default="pbkdf2:sha256:600000,pbkdf2:sha256:260000,pbkdf2:sha256:100000,scrypt:32768:8:1,scrypt:16384:8:1",
+                  help="Métodos de Werkzeug separados por comas")
+    @click.option("--seconds", default=2.0, help="Duración de la medida por método")
+    def bench_password_hashing(methods, seconds):
+        click.echo(f"{'método':<24} {'ms/verificación':>16} {'logins/s por núcleo':>20}")
+        for method in methods.split(','):
+            password_hash = generate_password_hash("contraseña-de-prueba", method=method)
+            count = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                check_password_hash(password_hash, "contraseña-de-prueba")
+                count += 1
+            elapsed = time.perf_counter() - start
+            click.echo(f"{method:<24} {elapsed * 1000 / count:>16.1f} {count / elapsed:>20.1f}")
+
+    # Borra los tokens de recuperación de contraseña caducados en lotes (uno por transacción)
+    # para no bloquear la tabla. Pensado para ejecutarse periódicamente: $ flask purge-reset-tokens
+    @app.cli.command("purge-reset-tokens")
+    @click.option("--batch-size", default=1000, help="Tokens borrados por transacción")
+    def purge_reset_tokens(batch_size):
+        table = PasswordResetToken.__table__
+        now = datetime.utcnow()
+        total = 0
+        while True:
+            # Los ids caducados se obtienen por el índice de expires_at
+            ids = db.session.execute(
+                db.select(table.c.id).where(table.c.expires_at < now).order_by(table.c.expires_at).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            db.session.execute(table.delete().where(table.c.id.in_(ids)))
+            db.session.commit()
+            total += len(ids)
+        click.echo(f"Tokens de recuperación eliminados: {total}")
+
+    # Geocodifica en lotes las direcciones pendientes (nuevas, importadas o con la dirección cambiada)
+    # $ flask geocode-addresses --retry-not-found  vuelve a intentar las que no se encontraron
+    @app.cli.command("geocode-addresses")
+    @click.option("--batch-size", default=GEOCODE_BATCH_SIZE, help="Direcciones por lote")
+    @click.option("--retry-not-found", is_flag=True, help="Reintentar las direcciones no encontradas")
+    def geocode_addresses(batch_size, retry_not_found):
+        if retry_not_found:
+            click.echo(f"Direcciones no encontradas puestas en cola de nuevo: {requeue_not_found()}")
+        start = time.perf_counter()
+        report = geocode_pending(batch_size)
+        click.echo(f"Procesadas: {report['processed']}  encontradas: {report['found']}  "
+                   f"no encontradas: {report['not_found']}  ({time.perf_counter() - start:.1f} s)")
+
+    """
+    Compara los endpoints de lectura servidos con el despliegue actual (gunicorn con workers síncronos)
+    y con el servidor ASGI (uvicorn + engine asíncrono, src/asgi.py) sobre la misma base de datos.
+    Arranca cada servidor en un puerto local, abre `concurrency` conexiones que piden la ruta en bucle
+    durante `seconds` segundos y muestra peticiones/s, latencias y errores. Sin --path siembra una
+    compañía temporal (la borra al terminar) y mide /api/addresses:
+    $ flask bench-read-path --concurrency 10,50,200 --seconds 10 --workers 2
+    """
+    @app.cli.command("bench-read-path")
+    @click.option("--path", default=None, help="Ruta a medir, con su query string")
+    @click.option("--rows", default=2000, help="Filas sembradas por tabla si no se indica --path")
+    @click.option("--concurrency", default="10,50,200", help="Conexiones simultáneas separadas por comas")
+    @click.option("--seconds", default=10.0, help="Duración de cada medida")
+    @click.option("--workers", default=2, help="Procesos de cada servidor")
+    @click.option("--cache/--no-cache", default=False, help="Usar la caché de lecturas en los servidores")
+    def bench_read_path(path, rows, concurrency, seconds, workers, cache):
+        company_id = None
+        if path is None:
+            company_id = _seed_plan_check_data(rows)
+            db.session.commit()
+            path = f"/api/addresses?company_id={company_id}&limit=50"
+
+        env = dict(os.environ)
+        if not cache:
+            env['CACHE_BACKEND'] = 'none'
+        try:
+            click.echo(f"{path}  ({workers} procesos por servidor, {seconds:g} s por medida)")
+            click.echo(f"{'servidor':<22} {'conexiones':>10} {'peticiones/s':>13} {'p50 ms':>9} {'p95 ms':>9} {'errores':>8}")
+            for name, command in _bench_servers(workers):
+                with _bench_server(command, path, env) as port:
+                    for connections in [int(value) for value in concurrency.split(',')]:
+                        stats = asyncio.run(_bench_load(port, path, connections, seconds))
+                        click.echo(f"{name:<22} {connections:>10} {stats['rps']:>13.1f} {stats['p50_ms']:>9.1f} "
+                                   f"{stats['p95_ms']:>9.1f} {stats['errors']:>8}")
+        finally:
+            if company_id is not None:
+                _delete_company_data(company_id)
+
+    # Worker de trabajos en segundo plano: un pool de hilos que ejecuta los trabajos de /api/jobs
+    # Se pueden arrancar varios (en varias máquinas): la toma de trabajos es atómica. Con SIGTERM o
+    # Ctrl+C deja de tomar trabajos, espera a los que están en curso y devuelve el resto a la cola
+    @app.cli.command("run-jobs")
+    @click.option("--workers", default=JOB_WORKERS, help="Hilos que ejecutan trabajos")
+    @click.option("--shutdown-timeout", default=30, help="Segundos de espera a los trabajos en curso al parar")
+    def run_jobs(workers, shutdown_timeout):
+        report = recover_stale_jobs()
+        click.echo(f"Trabajos abandonados recuperados: {report}")
+
+        runner = JobRunner(app, workers)
+        signal.signal(signal.SIGTERM, lambda signum, frame: runner.stopping.set())
+        runner.start()
+        click.echo(f"Worker {runner.worker_id} con {workers} hilos")
+        try:
+            while not runner.stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        released = runner.stop(shutdown_timeout)
+        click.echo(f"Worker detenido. Trabajos devueltos a la cola: {released}")
+
+
+# Inserta una compañía temporal con `rows` filas en cada tabla de listado
+def _seed_plan_check_data(rows):
+    suffix = uuid.uuid4().hex[:8]
+    company = Company(name=f"plan-check-{suffix}", created_at=datetime.utcnow())
+    db.session.add(company)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    stamps = [now - timedelta(minutes=i) for i in range(rows)]
+    db.session.execute(Address.__table__.insert(), [
+        {"name": f"Dirección {i}", "address": f"Calle {i}", "category": "cliente", "company_id": company.id, "created_at": stamp}
+        for i, stamp in enumerate(stamps)])
+    db.session.execute(Client.__table__.insert(), [
+        {"first_name": f"Cliente {i}", "last_name": "Prueba", "nif": f"{suffix}{i}", "company_id": company.id, "created_at": stamp}
+        for i, stamp in enumerate(stamps)])
+    db.session.execute(Partner.__table__.insert(), [
+        {"name": f"Socio {i}", "email": f"socio{i}-{suffix}@test.com", "price_type": "km", "price": 1.0,
+         "waiting_periods": 0, "include_tolls": False, "company_id": company.id, "created_at": stamp}
+        for i, stamp in enumerate(stamps)])
+    db.session.execute(Vehicle.__table__.insert(), [
+        {"name": f"Vehículo {i}", "plate": f"{suffix}-{i}", "company_id": company.id, "created_at": stamp}
+        for i, stamp in enumerate(stamps)])
+    db.session.execute(User.__table__.insert(), [
+        {"email": f"user{i}-{suffix}@test.com", "password_hash": "-", "name": "Usuario", "last_name": "Prueba",
+         "company_id": company.id, "created_at": stamp}
+        for i, stamp in enumerate(stamps)])
+    return company.id
+
+
+# Devuelve el plan de ejecución como una lista de líneas de texto
+def _explain(stmt, dialect):
+    compiled = stmt.compile(dialect=db.engine.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    connection = db.session.connection()
+    if dialect == 'sqlite':
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(f"EXPLAIN {compiled}", params).all()
+    return [row[0] for row in rows]
+
+
+# True si el plan recorre el índice indicado ("SEARCH ... USING INDEX ix_..." en SQLite,
+# "Index Scan using ix_..." en PostgreSQL). Cualquier otro índice no cuenta
+def _uses_index(plan, index_name):
+    pattern = re.compile(rf"(USING INDEX|using) {re.escape(index_name)}\b")
+    return any(pattern.search(line) for line in plan)
+
+
+def _best_of(repeat, func):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# Instancias en memoria (sin base de datos) con valores de ejemplo en todas las columnas
+def _bench_instances(model, rows):
+    now = datetime.utcnow()
+    instances = []
+    for i in range(rows):
+        instance = model.__mapper__.class_manager.new_instance()
+        for attribute in model.__mapper__.column_attrs:
+            python_type = attribute.columns[0].type.python_type
+            if python_type is datetime:
+                value = now - timedelta(seconds=i)
+            elif python_type is int:
+                value = i
+            elif python_type is float:
+                value = i * 0.5
+            elif python_type is bool:
+                value = bool(i % 2)
+            else:
+                value = f"{attribute.key}-{i}"
+            setattr(instance, attribute.key, value)
+        instances.append(instance)
+    return instances
+
+
+# Borra una compañía sembrada y todas sus filas
+def _delete_company_data(company_id):
+    for model in (Address, Client, Partner, Vehicle, User):
+        db.session.execute(model.__table__.delete().where(model.__table__.c.company_id == company_id))
+    db.session.execute(Company.__table__.delete().where(Company.__table__.c.id == company_id))
+    db.session.commit()
+
+
+# Servidores a comparar: el despliegue actual (Procfile) y el servidor ASGI
+def _bench_servers(workers):
+    return [
+        ("gunicorn (síncrono)", [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', SRC_DIR, '--workers', str(workers),
+                                 '--log-level', 'warning', '--bind']),
+        ("uvicorn (asíncrono)", [sys.executable, '-m', 'uvicorn', 'asgi:app', '--app-dir', SRC_DIR, '--workers', str(workers),
+                                 '--log-level', 'warning', '--no-access-log', '--host', '127.0.0.1', '--port']),
+    ]
+
+
+# Arranca el servidor en un puerto libre (se añade al final del comando) y espera a que responda
+@contextmanager
+def _bench_server(command, path, env, timeout=30):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    address = f"127.0.0.1:{port}" if '--bind' in command else str(port)
+    process = subprocess.Popen(command + [address], env=env)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise click.ClickException(f"El servidor terminó al arrancar: {' '.join(command)}")
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                connection.request('GET', path)
+                connection.getresponse().read()
+                connection.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise click.ClickException(f"El servidor no respondió en {timeout} s: {' '.join(command)}")
+                time.sleep(0.2)
+        yield port
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# Una conexión HTTP/1.1 que repite la petición hasta `deadline`. Si el servidor cierra la conexión
+# después de cada respuesta (los workers síncronos de gunicorn no mantienen keep-alive) se vuelve a abrir
+async def _bench_connection(port, request, deadline, latencies, errors):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            await reader.readexactly(int(headers.get('content-length', 0)))
+        except (OSError, IndexError, ValueError, asyncio.IncompleteReadError):
+            errors.append(1)
+            writer = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(1)
+        if headers.get('connection', '').lower() == 'close':
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _bench_load(port, path, connections, seconds):
+    request = f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nAccept: application/json\r\n\r\n".encode()
+    latencies, errors = [], []
+    started = time.perf_counter()
+    await asyncio.gather(*[_bench_connection(port, request, started + seconds, latencies, errors) for _ in range(connections)])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {'rps': len(latencies) / elapsed, 'p50_ms': _percentile_ms(latencies, 0.5),
+            'p95_ms': _percentile_ms(latencies, 0.95), 'errors': len(errors)}
+
+
+def _percentile_ms(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)] * 1000
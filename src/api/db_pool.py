@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ''):
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Opciones del engine de SQLAlchemy a partir de variables de entorno:
+#   DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+#   DB_POOL_PRE_PING y DB_STATEMENT_TIMEOUT_MS (0 desactiva el límite)
+def build_engine_options(database_uri):
+    options = {
+        # Comprueba la conexión antes de usarla: evita los errores tras un periodo de inactividad
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+    }
+
+    # SQLite no usa QueuePool, así que no admite tamaño ni desbordamiento
+    if database_uri.startswith('sqlite'):
+        return options
+
+    options.update({
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        # Recicla conexiones antes de que el servidor las cierre por inactividad
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+    })
+
+    statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if statement_timeout and database_uri.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+
+    return options
+
+
+# URL del engine asíncrono (servidor ASGI): el mismo DATABASE_URL con el driver asyncpg o aiosqlite
+# asyncpg no entiende sslmode (libpq): se pasa como su parámetro equivalente ssl
+def async_database_uri(database_uri):
+    url = make_url(database_uri.replace('postgres://', 'postgresql://', 1))
+    if url.get_backend_name() == 'sqlite':
+        return url.set(drivername='sqlite+aiosqlite')
+
+    query = dict(url.query)
+    if 'sslmode' in query:
+        query['ssl'] = query.pop('sslmode')
+    return url.set(drivername='postgresql+asyncpg', query=query)
+
+
+# Opciones del engine asíncrono con las mismas variables de entorno que el síncrono
+# El pool es AsyncAdaptedQueuePool (también con aiosqlite: con el NullPool por defecto cada petición
+# abriría una conexión y su hilo) y asyncpg recibe el statement timeout como server_settings
+def build_async_engine_options(database_uri):
+    options = build_engine_options(database_uri)
+    options.pop('poolclass', None)
+    if database_uri.startswith('sqlite') and ':memory:' not in database_uri:
+        options['poolclass'] = AsyncAdaptedQueuePool
+    if 'connect_args' in options:
+        statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(statement_timeout)}}
+    return options
+
+
+# Estadísticas de espera al pedir una conexión al pool
+class PoolWaitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_total_ms': round(self.total_wait * 1000, 3),
+                'wait_avg_ms': round(self.total_wait * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.max_wait * 1000, 3),
+            }
+
+
+# QueuePool que mide cuánto tiempo espera cada checkout hasta obtener una conexión
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.wait_stats.record(time.perf_counter() - start, timed_out)
+
+    # engine.dispose() recrea el pool: se conservan las estadísticas acumuladas
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+
+# Estado actual del pool del engine (por proceso). `engine_options` son las de build_engine_options:
+# el máximo de desbordamiento configurado sale de ahí (QueuePool no lo expone)
+def pool_status(engine, engine_options):
+    pool = engine.pool
+    status = {'pool': type(pool).__name__, 'pid': os.getpid()}
+
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            # overflow() es negativo mientras no se han abierto todas las conexiones base
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': engine_options.get('max_overflow'),
+            'timeout_s': pool.timeout(),
+        })
+
+    if isinstance(pool, InstrumentedQueuePool):
+        status.update(pool.wait_stats.snapshot())
+
+    return status
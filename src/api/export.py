@@ -0,0 +1,31 @@
+from api.models import db, Address, Client, Partner, User, Vehicle
+from api.serializers import dumps, row_encoder
+
+# Colecciones incluidas en la exportación de una compañía, en orden de salida
+EXPORT_COLLECTIONS = (
+    ('addresses', Address),
+    ('clients', Client),
+    ('vehicles', Vehicle),
+    ('partners', Partner),
+    ('users', User),
+)
+
+# Filas que se leen de cada vez del cursor del servidor durante la exportación
+EXPORT_BATCH_SIZE = 1000
+
+
+# Filas de una colección de la compañía como líneas NDJSON ({"type": collection, "data": {...}})
+# Sólo se leen las columnas públicas, con un cursor del lado del servidor: cada lote de
+# EXPORT_BATCH_SIZE filas sale como un bloque de bytes y la memoria no crece con la compañía
+def export_chunks(collection, model, company_id):
+    fields = model.public_fields
+    encode_rows = row_encoder(model, fields)
+    stmt = (
+        db.select(*[getattr(model, field) for field in fields])
+        .where(model.company_id == company_id)
+        .order_by(model.id)
+        .execution_options(stream_results=True)
+    )
+    result = db.session.execute(stmt).yield_per(EXPORT_BATCH_SIZE)
+    for partition in result.partitions():
+        yield b"".join(dumps({"type": collection, "data": item}) + b"\n" for item in encode_rows(partition))
@@ -0,0 +1,78 @@
+import os
+import numpy as np
+from api.utils import APIException
+
+# Radio medio de la Tierra en km
+EARTH_RADIUS_KM = 6371.0088
+
+# La distancia por carretera es mayor que la distancia en línea recta: se multiplica por este factor
+# (circuidad). La duración se estima con una velocidad media
+CIRCUITY_FACTOR = float(os.getenv('ROUTE_CIRCUITY_FACTOR', 1.3))
+AVERAGE_SPEED_KMH = float(os.getenv('ROUTE_AVERAGE_SPEED_KMH', 70))
+
+# Máximo de puntos por lado de la matriz (1000 x 1000 = 4 MB en float32)
+MAX_MATRIX_POINTS = 1000
+
+
+# Distancias en línea recta (km) entre todos los orígenes y destinos, en float32
+# `origins` y `destinations` son arrays (N, 2) y (M, 2) de [latitud, longitud] en grados
+def haversine_matrix(origins, destinations):
+    origins = np.radians(np.asarray(origins, dtype=np.float32))
+    destinations = np.radians(np.asarray(destinations, dtype=np.float32))
+
+    lat1, lng1 = origins[:, 0:1], origins[:, 1:2]
+    lat2, lng2 = destinations[:, 0], destinations[:, 1]
+
+    # Fórmula del semiverseno con broadcasting: (N, 1) contra (M,) -> (N, M)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))).astype(np.float32)
+
+
+# Matrices de distancia por carretera (km) y duración (horas) estimadas
+def distance_matrix(origins, destinations=None, circuity_factor=CIRCUITY_FACTOR, average_speed_kmh=AVERAGE_SPEED_KMH):
+    if destinations is None:
+        destinations = origins
+    distances = haversine_matrix(origins, destinations) * np.float32(circuity_factor)
+    durations = distances / np.float32(average_speed_kmh)
+    return distances, durations
+
+
+# Valida una lista de coordenadas: [[lat, lng], ...] o [{"lat": ..., "lng": ...}, ...]
+def parse_points(raw_points, name):
+    if not isinstance(raw_points, list) or not raw_points:
+        raise APIException(f"'{name}' debe ser una lista de coordenadas no vacía.", status_code=400)
+    if len(raw_points) > MAX_MATRIX_POINTS:
+        raise APIException(f"'{name}' admite como máximo {MAX_MATRIX_POINTS} puntos.", status_code=400)
+
+    points = []
+    for index, point in enumerate(raw_points):
+        if isinstance(point, dict):
+            point = [point.get('lat'), point.get('lng')]
+        if not isinstance(point, list) or len(point) != 2 or \
+                not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in point):
+            raise APIException(f"{name}[{index}]: se esperaba [lat, lng] o {{\"lat\": ..., \"lng\": ...}}.", status_code=400)
+        lat, lng = point
+        if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+            raise APIException(f"{name}[{index}]: coordenadas fuera de rango.", status_code=400)
+        points.append((lat, lng))
+    return np.array(points, dtype=np.float32)
+
+
+def parse_positive(data, key, default):
+    value = data.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value < float('inf'):
+        raise APIException(f"'{key}' debe ser un número mayor que cero.", status_code=400)
+    return float(value)
+
+
+# `name` identifica el elemento en los mensajes de error
+def parse_non_negative(data, key, default, name):
+    value = data.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value < float('inf'):
+        raise APIException(f"{name}: '{key}' debe ser un número mayor o igual que cero.", status_code=400)
+    return float(value)
+
+
+# Redondea una matriz float32 para la respuesta JSON (sin el ruido de la conversión a float64)
+def matrix_to_list(matrix, decimals=3):
+    return np.round(matrix.astype(np.float64), decimals).tolist()
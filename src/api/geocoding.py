@@ -0,0 +1,364 @@
+import csv
+import os
+import re
+import unicodedata
+import numpy as np
+from sqlalchemy import bindparam
+from api.models import db, Address, GeocodeCache
+from api.bulk import dialect_insert
+from api.versioning import bump_collection_version
+from api.geo import MAX_MATRIX_POINTS
+from api.utils import APIException
+
+# Estados de Address.geocode_status que no son una precisión
+GEOCODE_PENDING = 'pending'
+GEOCODE_NOT_FOUND = 'not_found'
+
+# Proveedores que se prueban en orden (GEOCODER_PROVIDERS) y ficheros CSV opcionales que amplían
+# los datos incluidos: GEOCODER_GAZETTEER_PATH (name,latitude,longitude,province_code)
+# y GEOCODER_POSTAL_CODES_PATH (postal_code,latitude,longitude; códigos de 5 dígitos o prefijos de 2)
+GEOCODER_PROVIDERS = os.getenv('GEOCODER_PROVIDERS', 'gazetteer,postal_code')
+GEOCODER_GAZETTEER_PATH = os.getenv('GEOCODER_GAZETTEER_PATH')
+GEOCODER_POSTAL_CODES_PATH = os.getenv('GEOCODER_POSTAL_CODES_PATH')
+
+GEOCODE_BATCH_SIZE = 500
+
+
+# Capitales de provincia por código postal (los dos primeros dígitos del código son la provincia)
+PROVINCE_CAPITALS = {
+    '01': (42.8467, -2.6716), '02': (38.9943, -1.8585), '03': (38.3452, -0.4810), '04': (36.8340, -2.4637),
+    '05': (40.6565, -4.6818), '06': (38.8794, -6.9707), '07': (39.5696, 2.6502), '08': (41.3874, 2.1686),
+    '09': (42.3439, -3.6969), '10': (39.4753, -6.3724), '11': (36.5271, -6.2886), '12': (39.9864, -0.0513),
+    '13': (38.9848, -3.9274), '14': (37.8882, -4.7794), '15': (43.3623, -8.4115), '16': (40.0704, -2.1374),
+    '17': (41.9794, 2.8214), '18': (37.1773, -3.5986), '19': (40.6333, -3.1667), '20': (43.3183, -1.9812),
+    '21': (37.2614, -6.9447), '22': (42.1401, -0.4089), '23': (37.7796, -3.7849), '24': (42.5987, -5.5671),
+    '25': (41.6176, 0.6200), '26': (42.4627, -2.4449), '27': (43.0097, -7.5568), '28': (40.4168, -3.7038),
+    '29': (36.7213, -4.4214), '30': (37.9922, -1.1307), '31': (42.8125, -1.6458), '32': (42.3358, -7.8639),
+    '33': (43.3614, -5.8493), '34': (42.0095, -4.5288), '35': (28.1235, -15.4363), '36': (42.4310, -8.6444),
+    '37': (40.9701, -5.6635), '38': (28.4636, -16.2518), '39': (43.4623, -3.8099), '40': (40.9429, -4.1088),
+    '41': (37.3891, -5.9845), '42': (41.7640, -2.4688), '43': (41.1189, 1.2445), '44': (40.3456, -1.1065),
+    '45': (39.8628, -4.0273), '46': (39.4699, -0.3763), '47': (41.6523, -4.7245), '48': (43.2630, -2.9350),
+    '49': (41.5033, -5.7446), '50': (41.6488, -0.8891), '51': (35.8894, -5.3213), '52': (35.2923, -2.9381),
+}
+
+# Municipios: nombre normalizado -> (latitud, longitud, provincia)
+SPANISH_CITIES = {
+    'vitoria': (42.8467, -2.6716, '01'), 'vitoria gasteiz': (42.8467, -2.6716, '01'), 'gasteiz': (42.8467, -2.6716, '01'),
+    'albacete': (38.9943, -1.8585, '02'),
+    'alicante': (38.3452, -0.4810, '03'), 'alacant': (38.3452, -0.4810, '03'), 'elche': (38.2699, -0.6983, '03'),
+    'elx': (38.2699, -0.6983, '03'), 'torrevieja': (37.9787, -0.6822, '03'), 'benidorm': (38.5411, -0.1225, '03'),
+    'almeria': (36.8340, -2.4637, '04'), 'el ejido': (36.7763, -2.8146, '04'), 'roquetas de mar': (36.7642, -2.6147, '04'),
+    'avila': (40.6565, -4.6818, '05'),
+    'badajoz': (38.8794, -6.9707, '06'), 'merida': (38.9161, -6.3437, '06'),
+    'palma': (39.5696, 2.6502, '07'), 'palma de mallorca': (39.5696, 2.6502, '07'), 'ibiza': (38.9067, 1.4206, '07'),
+    'eivissa': (38.9067, 1.4206, '07'), 'mahon': (39.8885, 4.2658, '07'), 'mao': (39.8885, 4.2658, '07'),
+    'manacor': (39.5696, 3.2096, '07'), 'inca': (39.7210, 2.9110, '07'),
+    'barcelona': (41.3874, 2.1686, '08'), 'l hospitalet de llobregat': (41.3597, 2.0998, '08'),
+    'hospitalet de llobregat': (41.3597, 2.0998, '08'), 'badalona': (41.4500, 2.2474, '08'),
+    'terrassa': (41.5610, 2.0089, '08'), 'sabadell': (41.5433, 2.1094, '08'), 'mataro': (41.5381, 2.4445, '08'),
+    'el prat de llobregat': (41.3266, 2.0950, '08'), 'granollers': (41.6083, 2.2870, '08'), 'rubi': (41.4933, 2.0327, '08'),
+    'manresa': (41.7251, 1.8266, '08'), 'vilanova i la geltru': (41.2242, 1.7256, '08'), 'castelldefels': (41.2800, 1.9767, '08'),
+    'sant cugat del valles': (41.4722, 2.0864, '08'), 'cornella de llobregat': (41.3550, 2.0701, '08'), 'vic': (41.9301, 2.2549, '08'),
+    'burgos': (42.3439, -3.6969, '09'), 'miranda de ebro': (42.6865, -2.9470, '09'), 'aranda de duero': (41.6704, -3.6892, '09'),
+    'caceres': (39.4753, -6.3724, '10'), 'plasencia': (40.0302, -6.0906, '10'),
+    'cadiz': (36.5271, -6.2886, '11'), 'jerez de la frontera': (36.6850, -6.1261, '11'), 'algeciras': (36.1408, -5.4562, '11'),
+    'la linea de la concepcion': (36.1681, -5.3478, '11'), 'san fernando': (36.4759, -6.1981, '11'),
+    'el puerto de santa maria': (36.5939, -6.2330, '11'), 'chiclana de la frontera': (36.4193, -6.1467, '11'),
+    'sanlucar de barrameda': (36.7781, -6.3515, '11'),
+    'castellon': (39.9864, -0.0513, '12'), 'castellon de la plana': (39.9864, -0.0513, '12'), 'castello de la plana': (39.9864, -0.0513, '12'),
+    'ciudad real': (38.9848, -3.9274, '13'), 'puertollano': (38.6871, -4.1073, '13'),
+    'cordoba': (37.8882, -4.7794, '14'),
+    'a coruna': (43.3623, -8.4115, '15'), 'la coruna': (43.3623, -8.4115, '15'), 'santiago de compostela': (42.8782, -8.5448, '15'),
+    'ferrol': (43.4832, -8.2369, '15'),
+    'cuenca': (40.0704, -2.1374, '16'),
+    'girona': (41.9794, 2.8214, '17'), 'gerona': (41.9794, 2.8214, '17'), 'figueres': (42.2665, 2.9617, '17'),
+    'granada': (37.1773, -3.5986, '18'), 'motril': (36.7450, -3.5170, '18'),
+    'guadalajara': (40.6333, -3.1667, '19'),
+    'san sebastian': (43.3183, -1.9812, '20'), 'donostia': (43.3183, -1.9812, '20'), 'irun': (43.3390, -1.7896, '20'),
+    'huelva': (37.2614, -6.9447, '21'),
+    'huesca': (42.1401, -0.4089, '22'),
+    'jaen': (37.7796, -3.7849, '23'), 'linares': (38.0951, -3.6360, '23'),
+    'leon': (42.5987, -5.5671, '24'), 'ponferrada': (42.5499, -6.5980, '24'),
+    'lleida': (41.6176, 0.6200, '25'), 'lerida': (41.6176, 0.6200, '25'),
+    'logrono': (42.4627, -2.4449, '26'), 'calahorra': (42.3050, -1.9653, '26'),
+    'lugo': (43.0097, -7.5568, '27'),
+    'madrid': (40.4168, -3.7038, '28'), 'mostoles': (40.3223, -3.8650, '28'), 'alcala de henares': (40.4818, -3.3636, '28'),
+    'fuenlabrada': (40.2842, -3.7942, '28'), 'leganes': (40.3272, -3.7635, '28'), 'getafe': (40.3057, -3.7329, '28'),
+    'alcorcon': (40.3458, -3.8249, '28'), 'torrejon de ardoz': (40.4597, -3.4800, '28'), 'parla': (40.2360, -3.7675, '28'),
+    'coslada': (40.4238, -3.5613, '28'), 'san fernando de henares': (40.4254, -3.5352, '28'), 'valdemoro': (40.1908, -3.6742, '28'),
+    'aranjuez': (40.0311, -3.6025, '28'), 'arganda del rey': (40.3008, -3.4383, '28'), 'pinto': (40.2415, -3.6999, '28'),
+    'alcobendas': (40.5475, -3.6420, '28'), 'san sebastian de los reyes': (40.5474, -3.6261, '28'), 'las rozas': (40.4929, -3.8737, '28'),
+    'pozuelo de alarcon': (40.4350, -3.8136, '28'), 'majadahonda': (40.4731, -3.8719, '28'),
+    'malaga': (36.7213, -4.4214, '29'), 'marbella': (36.5101, -4.8825, '29'),
+    'murcia': (37.9922, -1.1307, '30'), 'cartagena': (37.6257, -0.9966, '30'), 'lorca': (37.6771, -1.7006, '30'),
+    'molina de segura': (38.0548, -1.2076, '30'),
+    'pamplona': (42.8125, -1.6458, '31'), 'iruna': (42.8125, -1.6458, '31'), 'tudela': (42.0617, -1.6067, '31'),
+    'ourense': (42.3358, -7.8639, '32'), 'orense': (42.3358, -7.8639, '32'),
+    'oviedo': (43.3614, -5.8493, '33'), 'gijon': (43.5322, -5.6611, '33'), 'aviles': (43.5547, -5.9248, '33'),
+    'palencia': (42.0095, -4.5288, '34'),
+    'las palmas de gran canaria': (28.1235, -15.4363, '35'), 'telde': (27.9924, -15.4192, '35'),
+    'arrecife': (28.9630, -13.5477, '35'), 'puerto del rosario': (28.5004, -13.8627, '35'),
+    'pontevedra': (42.4310, -8.6444, '36'), 'vigo': (42.2406, -8.7207, '36'),
+    'salamanca': (40.9701, -5.6635, '37'),
+    'santa cruz de tenerife': (28.4636, -16.2518, '38'), 'san cristobal de la laguna': (28.4874, -16.3159, '38'),
+    'la laguna': (28.4874, -16.3159, '38'),
+    'santander': (43.4623, -3.8099, '39'), 'torrelavega': (43.3494, -4.0479, '39'),
+    'segovia': (40.9429, -4.1088, '40'),
+    'sevilla': (37.3891, -5.9845, '41'), 'dos hermanas': (37.2836, -5.9209, '41'),
+    'soria': (41.7640, -2.4688, '42'),
+    'tarragona': (41.1189, 1.2445, '43'), 'reus': (41.1561, 1.1069, '43'), 'tortosa': (40.8125, 0.5216, '43'),
+    'teruel': (40.3456, -1.1065, '44'),
+    'toledo': (39.8628, -4.0273, '45'), 'talavera de la reina': (39.9635, -4.8308, '45'),
+    'valencia': (39.4699, -0.3763, '46'), 'gandia': (38.9680, -0.1819, '46'), 'sagunto': (39.6800, -0.2733, '46'),
+    'sagunt': (39.6800, -0.2733, '46'), 'paterna': (39.5028, -0.4406, '46'),
+    'valladolid': (41.6523, -4.7245, '47'),
+    'bilbao': (43.2630, -2.9350, '48'), 'getxo': (43.3569, -3.0110, '48'), 'barakaldo': (43.2956, -2.9973, '48'),
+    'zamora': (41.5033, -5.7446, '49'),
+    'zaragoza': (41.6488, -0.8891, '50'),
+    'ceuta': (35.8894, -5.3213, '51'),
+    'melilla': (35.2923, -2.9381, '52'),
+}
+
+# Provincias, comunidades e islas: se usan sólo si no aparece ningún municipio conocido
+SPANISH_REGIONS = {
+    'alava': '01', 'araba': '01', 'asturias': '33', 'baleares': '07', 'illes balears': '07', 'mallorca': '07',
+    'bizkaia': '48', 'vizcaya': '48', 'gipuzkoa': '20', 'guipuzcoa': '20', 'cantabria': '39', 'navarra': '31',
+    'la rioja': '26', 'gran canaria': '35', 'tenerife': '38',
+}
+
+POSTAL_CODE_PATTERN = re.compile(r'\b(\d{5})\b')
+
+
+# Normaliza una dirección para la caché: minúsculas, sin tildes ni signos y con espacios simples
+def normalize_address(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())[:200]
+
+
+def _postal_code(normalized):
+    codes = POSTAL_CODE_PATTERN.findall(normalized)
+    # El código postal suele ir al final de la dirección; se descartan prefijos de provincia inexistentes
+    for code in reversed(codes):
+        if code[:2] in PROVINCE_CAPITALS:
+            return code
+    return None
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        return list(csv.DictReader(file))
+
+
+# Resultado de un proveedor: (latitud, longitud, precisión) o None
+# Busca municipios del nomenclátor en la dirección, empezando por el final (la localidad suele ir
+# detrás de la calle). Si hay código postal, el municipio debe ser de esa provincia
+class GazetteerProvider:
+    name = 'gazetteer'
+
+    def __init__(self, extra_path=None):
+        self.cities = dict(SPANISH_CITIES)
+        if extra_path:
+            for row in _read_csv(extra_path):
+                self.cities[normalize_address(row['name'])] = (float(row['latitude']), float(row['longitude']), row.get('province_code') or None)
+        self.max_words = max(len(name.split()) for name in list(self.cities) + list(SPANISH_REGIONS))
+
+    def _candidates(self, words, places):
+        # n-gramas desde el final; a igual posición final, el nombre más largo primero
+        for end in range(len(words), 0, -1):
+            for size in range(min(self.max_words, end), 0, -1):
+                name = ' '.join(words[end - size:end])
+                if name in places:
+                    yield places[name]
+
+    def geocode(self, normalized):
+        words = normalized.split()
+        postal_code = _postal_code(normalized)
+        province = postal_code[:2] if postal_code else None
+
+        for lat, lng, city_province in self._candidates(words, self.cities):
+            if province is None or city_province in (None, province):
+                return lat, lng, 'city'
+
+        for region_province in self._candidates(words, SPANISH_REGIONS):
+            if province is None or region_province == province:
+                lat, lng = PROVINCE_CAPITALS[region_province]
+                return lat, lng, 'province'
+        return None
+
+
+# Centroides por código postal: el código completo si está en el CSV configurado y, si no,
+# la capital de la provincia (dos primeros dígitos)
+class PostalCodeProvider:
+    name = 'postal_code'
+
+    def __init__(self, extra_path=None):
+        self.centroids = {}
+        if extra_path:
+            for row in _read_csv(extra_path):
+                self.centroids[row['postal_code'].strip()] = (float(row['latitude']), float(row['longitude']))
+
+    def geocode(self, normalized):
+        postal_code = _postal_code(normalized)
+        if postal_code is None:
+            return None
+        if postal_code in self.centroids:
+            lat, lng = self.centroids[postal_code]
+            return lat, lng, 'postal_code'
+        lat, lng = self.centroids.get(postal_code[:2]) or PROVINCE_CAPITALS[postal_code[:2]]
+        return lat, lng, 'province'
+
+
+# Proveedores disponibles: para añadir uno (por ejemplo un servicio externo) basta con una clase
+# con `name` y `geocode(normalized)` registrada aquí
+PROVIDERS = {
+    'gazetteer': lambda: GazetteerProvider(GEOCODER_GAZETTEER_PATH),
+    'postal_code': lambda: PostalCodeProvider(GEOCODER_POSTAL_CODES_PATH),
+}
+
+
+# Prueba los proveedores en orden y devuelve el primer resultado
+class ChainGeocoder:
+    def __init__(self, providers):
+        self.providers = providers
+
+    def geocode(self, normalized):
+        for provider in self.providers:
+            result = provider.geocode(normalized)
+            if result is not None:
+                return result + (provider.name,)
+        return None
+
+
+def create_geocoder():
+    names = [name.strip() for name in GEOCODER_PROVIDERS.split(',') if name.strip()]
+    unknown = [name for name in names if name not in PROVIDERS]
+    if unknown:
+        raise ValueError(f"Proveedores de geocodificación desconocidos: {', '.join(unknown)}")
+    return ChainGeocoder([PROVIDERS[name]() for name in names])
+
+
+_geocoder = None
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = create_geocoder()
+    return _geocoder
+
+
+# Resuelve direcciones normalizadas: primero en la caché persistente (una consulta) y las que faltan
+# con los proveedores, guardando el resultado. Devuelve {normalizada: (lat, lng, precisión) | None}
+def resolve_addresses(normalized_addresses):
+    keys = sorted(set(normalized_addresses))
+    if not keys:
+        return {}
+
+    table = GeocodeCache.__table__
+    results = {}
+    for row in db.session.execute(
+            db.select(table.c.normalized_address, table.c.latitude, table.c.longitude, table.c.precision)
+            .where(table.c.normalized_address.in_(keys))):
+        results[row.normalized_address] = (row.latitude, row.longitude, row.precision) if row.precision else None
+
+    missing = [key for key in keys if key not in results]
+    if missing:
+        geocoder = get_geocoder()
+        entries = []
+        for key in missing:
+            result = geocoder.geocode(key) if key else None
+            results[key] = result[:3] if result else None
+            entries.append({
+                'normalized_address': key,
+                'latitude': result[0] if result else None,
+                'longitude': result[1] if result else None,
+                'precision': result[2] if result else None,
+                'provider': result[3] if result else None,
+            })
+        # Otro proceso puede haber guardado la misma dirección a la vez: se conserva la primera
+        db.session.execute(dialect_insert(table).on_conflict_do_nothing(index_elements=['normalized_address']), entries)
+    return results
+
+
+def _apply_result(values, result):
+    if result is None:
+        values.update(latitude=None, longitude=None, geocode_status=GEOCODE_NOT_FOUND)
+    else:
+        values.update(latitude=result[0], longitude=result[1], geocode_status=result[2])
+    return values
+
+
+# Geocodifica una dirección al crearla o editarla (sin red: caché y proveedores locales)
+# No hace commit: el resultado se guarda en la misma transacción que la dirección
+def geocode_address(address):
+    normalized = normalize_address(address.address)
+    values = _apply_result({}, resolve_addresses([normalized])[normalized])
+    for key, value in values.items():
+        setattr(address, key, value)
+
+
+# Geocodifica las direcciones pendientes en lotes (un commit por lote)
+# Devuelve {"processed": n, "found": n, "not_found": n}
+def geocode_pending(batch_size=GEOCODE_BATCH_SIZE):
+    table = Address.__table__
+    report = {"processed": 0, "found": 0, "not_found": 0}
+    update = table.update().where(table.c.id == bindparam('address_id')).values(
+        latitude=bindparam('latitude'), longitude=bindparam('longitude'), geocode_status=bindparam('geocode_status'))
+
+    while True:
+        rows = db.session.execute(
+            db.select(table.c.id, table.c.address, table.c.company_id)
+            .where(table.c.geocode_status == GEOCODE_PENDING)
+            .order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        normalized = {row.id: normalize_address(row.address) for row in rows}
+        results = resolve_addresses(normalized.values())
+
+        params = [_apply_result({'address_id': row.id}, results[normalized[row.id]]) for row in rows]
+        db.session.execute(update, params)
+
+        # Las coordenadas forman parte de los listados: se invalida la versión de cada compañía
+        for company_id in {row.company_id for row in rows}:
+            bump_collection_version(company_id, 'addresses')
+        db.session.commit()
+
+        found = sum(1 for values in params if values['geocode_status'] != GEOCODE_NOT_FOUND)
+        report["processed"] += len(rows)
+        report["found"] += found
+        report["not_found"] += len(rows) - found
+    return report
+
+
+# Vuelve a poner en cola las direcciones no encontradas y olvida los resultados negativos de la caché
+# (por ejemplo tras ampliar el nomenclátor o los códigos postales)
+def requeue_not_found():
+    GeocodeCache.query.filter(GeocodeCache.precision.is_(None)).delete(synchronize_session=False)
+    count = Address.query.filter_by(geocode_status=GEOCODE_NOT_FOUND).update(
+        {'geocode_status': GEOCODE_PENDING}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+# Coordenadas [lat, lng] de direcciones de la compañía, en el orden de `address_ids`
+def address_points(company_id, address_ids, name):
+    if not isinstance(address_ids, list) or not address_ids or \
+            not all(isinstance(value, int) and not isinstance(value, bool) for value in address_ids):
+        raise APIException(f"'{name}' debe ser una lista de identificadores de dirección.", status_code=400)
+    if len(address_ids) > MAX_MATRIX_POINTS:
+        raise APIException(f"'{name}' admite como máximo {MAX_MATRIX_POINTS} direcciones.", status_code=400)
+
+    table = Address.__table__
+    rows = db.session.execute(
+        db.select(table.c.id, table.c.latitude, table.c.longitude)
+        .where(table.c.company_id == company_id, table.c.id.in_(set(address_ids)))
+    ).all()
+    coordinates = {row.id: (row.latitude, row.longitude) for row in rows if row.latitude is not None}
+
+    missing = [address_id for address_id in address_ids if address_id not in coordinates]
+    if missing:
+        raise APIException(f"Direcciones no encontradas o sin geocodificar: {', '.join(map(str, missing[:20]))}", status_code=400)
+    return np.array([coordinates[address_id] for address_id in address_ids], dtype=np.float32)
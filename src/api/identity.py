@@ -0,0 +1,130 @@
+from datetime import datetime, timezone
+from flask import g, request
+from flask_jwt_extended import (create_access_token, get_jwt, get_jwt_identity, set_access_cookies,
+                                verify_jwt_in_request)
+from flask_jwt_extended.exceptions import JWTExtendedException
+import jwt
+from jwt.exceptions import InvalidTokenError, PyJWTError
+from api.models import db, User, Company
+from api.utils import APIException
+
+# Claims que llevan todos los tokens de acceso: permiten resolver el usuario y su compañía
+# sin consultar las tablas users ni companies
+IDENTITY_CLAIMS = ('company_id', 'company_name', 'name', 'last_name', 'email', 'location', 'created_at')
+
+
+def user_claims(user, company):
+    return {
+        'company_id': company.id,
+        'company_name': company.name,
+        'name': user.name,
+        'last_name': user.last_name,
+        'email': user.email,
+        'location': user.location,
+        'created_at': user.created_at.isoformat() if user.created_at else None,
+    }
+
+
+def create_user_token(user, company, expires_delta=None):
+    kwargs = {'expires_delta': expires_delta} if expires_delta is not None else {}
+    return create_access_token(identity=str(user.id), additional_claims=user_claims(user, company), **kwargs)
+
+
+# Identidad a partir de las claims del token; None si el token es antiguo y no las trae todas
+def claims_identity(claims):
+    if all(key in claims for key in IDENTITY_CLAIMS):
+        return {key: claims[key] for key in IDENTITY_CLAIMS}
+    return None
+
+
+# Datos del usuario que devuelve /api/users/me
+def public_profile(identity):
+    return {
+        "name": identity['name'],
+        "last_name": identity['last_name'],
+        "email": identity['email'],
+        "location": identity['location'],
+        "company": identity['company_name'],
+        "created_at": identity['created_at']
+    }
+
+
+# Claims del token de acceso de la cookie fuera de Flask (servidor ASGI). Hace las mismas comprobaciones
+# que flask_jwt_extended con la configuración de app.py: firma HS256, caducidad y tipo de token
+def decode_access_token(token, secret_key):
+    claims = jwt.decode(token, secret_key, algorithms=['HS256'])
+    if claims.get('type') != 'access':
+        raise InvalidTokenError("Only access tokens are allowed")
+    return claims
+
+
+# Identidad de la petición actual (requiere un JWT ya verificado). Se resuelve una vez por petición:
+# con las claims del token si están completas y, para tokens antiguos, leyendo la base de datos
+def current_identity():
+    if 'identity' in g:
+        return g.identity
+
+    user_id = int(get_jwt_identity())
+    identity = claims_identity(get_jwt())
+
+    if identity is None:
+        user = db.session.get(User, user_id)
+        if not user:
+            g.identity = None
+            return None
+        identity = user_claims(user, db.session.get(Company, user.company_id))
+
+    identity['user_id'] = user_id
+    g.identity = identity
+    return identity
+
+
+# Compañía de la petición a partir de la identidad del JWT (None sin token válido) y del ?company_id=
+# pedido. Con JWT manda siempre la compañía del token: pedir otra responde 403. Sin JWT sólo se acepta
+# ?company_id= en los endpoints que ya eran públicos (allow_query); el resto responde 401
+def company_for_request(identity, requested_company_id, allow_query=False):
+    if identity is None:
+        if allow_query:
+            return requested_company_id
+        raise APIException("Debe iniciar sesión para acceder a este recurso.", status_code=401)
+
+    if requested_company_id and requested_company_id != identity['company_id']:
+        raise APIException("No tiene permiso para acceder a los datos de otra compañía.", status_code=403)
+    return identity['company_id']
+
+
+# Identidad del JWT de la cookie si viene y es válido (None en otro caso)
+def optional_identity():
+    try:
+        if verify_jwt_in_request(optional=True, locations=['cookies']) is None:
+            return None
+    except (JWTExtendedException, PyJWTError):
+        return None
+    return current_identity()
+
+
+# company_id de la petición actual (ver company_for_request)
+def resolve_company_id(allow_query=False):
+    return company_for_request(optional_identity(), request.args.get('company_id', type=int), allow_query)
+
+
+# Vuelve a emitir el token de acceso con las claims actualizadas tras cambiar el perfil
+# Conserva la caducidad del token actual (por ejemplo la de "Recuérdame")
+def refresh_identity_cookie(response, user):
+    try:
+        if verify_jwt_in_request(optional=True, locations=['cookies']) is None:
+            return response
+    except (JWTExtendedException, PyJWTError):
+        return response
+
+    if get_jwt_identity() != str(user.id):
+        return response
+
+    expires_at = datetime.fromtimestamp(get_jwt()['exp'], tz=timezone.utc)
+    expires_delta = expires_at - datetime.now(timezone.utc)
+    if expires_delta.total_seconds() <= 0:
+        return response
+
+    company = db.session.get(Company, user.company_id)
+    set_access_cookies(response, create_user_token(user, company, expires_delta), max_age=int(expires_delta.total_seconds()))
+    return response
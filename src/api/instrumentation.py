@@ -0,0 +1,102 @@
+import json
+import logging
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Logger de métricas por petición: una línea JSON por petición
+logger = logging.getLogger('api.requests')
+
+
+def _configure_logger():
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# Cronometra cada sentencia SQL de cualquier engine y la suma a la petición en curso
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # La sentencia falló: after_cursor_execute no se ejecutará
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+
+# Escribe la línea de log de una petición. `metrics` es el g de la petición (con request_start,
+# sql_count y sql_time) y `fields` los datos de la petición y la respuesta
+def _log_request(fields, metrics, **extra):
+    total_ms = (time.perf_counter() - metrics.request_start) * 1000
+    logger.info(json.dumps({
+        'event': 'request',
+        **fields,
+        'sql_count': metrics.sql_count,
+        'db_ms': round(metrics.sql_time * 1000, 2),
+        'total_ms': round(total_ms, 2),
+        **extra,
+    }))
+
+
+# Registra las métricas por petición: número de consultas, tiempo en BD y tiempo total
+# Se devuelven en la cabecera Server-Timing y en una línea de log estructurada
+# En las respuestas en streaming (como la exportación de una compañía) las consultas del cuerpo se
+# ejecutan después de enviar las cabeceras: la cabecera sólo mide hasta ese momento y el log se
+# escribe al cerrar la respuesta, con todas las consultas
+def setup_request_metrics(app):
+    _configure_logger()
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_start = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+
+    @app.after_request
+    def emit_request_metrics(response):
+        if 'request_start' not in g:
+            return response
+
+        total_ms = (time.perf_counter() - g.request_start) * 1000
+        db_ms = g.sql_time * 1000
+        app_ms = max(total_ms - db_ms, 0.0)
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'blueprint': request.blueprint,
+            'endpoint': request.endpoint,
+        }
+
+        if response.is_streamed:
+            response.headers['Server-Timing'] = (
+                f'db;dur={db_ms:.2f};desc="{g.sql_count} consultas (parcial, sin el cuerpo)", '
+                f'headers;dur={total_ms:.2f}'
+            )
+            # El contexto de la petición ya no existe al cerrar: se conserva el objeto g
+            metrics = g._get_current_object()
+            response.call_on_close(lambda: _log_request(fields, metrics, streamed=True))
+            return response
+
+        response.headers['Server-Timing'] = (
+            f'db;dur={db_ms:.2f};desc="{g.sql_count} consultas", '
+            f'app;dur={app_ms:.2f}, total;dur={total_ms:.2f}'
+        )
+        _log_request(fields, g)
+        return response
@@ -0,0 +1,396 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import func, text
+from api.models import db, Job, JobResultChunk, Address
+from api.serializers import dumps, loads
+from api.versioning import bump_collection_version
+from api.bulk import clean_record, insert_in_batches, MAX_REPORTED_ERRORS
+from api.export import export_chunks, EXPORT_BATCH_SIZE
+from api.planning import optimize_stops, plan_fleet
+from api.quotes import parse_fuel_prices
+from api.quote_cache import cached_quotes
+from api.utils import APIException
+
+# Trabajos en segundo plano: las optimizaciones, importaciones y exportaciones que no caben en el
+# timeout de una petición se encolan en la tabla jobs y las ejecuta un pool de hilos local
+# (flask run-jobs). El estado vive en la base de datos: si un worker muere, sus trabajos se
+# detectan por falta de latidos y vuelven a la cola
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+# Hilos por worker, trabajos simultáneos por compañía y trabajos pendientes (en cola o en curso) por compañía
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_COMPANY_CONCURRENCY = int(os.getenv('JOB_COMPANY_CONCURRENCY', 1))
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', 20))
+
+# Intentos antes de darlo por fallido, segundos entre latidos y sin latidos para darlo por abandonado
+JOB_MAX_ATTEMPTS = 3
+JOB_HEARTBEAT_S = 10
+JOB_STALE_S = 60
+# Espera entre consultas a la cola cuando no hay trabajo
+JOB_POLL_S = 1.0
+
+# Presupuesto de tiempo máximo de las optimizaciones en segundo plano (en una petición es mucho menor)
+JOB_MAX_TIME_BUDGET_MS = 120000
+
+# Clave del bloqueo consultivo de PostgreSQL que serializa la toma de trabajos entre procesos
+JOBS_LOCK_KEY = 7301
+
+JOB_HANDLERS = {}
+
+# Tipos de trabajo cuyo resultado se guarda como NDJSON en job_result_chunks (job.result es sólo el resumen)
+NDJSON_RESULT_KINDS = {'addresses.export'}
+
+# Partes del resultado que se leen de cada vez al enviarlo
+RESULT_CHUNKS_PER_FETCH = 16
+
+
+# Registra la función que ejecuta un tipo de trabajo: handler(params, company_id, context) -> resultado
+def job_handler(kind):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# Guarda una parte del resultado en la transacción del handler: si el trabajo se cancela, falla o
+# lo toma otro worker, las partes se descartan con el resto de sus escrituras
+def save_result_chunk(job_id, seq, data):
+    db.session.execute(JobResultChunk.__table__.insert().values(job_id=job_id, seq=seq, data=data))
+
+
+# Partes del resultado en orden, leídas con un cursor del lado del servidor
+def result_chunks(job_id):
+    stmt = (
+        db.select(JobResultChunk.data)
+        .where(JobResultChunk.job_id == job_id)
+        .order_by(JobResultChunk.seq)
+        .execution_options(stream_results=True)
+    )
+    yield from db.session.execute(stmt).yield_per(RESULT_CHUNKS_PER_FETCH).scalars()
+
+
+# Lo que ve un handler de su trabajo. Las escrituras de estado van por una conexión aparte para
+# no confirmar a medias la transacción del handler
+class JobContext:
+    def __init__(self, job_id, company_id):
+        self.job_id = job_id
+        self.company_id = company_id
+        self._last_update = 0.0
+
+    # Guarda el progreso (0 a 1) como mucho cada medio segundo; también cuenta como latido
+    # Si se ha pedido cancelar, el handler termina aquí con JobCancelled
+    def progress(self, fraction):
+        now = time.monotonic()
+        if now - self._last_update < 0.5:
+            return
+        self._last_update = now
+        update = db.update(Job).where(Job.id == self.job_id) \
+            .values(progress=min(max(fraction, 0.0), 1.0), heartbeat_at=datetime.utcnow())
+        cancel_requested = db.select(Job.cancel_requested).where(Job.id == self.job_id)
+        if db.engine.dialect.name == 'sqlite':
+            # SQLite sólo admite un escritor: una segunda conexión esperaría a que el handler confirme
+            db.session.execute(update)
+            cancelled = db.session.execute(cancel_requested).scalar()
+        else:
+            with db.engine.begin() as connection:
+                connection.execute(update)
+                cancelled = connection.execute(cancel_requested).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+
+def submit_job(company_id, kind, params):
+    if kind not in JOB_HANDLERS:
+        raise APIException(f"Tipo de trabajo no válido. Tipos disponibles: {', '.join(sorted(JOB_HANDLERS))}", status_code=400)
+    if not isinstance(params, dict):
+        raise APIException("'params' debe ser un objeto JSON.", status_code=400)
+
+    pending = Job.query.filter(Job.company_id == company_id, Job.status.in_([JOB_QUEUED, JOB_RUNNING])).count()
+    if pending >= JOB_MAX_PENDING:
+        raise APIException(f"La compañía ya tiene {pending} trabajos pendientes. Espere a que terminen.", status_code=429)
+
+    job = Job(company_id=company_id, kind=kind, status=JOB_QUEUED, progress=0.0, params=dumps(params).decode(),
+              cancel_requested=False, attempts=0, created_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+# Un trabajo en cola se cancela al momento; uno en curso se marca y el handler lo detecta
+def cancel_job(job):
+    if job.status in FINISHED_STATUSES:
+        raise APIException("El trabajo ya ha terminado.", status_code=409)
+
+    cancelled = db.session.execute(
+        db.update(Job).where(Job.id == job.id, Job.status == JOB_QUEUED)
+        .values(status=JOB_CANCELLED, cancel_requested=True, finished_at=datetime.utcnow())
+    ).rowcount
+    if not cancelled:
+        db.session.execute(db.update(Job).where(Job.id == job.id).values(cancel_requested=True))
+    db.session.commit()
+    db.session.refresh(job)
+    return job
+
+
+# Toma el trabajo en cola más antiguo de una compañía que no haya llegado a su límite de concurrencia
+# En PostgreSQL un bloqueo consultivo serializa las tomas de todos los procesos, así el límite es exacto
+# Devuelve el id del trabajo o None
+def claim_job(worker_id):
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': JOBS_LOCK_KEY})
+
+    running = dict(db.session.execute(
+        db.select(Job.company_id, func.count()).where(Job.status == JOB_RUNNING).group_by(Job.company_id)
+    ).all())
+    candidates = db.session.execute(
+        db.select(Job.id, Job.company_id).where(Job.status == JOB_QUEUED).order_by(Job.created_at, Job.id).limit(100)
+    ).all()
+
+    for job_id, company_id in candidates:
+        if running.get(company_id, 0) >= JOB_COMPANY_CONCURRENCY:
+            continue
+        now = datetime.utcnow()
+        claimed = db.session.execute(
+            db.update(Job).where(Job.id == job_id, Job.status == JOB_QUEUED)
+            .values(status=JOB_RUNNING, worker=worker_id, started_at=now, heartbeat_at=now, attempts=Job.attempts + 1)
+        ).rowcount
+        if claimed:
+            db.session.commit()
+            return job_id
+    db.session.commit()
+    return None
+
+
+# Cierra un trabajo con `values` si sigue en curso y asignado a este worker. Devuelve las filas actualizadas
+def _finish_job(job_id, worker_id, *conditions, **values):
+    return db.session.execute(
+        db.update(Job).where(Job.id == job_id, Job.status == JOB_RUNNING, Job.worker == worker_id, *conditions)
+        .values(finished_at=datetime.utcnow(), **values)
+    ).rowcount
+
+
+# Ejecuta un trabajo ya tomado y guarda su resultado. El estado final se escribe en la misma
+# transacción que las escrituras del handler y sólo si el trabajo sigue siendo de este worker y no
+# se ha pedido cancelarlo: si se dio por abandonado y volvió a la cola no se confirma nada
+# Devuelve el estado final o None si el resultado se descartó
+def run_job(job_id, worker_id):
+    job = db.session.get(Job, job_id)
+    context = JobContext(job.id, job.company_id)
+    try:
+        handler = JOB_HANDLERS[job.kind]
+        result = handler(loads(job.params or '{}'), job.company_id, context)
+        if not _finish_job(job_id, worker_id, Job.cancel_requested.is_(False),
+                           status=JOB_SUCCEEDED, progress=1.0, result=dumps(result).decode()):
+            # Cancelación pedida que el handler no llegó a comprobar (o el trabajo ya no es nuestro)
+            raise JobCancelled()
+        db.session.commit()
+        return JOB_SUCCEEDED
+    except JobCancelled:
+        db.session.rollback()
+        values = {'status': JOB_CANCELLED}
+    except APIException as e:
+        db.session.rollback()
+        values = {'status': JOB_FAILED, 'error': e.message}
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error en el trabajo {job_id} ({job.kind}): {e}")
+        values = {'status': JOB_FAILED, 'error': "Error interno del servidor"}
+
+    finished = _finish_job(job_id, worker_id, **values)
+    db.session.commit()
+    return values['status'] if finished else None
+
+
+# Trabajos en curso sin latidos recientes (su worker murió o se reinició): vuelven a la cola
+# o, si ya agotaron los intentos, quedan fallidos. Los que tenían la cancelación pedida se cancelan
+def recover_stale_jobs():
+    now = datetime.utcnow()
+    stale = db.and_(Job.status == JOB_RUNNING, Job.heartbeat_at < now - timedelta(seconds=JOB_STALE_S))
+    report = {
+        'cancelled': db.session.execute(
+            db.update(Job).where(stale, Job.cancel_requested.is_(True))
+            .values(status=JOB_CANCELLED, finished_at=now)
+        ).rowcount,
+        'requeued': db.session.execute(
+            db.update(Job).where(stale, Job.attempts < JOB_MAX_ATTEMPTS)
+            .values(status=JOB_QUEUED, worker=None, progress=0.0)
+        ).rowcount,
+        'failed': db.session.execute(
+            db.update(Job).where(stale)
+            .values(status=JOB_FAILED, error="El trabajo se interrumpió demasiadas veces.", finished_at=now)
+        ).rowcount,
+    }
+    db.session.commit()
+    return report
+
+
+# Devuelve a la cola los trabajos de un worker que se detiene
+def release_jobs(worker_id):
+    released = db.session.execute(
+        db.update(Job).where(Job.status == JOB_RUNNING, Job.worker == worker_id)
+        .values(status=JOB_QUEUED, worker=None, progress=0.0)
+    ).rowcount
+    db.session.commit()
+    return released
+
+
+# Pool de hilos que ejecuta trabajos. Cada hilo toma un trabajo, lo ejecuta y vuelve a la cola;
+# otro hilo envía los latidos de los trabajos en curso y recupera los abandonados por otros workers
+class JobRunner:
+    def __init__(self, app, workers=JOB_WORKERS):
+        self.app = app
+        self.workers = workers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Al activarse los hilos dejan de tomar trabajos
+        self.stopping = threading.Event()
+        self._threads = []
+        self._running = set()
+        self._running_lock = threading.Lock()
+        # Dentro del proceso las tomas van de una en una (el límite por compañía se cuenta bien)
+        self._claim_lock = threading.Lock()
+
+    def start(self):
+        for index in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True))
+        self._threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    # Deja de tomar trabajos, espera a los que están en curso hasta `timeout` segundos y devuelve
+    # a la cola los que no terminaron
+    def stop(self, timeout=30):
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        with self.app.app_context():
+            released = release_jobs(self.worker_id)
+            db.session.remove()
+        return released
+
+    def _work(self):
+        while not self.stopping.is_set():
+            job_id = None
+            with self.app.app_context():
+                try:
+                    with self._claim_lock:
+                        job_id = claim_job(self.worker_id)
+                    if job_id is not None:
+                        with self._running_lock:
+                            self._running.add(job_id)
+                        run_job(job_id, self.worker_id)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error en el worker de trabajos: {e}")
+                finally:
+                    with self._running_lock:
+                        self._running.discard(job_id)
+                    db.session.remove()
+            if job_id is None:
+                self.stopping.wait(JOB_POLL_S)
+
+    def _heartbeat(self):
+        while not self.stopping.wait(JOB_HEARTBEAT_S):
+            with self.app.app_context():
+                try:
+                    with self._running_lock:
+                        running = list(self._running)
+                    if running:
+                        db.session.execute(
+                            db.update(Job).where(Job.id.in_(running), Job.worker == self.worker_id)
+                            .values(heartbeat_at=datetime.utcnow())
+                        )
+                        db.session.commit()
+                    recover_stale_jobs()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error en los latidos de trabajos: {e}")
+                finally:
+                    db.session.remove()
+
+
+
+# TIPOS DE TRABAJO
+
+# Mismos parámetros que POST /api/routes/optimize, con más presupuesto de tiempo
+@job_handler('routes.optimize')
+def optimize_route_job(params, company_id, context):
+    return optimize_stops(params, company_id, max_time_budget_ms=JOB_MAX_TIME_BUDGET_MS, on_progress=context.progress)
+
+
+# Mismos parámetros que POST /api/routes/fleet-plan, con más presupuesto de tiempo
+@job_handler('routes.fleet_plan')
+def fleet_plan_job(params, company_id, context):
+    return plan_fleet(params, company_id, max_time_budget_ms=JOB_MAX_TIME_BUDGET_MS, on_progress=context.progress)
+
+
+# Mismos parámetros que POST /api/quotes/batch
+@job_handler('quotes.batch')
+def quotes_batch_job(params, company_id, context):
+    quotes, cache_hits = cached_quotes(params.get('quotes'), parse_fuel_prices(params), on_progress=context.progress)
+    return {"quotes": quotes, "cache_hits": cache_hits}
+
+
+# Importación de direcciones: {"records": [{"name", "address", "category", "contact", "comments"}, ...]}
+# Como /api/addresses/bulk, pero todo o nada: si se cancela no queda ninguna fila insertada
+@job_handler('addresses.import')
+def import_addresses_job(params, company_id, context):
+    records = params.get('records')
+    if not isinstance(records, list) or not records:
+        raise APIException("'records' debe ser una lista de direcciones no vacía.", status_code=400)
+
+    report = {"inserted": 0, "rejected": 0, "errors": []}
+    created_at = datetime.utcnow()
+
+    def valid_rows():
+        for index, record in enumerate(records):
+            context.progress(index / len(records))
+            if not isinstance(record, dict):
+                errors = ["Se esperaba un objeto JSON."]
+            else:
+                values, errors = clean_record(Address, record, ['name', 'address', 'category'], ['contact', 'comments'])
+            if errors:
+                report["rejected"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"line": index + 1, "errors": errors})
+                continue
+            values['company_id'] = company_id
+            values['created_at'] = created_at
+            yield values
+
+    report["inserted"] = insert_in_batches(Address.__table__, valid_rows())
+    if report["inserted"]:
+        bump_collection_version(company_id, 'addresses')
+    report["errors_truncated"] = report["rejected"] > len(report["errors"])
+    return report
+
+
+# Exportación de todas las direcciones de la compañía en NDJSON, como /api/companies/<id>/export
+# Cada lote de EXPORT_BATCH_SIZE filas se guarda como una parte del resultado: ni las filas ni el
+# resultado completo llegan a estar en memoria. Se descarga de /api/jobs/<id>/result
+@job_handler('addresses.export')
+def export_addresses_job(params, company_id, context):
+    total = db.session.execute(
+        db.select(func.count()).select_from(Address).where(Address.company_id == company_id)
+    ).scalar()
+    count = chunks = 0
+    for chunks, chunk in enumerate(export_chunks('addresses', Address, company_id), start=1):
+        save_result_chunk(context.job_id, chunks, chunk)
+        # Una línea por dirección (dumps no deja saltos de línea dentro del JSON)
+        count += chunk.count(b"\n")
+        context.progress(chunks * EXPORT_BATCH_SIZE / total)
+    return {"count": count, "chunks": chunks, "format": "ndjson"}
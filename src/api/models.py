@@ -5,6 +5,7 @@ from sqlalchemy.sql import func
 from flask_jwt_extended import JWTManager
 import re
 from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
 
 
 
@@ -31,9 +32,15 @@ class User(db.Model):
     location = db.Column(db.String(150), nullable=True)
     created_at = db.Column(db.DateTime, default=func.now(), nullable=False)  
 
+    # Índice para los listados por compañía ordenados por (created_at, id)
+    __table_args__ = (db.Index('ix_users_company_created', 'company_id', 'created_at', 'id'),)
+
     # Relación uno a muchos con Company
     company = db.relationship('Company', backref='users', lazy='select')
 
+    # Columnas que se pueden exponer en los listados (nunca el password_hash)
+    public_fields = ('id', 'email', 'name', 'last_name', 'company_id', 'location', 'created_at')
+
     # Inicializar instancia de users
     def __init__(self, email, password_hash, name, last_name, company_id, location=None, created_at=None):
         self.email = email
@@ -65,9 +72,14 @@ class PasswordResetToken(db.Model):
 
     # Contenido de la tabla
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String(500), nullable=False, unique=True)
+    # Sólo se guarda el SHA-256 del token (64 caracteres hex): índice pequeño y el token no queda en la BD
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    # Indexado para la purga de tokens caducados (los usados se borran al restablecer la contraseña)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+# Relaciones de Company que se pueden expandir con ?include=
+COMPANY_RELATIONS = ('users', 'addresses', 'vehicles', 'partners', 'clients')
 
 class Company(db.Model):
 
@@ -92,9 +104,10 @@ class Company(db.Model):
         self.email = email
         self.created_at = created_at or func.now()
 
-    # Serializar la info de User para convertirla en un diccionario de Python 
-    def serialize(self):
-        return {
+    # Serializar la info de Company para convertirla en un diccionario de Python
+    # include indica qué relaciones se añaden (por defecto todas)
+    def serialize(self, include=COMPANY_RELATIONS):
+        data = {
             'id' : self.id,
             'name' : self.name,
             'nif' : self.nif, 
@@ -102,15 +115,30 @@ class Company(db.Model):
             'phone' : self.phone,
             'email' : self.email, 
             'created_at' : self.created_at.isoformat(),  # Convierte este valor en formato ISO
-
-            # Elementos de otras clases relacionados
-            'users' : [user.serialize() for user in self.users],
-            'addresses': [address.serialize() for address in self.addresses],
-            'vehicles': [vehicle.serialize() for vehicle in self.vehicles],
-            'partners' : [partner.serialize() for partner in self.partners],
-            'clients' : [client.serialize() for client in self.clients]
         }
 
+        # Elementos de otras clases relacionados
+        for relation in include:
+            data[relation] = [item.serialize() for item in getattr(self, relation)]
+        return data
+
+    # Carga en bloque las relaciones pedidas: una consulta por relación, sin importar
+    # cuántas compañías haya. company_ids es una subconsulta con los ids de las compañías
+    @staticmethod
+    def load_relations(companies, include, company_ids):
+        for relation in include:
+            model = getattr(Company, relation).property.mapper.class_
+            grouped = {company.id: [] for company in companies}
+
+            items = model.query.filter(model.company_id.in_(company_ids)).order_by(model.id).all()
+            for item in items:
+                if item.company_id in grouped:
+                    grouped[item.company_id].append(item)
+
+            # Rellenar la colección sin marcarla como modificada ni lanzar la carga perezosa
+            for company in companies:
+                set_committed_value(company, relation, grouped[company.id])
+
 
     # Validación del campo 'nif' con un decorador de SQLAlchemy
     @validates('nif')
@@ -141,6 +169,15 @@ class Company(db.Model):
 
 
 
+# Versión de cada colección por compañía: se incrementa en cada escritura y sirve para los ETag
+class CollectionVersion(db.Model):
+    __tablename__ = 'collection_versions'
+
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), primary_key=True)
+    collection = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+
 class Address(db.Model):
     __tablename__ = 'addresses'
 
@@ -152,10 +189,26 @@ class Address(db.Model):
     comments = db.Column(db.Text, nullable=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=func.now(), nullable=False)
+    # Coordenadas geocodificadas (ver api/geocoding.py)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    # 'pending', 'not_found' o la precisión obtenida ('postal_code', 'city', 'province')
+    geocode_status = db.Column(db.String(16), default='pending', server_default='pending', nullable=False)
+
+    # Índice para los listados por compañía ordenados por (created_at, id)
+    # e índice para que el geocodificador encuentre las direcciones pendientes
+    __table_args__ = (
+        db.Index('ix_addresses_company_created', 'company_id', 'created_at', 'id'),
+        db.Index('ix_addresses_geocode_status', 'geocode_status'),
+    )
 
     # Relación 1 a n con Company
     company = db.relationship('Company', backref='addresses', lazy='select')
 
+    # Columnas que se pueden exponer en los listados
+    public_fields = ('id', 'name', 'address', 'category', 'contact', 'comments', 'company_id', 'created_at',
+                     'latitude', 'longitude', 'geocode_status')
+
     def __init__(self, name, address, category, contact=None, comments=None, company_id=None, created_at=None):
         self.name = name
         self.address = address
@@ -173,10 +226,82 @@ class Address(db.Model):
             'category': self.category,
             'contact': self.contact,
             'comments': self.comments,
-            'company_id' : self.company_id
+            'company_id' : self.company_id,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'geocode_status': self.geocode_status
         }
+
+
+# Caché persistente de geocodificación: cada dirección normalizada se geocodifica una sola vez
+# Los resultados sin coordenadas (precision NULL) también se guardan para no repetir la búsqueda
+class GeocodeCache(db.Model):
+    __tablename__ = 'geocode_cache'
+
+    normalized_address = db.Column(db.String(200), primary_key=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    precision = db.Column(db.String(16), nullable=True)
+    provider = db.Column(db.String(32), nullable=True)
+    created_at = db.Column(db.DateTime, default=func.now(), nullable=False)
     
     
+# Trabajo en segundo plano (optimizaciones, importaciones, exportaciones...). Ver api/jobs.py
+# params y result se guardan como JSON en texto
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    kind = db.Column(db.String(50), nullable=False)
+    # 'queued', 'running', 'succeeded', 'failed' o 'cancelled'
+    status = db.Column(db.String(16), default='queued', nullable=False)
+    progress = db.Column(db.Float, default=0.0, nullable=False)
+    params = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    # Proceso que lo ejecuta y último latido: sin latidos recientes se da por abandonado
+    worker = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # Índice para que los workers tomen los trabajos en cola por orden de llegada
+    # e índice para los listados y los límites de concurrencia por compañía
+    __table_args__ = (
+        db.Index('ix_jobs_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_jobs_company_status', 'company_id', 'status'),
+    )
+
+    def serialize(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': round(self.progress, 4),
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'attempts': self.attempts,
+            'company_id': self.company_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+# Resultado de un trabajo guardado por partes (exportaciones en NDJSON), en orden de `seq`
+# job.result sólo guarda el resumen; las partes se envían en streaming desde /api/jobs/<id>/result
+class JobResultChunk(db.Model):
+    __tablename__ = 'job_result_chunks'
+
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id', ondelete='CASCADE'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
 class ContactMessage(db.Model):
     __tablename__ = 'contact_messages'
 
@@ -220,10 +345,17 @@ class Client(db.Model):
 
     # Restricción única compuesta: (user_id, nif)
     # Un mismo usuario sólo puede dar de alta un mismo NIF como cliente
-    __table_args__ = (UniqueConstraint('company_id', 'nif', name='unique_company_client_nif'),) 
+    # Índice para los listados por compañía ordenados por (created_at, id)
+    __table_args__ = (
+        UniqueConstraint('company_id', 'nif', name='unique_company_client_nif'),
+        db.Index('ix_clients_company_created', 'company_id', 'created_at', 'id'),
+    )
 
     # Relación 1 a n con Company
     company = db.relationship('Company', backref='clients', lazy='select')
+
+    # Columnas que se pueden exponer en los listados
+    public_fields = ('id', 'first_name', 'last_name', 'nif', 'phone', 'email', 'address', 'company_id', 'created_at')
     
     def __init__(self, first_name, last_name, nif=None, phone=None, email=None, address=None, company=None, company_id=None, created_at=None) :
         self.first_name = first_name
@@ -263,10 +395,16 @@ class Vehicle(db.Model):
     emissions = db.Column(db.String(50), nullable=True)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=func.now(), nullable=False)
+
+    # Índice para los listados por compañía ordenados por (created_at, id)
+    __table_args__ = (db.Index('ix_vehicles_company_created', 'company_id', 'created_at', 'id'),)
     
     # Relación 1 a n con Company
     company = db.relationship('Company', backref='vehicles', lazy='select')
 
+    # Columnas que se pueden exponer en los listados
+    public_fields = ('id', 'name', 'plate', 'tow', 'cost_km', 'cost_hour', 'axles', 'weight', 'fuel', 'emissions', 'company_id', 'created_at')
+
     def __init__(self, name, plate, tow=None, cost_km=None, cost_hour=None, axles=None, weight=None, fuel=None, emissions=None, company=None, company_id=None, created_at=None) :
         self.name = name
         self.plate = plate
@@ -292,7 +430,6 @@ class Vehicle(db.Model):
             'weight': self.weight,
             'fuel': self.fuel,
             'emissions': self.emissions,
-            'company' : self.company,
             'company_id' : self.company_id,
             'created_at': self.created_at.isoformat()  # Formato ISO
         }
@@ -311,9 +448,15 @@ class Partner(db.Model):
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=func.now(), nullable=False)
 
+    # Índice para los listados por compañía ordenados por (created_at, id)
+    __table_args__ = (db.Index('ix_partners_company_created', 'company_id', 'created_at', 'id'),)
+
     # Relación 1 a n con Company
     company = db.relationship('Company', backref='partners', lazy='select')
 
+    # Columnas que se pueden exponer en los listados
+    public_fields = ('id', 'name', 'email', 'price_type', 'price', 'waiting_periods', 'include_tolls', 'company_id', 'created_at')
+
     def __init__(self, name, email, price_type, price, waiting_periods, include_tolls, company=None, company_id=None, created_at=None):
         self.name = name
         self.email = email
@@ -321,7 +464,9 @@ class Partner(db.Model):
         self.price = price
         self.waiting_periods = waiting_periods
         self.include_tolls = include_tolls
-        self.company = company
+        # Asignar la relación a None anularía company_id al hacer flush
+        if company is not None:
+            self.company = company
         self.company_id = company_id
         self.created_at = created_at
 
@@ -334,7 +479,6 @@ class Partner(db.Model):
             'price' : self.price, 
             'waiting_periods' : self.waiting_periods,
             'include_tolls' : self.include_tolls,
-            'company' : self.company,
             'company_id' : self.company_id,
             'created_at' : self.created_at.isoformat()  # Convertir a formato ISO
         }
@@ -0,0 +1,120 @@
+import time
+import numpy as np
+
+# Máximo de paradas intermedias por optimización y presupuesto de tiempo (ms) por defecto y máximo
+MAX_ROUTE_STOPS = 300
+DEFAULT_TIME_BUDGET_MS = 500
+MAX_TIME_BUDGET_MS = 5000
+
+# Longitudes de los tramos que Or-opt prueba a mover
+OR_OPT_SEGMENTS = (1, 2, 3)
+
+# Mejora mínima para aceptar un movimiento (evita ciclos por errores de redondeo)
+EPSILON = 1e-9
+
+
+# Longitud de un recorrido sobre la matriz de distancias
+def route_length(matrix, order):
+    order = np.asarray(order)
+    return float(matrix[order[:-1], order[1:]].sum())
+
+
+# Vecino más próximo desde el inicio (índice 0) visitando todas las paradas intermedias;
+# el final (último índice) queda fijo
+def nearest_neighbor(matrix):
+    n = len(matrix)
+    order = [0]
+    remaining = np.ones(n, dtype=bool)
+    remaining[0] = remaining[n - 1] = False
+    current = 0
+    for _ in range(n - 2):
+        candidates = np.where(remaining, matrix[current], np.inf)
+        current = int(np.argmin(candidates))
+        remaining[current] = False
+        order.append(current)
+    order.append(n - 1)
+    return np.array(order)
+
+
+# 2-opt con extremos fijos: invierte el tramo order[i..j] si acorta el recorrido
+# Para cada i se evalúan todos los j a la vez con NumPy. La matriz debe ser simétrica
+def two_opt_pass(matrix, order, deadline):
+    n = len(order)
+    improved = False
+    for i in range(1, n - 2):
+        if time.perf_counter() > deadline:
+            break
+        a, b = order[i - 1], order[i]
+        c = order[i + 1:n - 1]
+        d = order[i + 2:n]
+        delta = matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+        best = int(np.argmin(delta))
+        if delta[best] < -EPSILON:
+            j = i + 1 + best
+            order[i:j + 1] = order[i:j + 1][::-1]
+            improved = True
+    return improved
+
+
+# Or-opt: mueve tramos de 1 a 3 paradas (en su sentido o invertidos) a la mejor posición del recorrido
+def or_opt_pass(matrix, order, deadline):
+    n = len(order)
+    improved = False
+    for length in OR_OPT_SEGMENTS:
+        i = 1
+        while i + length <= n - 1:
+            if time.perf_counter() > deadline:
+                return improved
+            first, last = order[i], order[i + length - 1]
+            prev, next_ = order[i - 1], order[i + length]
+            removal_gain = matrix[prev, first] + matrix[last, next_] - matrix[prev, next_]
+
+            # Recorrido sin el tramo: se prueba a insertarlo entre cada par de paradas consecutivas
+            rest = np.concatenate((order[:i], order[i + length:]))
+            left, right = rest[:-1], rest[1:]
+            forward = matrix[left, first] + matrix[last, right] - matrix[left, right]
+            backward = matrix[left, last] + matrix[first, right] - matrix[left, right]
+            # Reinsertarlo donde estaba no es un movimiento
+            forward[i - 1] = backward[i - 1] = np.inf
+
+            best_forward, best_backward = int(np.argmin(forward)), int(np.argmin(backward))
+            if forward[best_forward] <= backward[best_backward]:
+                position, cost, reverse = best_forward, forward[best_forward], False
+            else:
+                position, cost, reverse = best_backward, backward[best_backward], True
+
+            if cost - removal_gain < -EPSILON:
+                segment = order[i:i + length]
+                if reverse:
+                    segment = segment[::-1]
+                order[:] = np.concatenate((rest[:position + 1], segment, rest[position + 1:]))
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+# Ordena las paradas entre un inicio (índice 0) y un final (último índice) fijos
+# Construcción por vecino más próximo y mejora con 2-opt y Or-opt hasta no mejorar o agotar el tiempo
+# on_progress(fracción del presupuesto consumida) se llama tras cada pasada; si lanza una excepción
+# (por ejemplo, un trabajo cancelado) la optimización se interrumpe
+# Devuelve (orden, pasadas de mejora, se agotó el tiempo)
+def optimize_route(matrix, time_budget_ms=DEFAULT_TIME_BUDGET_MS, on_progress=None):
+    matrix = np.asarray(matrix, dtype=np.float64)
+    started = time.perf_counter()
+    deadline = started + time_budget_ms / 1000
+
+    order = nearest_neighbor(matrix)
+    if len(order) <= 3:
+        return order, 0, False
+
+    passes = 0
+    while time.perf_counter() < deadline:
+        passes += 1
+        improved = two_opt_pass(matrix, order, deadline)
+        improved = or_opt_pass(matrix, order, deadline) or improved
+        if not improved:
+            return order, passes, False
+        if on_progress is not None:
+            on_progress(min((time.perf_counter() - started) / (deadline - started), 1.0))
+    return order, passes, True
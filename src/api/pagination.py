@@ -0,0 +1,97 @@
+import base64
+import binascii
+from datetime import datetime
+from sqlalchemy import select, and_, or_
+from api.utils import APIException
+from api.serializers import row_encoder
+
+# Tamaño de página por defecto y máximo permitido en los listados
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+# Convierte el parámetro "fields=a,b,c" en la lista de columnas a seleccionar
+def parse_fields(model, raw_fields):
+    if not raw_fields:
+        return list(model.public_fields)
+
+    fields = []
+    for field in raw_fields.split(','):
+        field = field.strip()
+        if field and field not in fields:
+            fields.append(field)
+
+    invalid = [field for field in fields if field not in model.public_fields]
+    if invalid:
+        raise APIException(f"Campos no válidos: {', '.join(invalid)}", status_code=400)
+    if not fields:
+        return list(model.public_fields)
+    return fields
+
+
+# Valida el parámetro "limit" y lo acota al máximo permitido
+def parse_limit(raw_limit):
+    if raw_limit is None or raw_limit == '':
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw_limit)
+    except (TypeError, ValueError):
+        raise APIException("El parámetro 'limit' debe ser un número entero.", status_code=400)
+    if limit < 1:
+        raise APIException("El parámetro 'limit' debe ser mayor que cero.", status_code=400)
+    return min(limit, MAX_PAGE_SIZE)
+
+
+# El cursor es opaco para el cliente: codifica la clave (created_at, id) de la última fila
+def encode_cursor(created_at, id):
+    raw = f"{created_at.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise APIException("El cursor de paginación no es válido.", status_code=400)
+
+
+# Construye la consulta de una página ordenada por (created_at, id)
+# Sólo se seleccionan las columnas pedidas más las necesarias para calcular el cursor
+def keyset_select(model, fields, company_id=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    selected = list(fields) + [key for key in ('created_at', 'id') if key not in fields]
+    stmt = select(*[getattr(model, field) for field in selected])
+
+    if company_id is not None:
+        stmt = stmt.where(model.company_id == company_id)
+
+    if cursor is not None:
+        created_at, id = cursor
+        stmt = stmt.where(or_(
+            model.created_at > created_at,
+            and_(model.created_at == created_at, model.id > id)
+        ))
+
+    # Se pide una fila de más para saber si existe una página siguiente
+    return stmt.order_by(model.created_at, model.id).limit(limit + 1)
+
+
+# Ejecuta la consulta paginada a partir de los parámetros de la petición
+# Devuelve {"items": [...], "next_cursor": "..." | None}; las fechas se dejan como datetime
+# y se codifican al generar la respuesta (ver api.serializers.json_response)
+def keyset_page(session, model, args, company_id=None):
+    fields = parse_fields(model, args.get('fields'))
+    limit = parse_limit(args.get('limit'))
+    cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+
+    rows = session.execute(keyset_select(model, fields, company_id, cursor, limit)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    items = row_encoder(model, fields)(rows)
+    return {"items": items, "next_cursor": next_cursor}
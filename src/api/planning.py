@@ -0,0 +1,157 @@
+import time
+import numpy as np
+from api.models import Vehicle
+from api.geocoding import address_points
+from api.optimizer import optimize_route, route_length, MAX_ROUTE_STOPS, DEFAULT_TIME_BUDGET_MS, MAX_TIME_BUDGET_MS
+from api.vrp import FleetProblem, solve_fleet, MAX_VRP_JOBS, MAX_VRP_VEHICLES, DEFAULT_VRP_TIME_BUDGET_MS, MAX_VRP_TIME_BUDGET_MS
+from api.geo import distance_matrix, parse_points, parse_positive, parse_non_negative, CIRCUITY_FACTOR, AVERAGE_SPEED_KMH
+from api.utils import APIException
+
+# Planificación de rutas compartida por los endpoints de /api/routes y los trabajos en segundo plano
+# Devuelven el resultado como diccionario y señalan los errores de entrada con APIException
+
+NO_COMPANY_ERROR = "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."
+
+
+# Inicio, paradas y final de una ruta: coordenadas o ids de direcciones de la compañía
+# Devuelve (puntos, ids de las paradas o None)
+def route_points(data, company_id):
+    if data.get('stop_address_ids') is not None:
+        if not company_id:
+            raise APIException(NO_COMPANY_ERROR, status_code=405)
+        stop_ids = data['stop_address_ids']
+        if isinstance(stop_ids, list) and len(stop_ids) > MAX_ROUTE_STOPS:
+            raise APIException(f"Como máximo se admiten {MAX_ROUTE_STOPS} paradas.", status_code=400)
+        start_id = data.get('start_address_id')
+        end_id = data.get('end_address_id', start_id)
+        points = address_points(company_id, [start_id] + stop_ids + [end_id], 'start_address_id, stop_address_ids, end_address_id')
+        return points, stop_ids
+
+    stops = data.get('stops')
+    if isinstance(stops, list) and len(stops) > MAX_ROUTE_STOPS:
+        raise APIException(f"Como máximo se admiten {MAX_ROUTE_STOPS} paradas.", status_code=400)
+    start = parse_points([data.get('start')], 'start')
+    end = parse_points([data['end']], 'end') if data.get('end') is not None else start
+    return np.concatenate((start, parse_points(stops, 'stops'), end)), None
+
+
+# Orden de visita casi óptimo de las paradas entre un inicio y un final fijos
+# `max_time_budget_ms` limita el time_budget_ms de la petición (los trabajos admiten más tiempo)
+# y on_progress recibe el avance de la optimización (ver optimize_route)
+def optimize_stops(data, company_id, max_time_budget_ms=MAX_TIME_BUDGET_MS, on_progress=None):
+    started = time.perf_counter()
+    points, stop_ids = route_points(data, company_id)
+    circuity_factor = parse_positive(data, 'circuity_factor', CIRCUITY_FACTOR)
+    average_speed_kmh = parse_positive(data, 'average_speed_kmh', AVERAGE_SPEED_KMH)
+    time_budget_ms = min(parse_positive(data, 'time_budget_ms', DEFAULT_TIME_BUDGET_MS), max_time_budget_ms)
+
+    distances, _ = distance_matrix(points, points, circuity_factor, average_speed_kmh)
+    order, passes, exhausted = optimize_route(distances, time_budget_ms, on_progress)
+
+    input_km = route_length(distances, np.arange(len(points)))
+    optimized_km = route_length(distances, order)
+    # Índices de las paradas en la lista recibida (sin el inicio ni el final)
+    stop_order = [int(index) - 1 for index in order[1:-1]]
+
+    result = {
+        "order": stop_order,
+        "input_distance_km": round(input_km, 3),
+        "optimized_distance_km": round(optimized_km, 3),
+        "saved_km": round(input_km - optimized_km, 3),
+        "saved_percent": round((input_km - optimized_km) / input_km * 100, 2) if input_km else 0.0,
+        "optimized_duration_hours": round(optimized_km / average_speed_kmh, 3),
+        "improvement_passes": passes,
+        "time_budget_exhausted": exhausted,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    if stop_ids is not None:
+        result["stop_address_ids"] = [stop_ids[index] for index in stop_order]
+    return result
+
+
+# Depósito y trabajos de un plan de flota. Cada ubicación es [lat, lng] o el id de una dirección
+# de la compañía (se resuelven todas en una consulta). Devuelve (puntos, pesos, horas de servicio)
+def fleet_jobs(data, company_id):
+    jobs = data.get('jobs')
+    if not isinstance(jobs, list) or not jobs:
+        raise APIException("'jobs' debe ser una lista de trabajos no vacía.", status_code=400)
+    if len(jobs) > MAX_VRP_JOBS:
+        raise APIException(f"Como máximo se admiten {MAX_VRP_JOBS} trabajos.", status_code=400)
+
+    depot = {'address_id': data['depot_address_id']} if data.get('depot_address_id') is not None else {'location': data.get('depot')}
+    locations, address_ids, weights, service_hours = [], [], [], []
+    for index, item in enumerate([depot] + jobs):
+        name = 'depot' if index == 0 else f"jobs[{index - 1}]"
+        if not isinstance(item, dict):
+            raise APIException(f"{name}: se esperaba un objeto JSON.", status_code=400)
+        if item.get('address_id') is not None:
+            locations.append(None)
+            address_ids.append(item['address_id'])
+        else:
+            locations.append(parse_points([item.get('location')], name)[0])
+        if index > 0:
+            weights.append(parse_non_negative(item, 'weight', 0.0, name))
+            service_hours.append(parse_non_negative(item, 'service_minutes', 0.0, name) / 60)
+
+    if address_ids:
+        resolved = iter(address_points(company_id, address_ids, 'address_id'))
+        locations = [location if location is not None else next(resolved) for location in locations]
+    return np.array(locations, dtype=np.float32), weights, service_hours
+
+
+# Reparte los trabajos del día entre los vehículos de la compañía respetando su capacidad (weight)
+# y minimizando cost_km * km + cost_hour * horas
+def plan_fleet(data, company_id, max_time_budget_ms=MAX_VRP_TIME_BUDGET_MS, on_progress=None):
+    started = time.perf_counter()
+    points, weights, service_hours = fleet_jobs(data, company_id)
+    circuity_factor = parse_positive(data, 'circuity_factor', CIRCUITY_FACTOR)
+    average_speed_kmh = parse_positive(data, 'average_speed_kmh', AVERAGE_SPEED_KMH)
+    time_budget_ms = min(parse_positive(data, 'time_budget_ms', DEFAULT_VRP_TIME_BUDGET_MS), max_time_budget_ms)
+
+    query = Vehicle.query.filter_by(company_id=company_id)
+    if data.get('vehicle_ids') is not None:
+        vehicle_ids = data['vehicle_ids']
+        if not isinstance(vehicle_ids, list) or not all(isinstance(value, int) and not isinstance(value, bool) for value in vehicle_ids):
+            raise APIException("'vehicle_ids' debe ser una lista de identificadores de vehículo.", status_code=400)
+        query = query.filter(Vehicle.id.in_(vehicle_ids))
+    vehicles = query.order_by(Vehicle.id).limit(MAX_VRP_VEHICLES).all()
+    if not vehicles:
+        raise APIException("La compañía no tiene vehículos disponibles.", status_code=404)
+
+    # Sin peso máximo registrado el vehículo no tiene límite de carga; sin costes cuentan como 0
+    distances, _ = distance_matrix(points, points, circuity_factor, average_speed_kmh)
+    problem = FleetProblem(
+        distances, weights, service_hours,
+        capacities=[vehicle.weight if vehicle.weight is not None else np.inf for vehicle in vehicles],
+        cost_km=[vehicle.cost_km or 0.0 for vehicle in vehicles],
+        cost_hour=[vehicle.cost_hour or 0.0 for vehicle in vehicles],
+        speed_kmh=average_speed_kmh,
+    )
+    solution = solve_fleet(problem, time_budget_ms, on_progress=on_progress)
+
+    job_refs = [job.get('id', index) for index, job in enumerate(data['jobs'])]
+    routes = []
+    for v, route in enumerate(solution["routes"]):
+        if not route:
+            continue
+        km = problem.route_km(route)
+        service = float(sum(service_hours[job - 1] for job in route))
+        routes.append({
+            "vehicle_id": vehicles[v].id,
+            "vehicle_name": vehicles[v].name,
+            "plate": vehicles[v].plate,
+            "jobs": [job_refs[job - 1] for job in route],
+            "load": round(float(sum(weights[job - 1] for job in route)), 3),
+            "capacity": vehicles[v].weight,
+            "distance_km": round(km, 3),
+            "duration_hours": round(km / average_speed_kmh + service, 3),
+            "cost": round(float(problem.route_cost(v, route)), 2),
+        })
+
+    return {
+        "routes": routes,
+        "unassigned": [job_refs[job - 1] for job in solution["unassigned"]],
+        "total_cost": round(float(solution["cost"]), 2),
+        "restarts": solution["restarts"],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
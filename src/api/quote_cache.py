@@ -0,0 +1,114 @@
+import os
+import hashlib
+import numpy as np
+from api.cache import LRUTTLCache, MISSING
+from api.serializers import dumps
+from api.geocoding import normalize_address, resolve_addresses
+from api.geo import distance_matrix, CIRCUITY_FACTOR, AVERAGE_SPEED_KMH
+from api.quotes import price_quotes, quotes_to_list, parse_quote_items, MAX_BATCH_QUOTES
+from api.utils import APIException
+
+# Caché de presupuestos y de métricas de ruta (distancia y duración por paradas)
+# Los planificadores repiten a diario las mismas rutas con el mismo contenedor y tarifa: la clave
+# canónica se forma con las paradas normalizadas y todos los parámetros de precio
+
+# Máximo de paradas por ruta
+MAX_QUOTE_STOPS = 25
+
+# Presupuestos que se calculan en cada pasada vectorizada (entre pasadas se informa del progreso)
+QUOTE_CHUNK_SIZE = 1000
+
+# Caché LRU con caducidad propia de este proceso (QUOTE_CACHE_MAX_ENTRIES, QUOTE_CACHE_TTL)
+_quote_cache = LRUTTLCache(max_entries=int(os.getenv('QUOTE_CACHE_MAX_ENTRIES', 4096)),
+                           ttl=int(os.getenv('QUOTE_CACHE_TTL', 3600)))
+
+
+def _digest(parts):
+    return hashlib.sha1(dumps(parts)).hexdigest()
+
+
+# Versión de los precios del combustible: forma parte de la clave, así que al cambiar los precios
+# las entradas anteriores dejan de leerse y salen por LRU o por caducidad
+def fuel_price_version(fuel_prices):
+    return f"{fuel_prices['base_fuel_price']:.4f}-{fuel_prices['fuel_price']:.4f}"
+
+
+# Paradas normalizadas de un presupuesto (None si se presupuesta por distancia)
+def parse_stops(item, label):
+    stops = item.get('stops')
+    if stops is None:
+        return None
+    if not isinstance(stops, list) or not 2 <= len(stops) <= MAX_QUOTE_STOPS or \
+            not all(isinstance(stop, str) and stop.strip() for stop in stops):
+        raise APIException(f"{label}: 'stops' debe ser una lista de entre 2 y {MAX_QUOTE_STOPS} direcciones.", status_code=400)
+    return tuple(normalize_address(stop) for stop in stops)
+
+
+# Distancia por carretera (km) y duración (horas) estimadas de una ruta que recorre las paradas en orden
+def _compute_route_metrics(points):
+    distances, durations = distance_matrix(points, points, CIRCUITY_FACTOR, AVERAGE_SPEED_KMH)
+    legs = np.arange(len(points) - 1)
+    return {
+        'distance_km': round(float(distances[legs, legs + 1].astype(np.float64).sum()), 3),
+        'duration_hours': round(float(durations[legs, legs + 1].astype(np.float64).sum()), 3),
+    }
+
+
+# Métricas de varias rutas ({índice del presupuesto: paradas}). Las que no están en caché se geocodifican
+# juntas con una sola consulta a la caché de geocodificación (sin commit: lo hace quien llama)
+def route_metrics(routes):
+    keys = {index: 'route:' + _digest([stops, CIRCUITY_FACTOR, AVERAGE_SPEED_KMH]) for index, stops in routes.items()}
+    metrics = {index: _quote_cache.get(key) for index, key in keys.items()}
+    missing = [index for index, value in metrics.items() if value is MISSING]
+    if missing:
+        resolved = resolve_addresses(stop for index in missing for stop in routes[index])
+        for index in missing:
+            unresolved = [position for position, stop in enumerate(routes[index]) if resolved.get(stop) is None]
+            if unresolved:
+                raise APIException(f"Presupuesto {index}: no se pudieron geocodificar las paradas {', '.join(map(str, unresolved))}.", status_code=422)
+            points = np.array([resolved[stop][:2] for stop in routes[index]], dtype=np.float32)
+            metrics[index] = _compute_route_metrics(points)
+            _quote_cache.set(keys[index], metrics[index])
+    return metrics
+
+
+# Presupuestos con caché. Cada presupuesto se identifica por sus paradas normalizadas (o su distancia
+# y duración), el contenedor, el peso, la tarifa, el número de opciones y la versión de los precios
+# del combustible. Los que no están en caché se calculan juntos en pasadas vectorizadas de
+# QUOTE_CHUNK_SIZE; on_progress(fracción) se llama antes de cada una (los trabajos lo usan para cancelar)
+# Devuelve (presupuestos, aciertos de caché)
+def cached_quotes(items, fuel_prices, on_progress=None):
+    if not isinstance(items, list) or not items:
+        raise APIException("Se esperaba una lista de presupuestos no vacía.", status_code=400)
+    if len(items) > MAX_BATCH_QUOTES:
+        raise APIException(f"Como máximo se admiten {MAX_BATCH_QUOTES} presupuestos por petición.", status_code=400)
+
+    # Las rutas por paradas se resuelven antes de validar: aportan distance_km y duration_hours
+    stops = [parse_stops(item, f"Presupuesto {index}") if isinstance(item, dict) else None for index, item in enumerate(items)]
+    metrics = route_metrics({index: item_stops for index, item_stops in enumerate(stops) if item_stops is not None})
+    items = [dict(item, **metrics[index]) if index in metrics else item for index, item in enumerate(items)]
+
+    columns = parse_quote_items(items)
+    version = fuel_price_version(fuel_prices)
+    keys = []
+    for index, item_stops in enumerate(stops):
+        route = item_stops if item_stops is not None else (columns['distance_km'][index], columns['duration_hours'][index])
+        keys.append('quote:' + _digest([route, columns['container_types'][index], columns['weights'][index],
+                                        columns['tariffs'][index], columns['option_counts'][index], version]))
+
+    quotes = [_quote_cache.get(key) for key in keys]
+    misses = [index for index, quote in enumerate(quotes) if quote is MISSING]
+    for start in range(0, len(misses), QUOTE_CHUNK_SIZE):
+        if on_progress is not None:
+            on_progress(start / len(misses))
+        chunk = misses[start:start + QUOTE_CHUNK_SIZE]
+        priced = quotes_to_list(price_quotes(**{name: [column[index] for index in chunk] for name, column in columns.items()},
+                                             **fuel_prices))
+        for index, quote in zip(chunk, priced):
+            _quote_cache.set(keys[index], quote)
+            quotes[index] = quote
+    return quotes, len(items) - len(misses)
+
+
+def quote_cache_info():
+    return _quote_cache.info()
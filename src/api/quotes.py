@@ -0,0 +1,153 @@
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+from api.utils import APIException
+
+# Motor de presupuestos: mismas fórmulas que src/front/js/component/calculateDistance.js,
+# vectorizadas con NumPy para presupuestar miles de rutas en una sola llamada
+
+# Consumo base en litros cada 100 km según el tipo de contenedor
+BASE_FUEL_CONSUMPTION = {'20': 28.0, '20reefer': 28.0, '40': 32.0, '40reefer': 32.0}
+DEFAULT_FUEL_CONSUMPTION = 30.0
+
+# El consumo aumenta un 2% por cada tonelada por encima de 20
+FUEL_WEIGHT_THRESHOLD = 20.0
+FUEL_WEIGHT_FACTOR = 0.02
+
+# Peso máximo (toneladas) antes de aplicar el recargo por exceso de peso
+WEIGHT_LIMITS = {'20': 25.0, '20reefer': 25.0, '40': 24.0, '40reefer': 24.0}
+WEIGHT_SURCHARGE = 0.25
+
+# Cada opción adicional suma un 5% sobre el precio base
+ADDITIONAL_OPTIONS = ('Nocturnidad', 'Mercancía peligrosa', 'Festivo', 'Basculante')
+OPTION_SURCHARGE = 0.05
+
+# Precios del combustible (€/litro) para el BAF y coste del conductor (€/km)
+BASE_FUEL_PRICE = 1.10
+CURRENT_FUEL_PRICE = 1.50
+DRIVER_COST_PER_KM = 0.80
+
+# Máximo de presupuestos por petición en /api/quotes/batch
+MAX_BATCH_QUOTES = 10000
+
+QUOTE_FIELDS = ('distance_km', 'duration_hours', 'fuel_consumption', 'baf_cost', 'driver_cost', 'operational_cost',
+                'base_price', 'weight_surcharge', 'options_surcharge', 'final_price', 'profit')
+
+
+# Calcula los presupuestos de varias rutas a la vez. Todos los argumentos son secuencias de la misma
+# longitud salvo los precios del combustible. Devuelve un diccionario de arrays (uno por campo)
+def price_quotes(distance_km, duration_hours, container_types, weights, tariffs, option_counts,
+                 base_fuel_price=BASE_FUEL_PRICE, fuel_price=CURRENT_FUEL_PRICE):
+    distance_km = np.asarray(distance_km, dtype=np.float64)
+    duration_hours = np.asarray(duration_hours, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    tariffs = np.asarray(tariffs, dtype=np.float64)
+    option_counts = np.asarray(option_counts, dtype=np.float64)
+
+    base_consumption = np.array([BASE_FUEL_CONSUMPTION.get(container, DEFAULT_FUEL_CONSUMPTION)
+                                 for container in container_types], dtype=np.float64)
+    weight_limits = np.array([WEIGHT_LIMITS.get(container, np.inf) for container in container_types],
+                             dtype=np.float64)
+
+    # Consumo de combustible ajustado por peso y coste BAF por la diferencia de precio
+    adjusted_consumption = base_consumption * (1 + np.maximum(0.0, weights - FUEL_WEIGHT_THRESHOLD) * FUEL_WEIGHT_FACTOR)
+    fuel_consumption = adjusted_consumption / 100 * distance_km
+    baf_cost = (fuel_price - base_fuel_price) * fuel_consumption
+
+    driver_cost = distance_km * DRIVER_COST_PER_KM
+    operational_cost = baf_cost + driver_cost
+
+    # Precio base por kilómetro y recargos sobre el precio base
+    base_price = distance_km * tariffs
+    weight_surcharge = np.where(weights > weight_limits, base_price * WEIGHT_SURCHARGE, 0.0)
+    options_surcharge = base_price * option_counts * OPTION_SURCHARGE
+
+    final_price = base_price + weight_surcharge + options_surcharge
+
+    return {
+        'distance_km': distance_km,
+        'duration_hours': duration_hours,
+        'fuel_consumption': fuel_consumption,
+        'baf_cost': baf_cost,
+        'driver_cost': driver_cost,
+        'operational_cost': operational_cost,
+        'base_price': base_price,
+        'weight_surcharge': weight_surcharge,
+        'options_surcharge': options_surcharge,
+        'final_price': final_price,
+        'profit': final_price - operational_cost,
+    }
+
+
+# Redondea a céntimos igual que toFixed(2) en el frontend: los empates exactos se alejan del cero
+# (np.round los lleva al par: 125.625 daría 125.62 en lugar de 125.63). Los valores cercanos a un
+# empate se redondean con Decimal sobre el valor binario exacto, como hace JavaScript
+def round_cents(values):
+    values = np.asarray(values, dtype=np.float64)
+    scaled = np.abs(values) * 100
+    rounded = np.copysign(np.floor(scaled + 0.5), values) / 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for index in np.flatnonzero(near_tie):
+        rounded[index] = float(Decimal(float(values[index])).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+    return rounded
+
+
+# Convierte el resultado columnar en una lista de presupuestos redondeados a céntimos
+def quotes_to_list(result):
+    columns = [round_cents(result[field]).tolist() for field in QUOTE_FIELDS]
+    return [dict(zip(QUOTE_FIELDS, values)) for values in zip(*columns)]
+
+
+# `label` identifica el presupuesto en los mensajes de error
+def _number(item, key, label, required=True, default=0.0):
+    value = item.get(key)
+    if value is None or value == '':
+        if required:
+            raise APIException(f"{label}: falta el campo '{key}'.", status_code=400)
+        return default
+    if isinstance(value, bool):
+        raise APIException(f"{label}: '{key}' debe ser un número.", status_code=400)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise APIException(f"{label}: '{key}' debe ser un número.", status_code=400)
+    if not np.isfinite(number) or number < 0:
+        raise APIException(f"{label}: '{key}' debe ser un número positivo.", status_code=400)
+    return number
+
+
+# Valida los datos de entrada y los separa en columnas para price_quotes
+def parse_quote_items(items):
+    if not isinstance(items, list) or not items:
+        raise APIException("Se esperaba una lista de presupuestos no vacía.", status_code=400)
+    if len(items) > MAX_BATCH_QUOTES:
+        raise APIException(f"Como máximo se admiten {MAX_BATCH_QUOTES} presupuestos por petición.", status_code=400)
+
+    columns = {'distance_km': [], 'duration_hours': [], 'container_types': [], 'weights': [], 'tariffs': [], 'option_counts': []}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise APIException(f"Presupuesto {index}: se esperaba un objeto JSON.", status_code=400)
+
+        container = item.get('container_type') or ''
+        if container and container not in BASE_FUEL_CONSUMPTION:
+            raise APIException(f"Presupuesto {index}: tipo de contenedor no válido: {container}", status_code=400)
+
+        options = item.get('options') or []
+        if not isinstance(options, list) or any(option not in ADDITIONAL_OPTIONS for option in options):
+            raise APIException(f"Presupuesto {index}: opciones no válidas. Opciones disponibles: {', '.join(ADDITIONAL_OPTIONS)}", status_code=400)
+
+        label = f"Presupuesto {index}"
+        columns['distance_km'].append(_number(item, 'distance_km', label))
+        columns['duration_hours'].append(_number(item, 'duration_hours', label, required=False))
+        columns['container_types'].append(container)
+        columns['weights'].append(_number(item, 'weight', label, required=False))
+        columns['tariffs'].append(_number(item, 'tariff', label))
+        columns['option_counts'].append(len(set(options)))
+    return columns
+
+
+# Precios del combustible de la petición (por defecto los de referencia)
+def parse_fuel_prices(data):
+    return {
+        'base_fuel_price': _number(data, 'base_fuel_price', 'Petición', required=False, default=BASE_FUEL_PRICE),
+        'fuel_price': _number(data, 'fuel_price', 'Petición', required=False, default=CURRENT_FUEL_PRICE),
+    }
@@ -1,11 +1,31 @@
+import hmac
 import os
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from flask_mail import Mail
 from itsdangerous import URLSafeTimedSerializer
-from api.models import db, Address, Company, User, ContactMessage, Vehicle, Client, Partner, PasswordResetToken, user_schema
+from api.models import db, Address, Company, User, ContactMessage, Vehicle, Client, Partner, PasswordResetToken, Job, user_schema, COMPANY_RELATIONS
+from api.pagination import keyset_page
+from api.search import search_page
+from api.quotes import parse_fuel_prices
+from api.quote_cache import cached_quotes, quote_cache_info
+from api.carriers import CarrierRates, parse_carrier_routes, carrier_costs, rank_carriers, parse_limit, MAX_CARRIERS
+from api.geocoding import geocode_address, address_points
+from api.spatial import company_index, index_address_write, parse_query_point, spatial_index_info, MAX_NEAREST, DEFAULT_NEAREST, MAX_RADIUS_KM, MAX_WITHIN_RESULTS
+from api.planning import optimize_stops, plan_fleet
+from api.jobs import submit_job, cancel_job, result_chunks, JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED, NDJSON_RESULT_KINDS
+from api.export import export_chunks, EXPORT_COLLECTIONS
+from api.geo import distance_matrix, parse_points, parse_positive, matrix_to_list, CIRCUITY_FACTOR, AVERAGE_SPEED_KMH
+from api.serializers import json_response, dumps
+from api.bulk import iter_records, clean_record, insert_in_batches, upsert_in_batches, CSV_MIMETYPES, NDJSON_MIMETYPES, MAX_REPORTED_ERRORS
+from api.db_pool import pool_status
+from api.versioning import bump_collection_version, check_collection_etag, cached_collection, with_etag, not_modified
+from api.cache import cache_info
+from api.security import hash_password, verify_password, needs_rehash, reset_token_digest, PasswordHashingBusy
+from api.identity import create_user_token, current_identity, public_profile, resolve_company_id, company_for_request, optional_identity, refresh_identity_cookie
+from sqlalchemy.exc import IntegrityError
+from api.utils import APIException
 from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity, unset_jwt_cookies, set_access_cookies, create_refresh_token, set_refresh_cookies
 
 
@@ -32,13 +52,32 @@ def handle_hello():
 
 # USUARIOS + REGISTER/LOGIN
 
-# Obtener todos los usuarios
+# Respuesta cuando la cola de hashes de contraseñas está llena (picos de inicios de sesión)
+def _hashing_busy_response():
+    response = jsonify({"error": "El servidor está ocupado. Por favor, inténtalo de nuevo en unos segundos."})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+# Obtener los usuarios de la compañía (paginado)
 @api.route('/api/users', methods=['GET'])
 def get_all_users():
 
     try:
-        users = User.query.all()
-        return jsonify([user.serialize() for user in users]), 200
+        # company_id del JWT o, sin sesión iniciada, de la query string; nunca se listan todas las compañías
+        company_id = resolve_company_id(allow_query=True)
+        if not company_id:
+            return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+        etag, is_fresh = check_collection_etag(company_id, 'users')
+        if is_fresh:
+            return not_modified(etag)
+
+        page = cached_collection(company_id, 'users', etag,
+                                 lambda: keyset_page(db.session, User, request.args, company_id=company_id))
+        return with_etag(json_response(page), etag)
+    except APIException:
+        raise
     except Exception as e:
         print(f"Error en /api/users: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
@@ -74,16 +113,17 @@ def create_user():
         if (existing_user):
             return jsonify({"error": "El usuario ya está registrado"}), 409
         
+        # Hashear la contraseña antes de tocar la base de datos: si el pool está ocupado (503)
+        # no queda ninguna compañía creada sin usuario
+        hashed_password = hash_password(password)
+
         # Obtener o crear la compañía
         company = Company.query.filter_by(name=company_name).first()
         if not company:
-            # Si no existe la compañía, crearla
+            # Si no existe la compañía, crearla; se confirma junto con el usuario
             company = Company(name=company_name)
             db.session.add(company)
-            db.session.commit()  # Asegurarse de que la compañía se guarde antes de asociarla
-
-        # Hashear la contraseña antes de almacenarla
-        hashed_password = generate_password_hash(password)
+            db.session.flush()  # Asigna el id para asociarla al usuario
 
         # Crear el usuario
         new_user = User(
@@ -97,10 +137,11 @@ def create_user():
 
         # Agregar el usuario a la base de datos
         db.session.add(new_user)
+        bump_collection_version(company.id, 'users')
         db.session.commit()
 
-        # Crear un token JWT incluyendo el company_id
-        access_token = create_access_token(identity=str(new_user.id), additional_claims={"company_id": company.id, "location": new_user.location})
+        # Crear un token JWT con los datos del usuario y de su compañía
+        access_token = create_user_token(new_user, company)
 
         # Respuesta exitosa con el token
         return jsonify({
@@ -110,6 +151,8 @@ def create_user():
 
     except KeyError as e:
         return jsonify({"error": f"Falta el campo: {str(e)}"}), 400
+    except PasswordHashingBusy:
+        return _hashing_busy_response()
     except Exception as e:
         print(f"Error en /api/register: {e}")
         return jsonify({"error": f"Ocurrió un error inesperado: {str(e)}"}), 500
@@ -138,8 +181,17 @@ def login_user():
             return jsonify({"error": "El usuario no existe. Verifica el email ingresado."}), 404
         
         # Verifica la contraseña
-        if not check_password_hash(user.password_hash, password):
+        if not verify_password(user.password_hash, password):
             return jsonify({"error": "La contraseña ingresada es incorrecta."}), 401
+
+        # Si el hash se generó con un método o coste antiguo se actualiza de forma transparente
+        # (si la cola está llena se deja para el siguiente inicio de sesión)
+        if needs_rehash(user.password_hash):
+            try:
+                user.password_hash = hash_password(password)
+                db.session.commit()
+            except PasswordHashingBusy:
+                pass
         
         # Obtener datos de la compañía
         company = Company.query.filter_by(id=user.company_id).first()
@@ -148,7 +200,8 @@ def login_user():
 
         # Configura la duración del token según la opción "Recuérdame"
         expires_delta = timedelta(days=365) if remember_me else timedelta(hours=1)
-        access_token = create_access_token(identity=str(user.id), expires_delta=expires_delta)
+        # El token lleva los datos del perfil y de la compañía: los endpoints autenticados no consultan la BD
+        access_token = create_user_token(user, company, expires_delta)
         refresh_token = create_refresh_token(identity=str(user.id))
 
         # Crea la respuesta con cookies HTTP-only
@@ -157,6 +210,9 @@ def login_user():
         set_refresh_cookies(response, refresh_token, max_age=2592000)
         return response, 200
 
+    except PasswordHashingBusy:
+        return _hashing_busy_response()
+
     except KeyError as e:
         current_app.logger.error(f"Clave faltante en /api/login: {e}")
         return jsonify({"error": "Faltan campos obligatorios en el cuerpo de la solicitud."}), 400
@@ -182,9 +238,9 @@ def request_password_reset():
     # Generar un token de recuperación
     token = create_access_token(identity=str(user.id), expires_delta=timedelta(minutes=15))
 
-    # Almacenar el token en la base de datos
+    # Almacenar la huella del token en la base de datos
     reset_token = PasswordResetToken(
-        token=token,
+        token_hash=reset_token_digest(token),
         user_id=user.id,
         expires_at=datetime.utcnow() + timedelta(minutes=15)
     )
@@ -208,7 +264,8 @@ def reset_password():
     if not token or not new_password:
         return jsonify({"message": "Token y nueva contraseña son obligatorios."}), 400
 
-    reset_token = PasswordResetToken.query.filter_by(token=token).first()
+    # Búsqueda por la huella del token (índice único)
+    reset_token = PasswordResetToken.query.filter_by(token_hash=reset_token_digest(token)).first()
 
     if not reset_token or reset_token.expires_at < datetime.utcnow():
         return jsonify({"message": "El enlace de recuperación es inválido o ha expirado."}), 400
@@ -218,7 +275,10 @@ def reset_password():
         return jsonify({"message": "Usuario no encontrado."}), 404
 
     # Actualizar la contraseña del usuario
-    user.password_hash = generate_password_hash(new_password)
+    try:
+        user.password_hash = hash_password(new_password)
+    except PasswordHashingBusy:
+        return _hashing_busy_response()
 
     # Invalidar el token después de usarlo
     db.session.delete(reset_token)
@@ -230,24 +290,14 @@ def reset_password():
 @api.route('/api/users/me', methods=['GET'])
 @jwt_required(locations=["cookies"])
 def get_current_user():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user:
+    # Datos del usuario y de su compañía desde las claims del token (sin consultar users ni companies)
+    identity = current_identity()
+
+    if not identity:
         return jsonify({"error": "Usuario no encontrado."}), 404
-    
-    # Acceder a la compaía del usuario
-    company = user.company  # Accede al objeto relacionado 'Company' gracias a db.Relationship
-    
+
     # Devolver los datos del usuario junto con el nombre de la compañía
-    return jsonify({
-        "name": user.name,
-        "last_name": user.last_name,
-        "email": user.email,
-        "location": user.location,
-        "company": company.name,
-        "created_at": user.created_at           
-    }), 200
+    return jsonify(public_profile(identity)), 200
     
 
 
@@ -266,17 +316,54 @@ def logout():
 companies_bp = Blueprint('companies', __name__)
 
 # Obtener todas las compañías registradas
+# ?include=users,addresses,... añade las relaciones indicadas (una consulta por relación)
 @companies_bp.route('/api/companies', methods=['GET'])
 def get_companies():
     try:
-        companies = Company.query.all()
-        return jsonify([company.serialize() for company in companies]), 200
+        include = [relation.strip() for relation in request.args.get('include', '').split(',') if relation.strip()]
+        invalid = [relation for relation in include if relation not in COMPANY_RELATIONS]
+        if invalid:
+            return jsonify({"error": f"Relaciones no válidas en 'include': {', '.join(invalid)}"}), 400
+        include = list(dict.fromkeys(include))
+
+        companies = Company.query.order_by(Company.id).all()
+        if include:
+            Company.load_relations(companies, include, db.select(Company.id))
+
+        return jsonify([company.serialize(include=include) for company in companies]), 200
     except Exception as e:
         print(f"Error en /api/companies: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
 
 
+# Exportar todas las entidades de una compañía como NDJSON (una entidad JSON por línea)
+# La respuesta se genera en streaming para que la memoria no crezca con el tamaño de la compañía
+# Sólo la puede descargar un usuario de la propia compañía
+@companies_bp.route('/api/companies/<int:id>/export', methods=['GET'])
+@jwt_required(locations=["cookies"])
+def export_company(id):
+    identity = current_identity()
+    if not identity or identity['company_id'] != id:
+        return jsonify({"error": "No tienes permiso para exportar esta compañía."}), 403
+
+    company = db.session.get(Company, id)
+    if not company:
+        return jsonify({"error": "Compañía no encontrada."}), 404
+
+    header = company.serialize(include=())
+
+    def generate():
+        yield dumps({"type": "company", "data": header}) + b"\n"
+
+        for collection, model in EXPORT_COLLECTIONS:
+            yield from export_chunks(collection, model, id)
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=company-{id}.ndjson'
+    return response
+
+
 # DIRECCIONES
 
 # Define el blueprint para las direcciones
@@ -296,18 +383,28 @@ def get_addresses():
     
     try:
 
-        # Obtener el company_id de los parámetros de la consulta (query string)
-        company_id = request.args.get('company_id')
+        # company_id del JWT o, sin sesión iniciada, de los parámetros de la consulta (query string)
+        company_id = resolve_company_id(allow_query=True)
 
         if not company_id:
             return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
 
-        # Filtrar las direcciones por el company_id
-        addresses = Address.query.filter_by(company_id=company_id).all()
-
-        # Serializar las direcciones
-        return jsonify([address.serialize() for address in addresses]), 200
-
+        # Página de direcciones de la compañía (limit, cursor y fields en la query string)
+        # Con ?q= se buscan por nombre o calle y se ordenan por relevancia
+        # Si el cliente ya tiene esta versión del listado se responde 304 sin consultar las direcciones
+        etag, is_fresh = check_collection_etag(company_id, 'addresses')
+        if is_fresh:
+            return not_modified(etag)
+
+        if request.args.get('q') is not None:
+            loader = lambda: search_page(db.session, Address, request.args, company_id)
+        else:
+            loader = lambda: keyset_page(db.session, Address, request.args, company_id=company_id)
+        page = cached_collection(company_id, 'addresses', etag, loader)
+        return with_etag(json_response(page), etag)
+
+    except APIException:
+        raise
     except Exception as e:
         print(f"Error en /api/addresses: {e}")
         return jsonify({"error": f"Ocurrió un error en el servidor: {str(e)}"}), 500
@@ -329,7 +426,6 @@ def add_address():
         print(f"Datos recibidos: {data}")  # Verifica qué datos está recibiendo la BD
 
         # Obtener los campos del cuerpo de la solicitud
-        id = data.get('id')
         name = data.get('name')
         address = data.get('address')
         category = data.get('category')
@@ -351,7 +447,6 @@ def add_address():
 
         # Crear nueva instancia de Addresses asociada a la compañía
         new_address = Address(
-            id=id,
             name=name,
             address=address,
             category=category,
@@ -361,9 +456,14 @@ def add_address():
             created_at=created_at
         )
 
+        # Coordenadas desde la caché de geocodificación o los proveedores locales
+        geocode_address(new_address)
+
         # Añadir y confirmar la transacción en la base de datos
         db.session.add(new_address)
+        bump_collection_version(company_id, 'addresses')
         db.session.commit()
+        index_address_write(company_id, new_address.id, new_address.latitude, new_address.longitude, new_address.category)
 
         # Retornar la nueva dirección con el método serialize()
         return jsonify(new_address.serialize()), 201
@@ -373,6 +473,114 @@ def add_address():
         return jsonify({"error": f"Ocurrió un error en el servidor: {str(e)}"}), 500
 
 
+# Respuesta de las consultas espaciales: las direcciones encontradas con su distancia, en orden
+def _spatial_results(matches):
+    addresses = {address.id: address for address in Address.query.filter(Address.id.in_([address_id for address_id, _ in matches]))}
+    return [dict(addresses[address_id].serialize(), distance_km=round(km, 3)) for address_id, km in matches if address_id in addresses]
+
+# Las k direcciones geocodificadas más cercanas a un punto (distancia en línea recta)
+# ?lat=&lng= o ?address_id=, k (por defecto 10), category y max_km opcionales
+@addresses_bp.route('/api/addresses/nearest', methods=['GET'])
+def get_nearest_addresses():
+    try:
+        company_id = resolve_company_id()
+        if not company_id:
+            return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+        lat, lng, origin_id = parse_query_point(request.args, company_id)
+        k = request.args.get('k', DEFAULT_NEAREST, type=int)
+        if not 1 <= k <= MAX_NEAREST:
+            return jsonify({"error": f"'k' debe estar entre 1 y {MAX_NEAREST}."}), 400
+        max_km = request.args.get('max_km', type=float)
+
+        # La dirección de origen no cuenta como resultado
+        matches = company_index(company_id).nearest(lat, lng, k + (origin_id is not None), request.args.get('category'), max_km)
+        matches = [match for match in matches if match[0] != origin_id][:k]
+        return jsonify({"addresses": _spatial_results(matches)}), 200
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/addresses/nearest: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Direcciones geocodificadas a menos de radius_km de un punto, de la más cercana a la más lejana
+# ?lat=&lng= o ?address_id=, radius_km, category y limit opcionales
+@addresses_bp.route('/api/addresses/within', methods=['GET'])
+def get_addresses_within():
+    try:
+        company_id = resolve_company_id()
+        if not company_id:
+            return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+        lat, lng, origin_id = parse_query_point(request.args, company_id)
+        radius_km = request.args.get('radius_km', type=float)
+        if radius_km is None or not 0 < radius_km <= MAX_RADIUS_KM:
+            return jsonify({"error": f"'radius_km' debe ser mayor que 0 y como máximo {MAX_RADIUS_KM}."}), 400
+        limit = request.args.get('limit', MAX_WITHIN_RESULTS, type=int)
+        if not 1 <= limit <= MAX_WITHIN_RESULTS:
+            return jsonify({"error": f"'limit' debe estar entre 1 y {MAX_WITHIN_RESULTS}."}), 400
+
+        matches = company_index(company_id).within(lat, lng, radius_km, request.args.get('category'), limit + (origin_id is not None))
+        matches = [match for match in matches if match[0] != origin_id][:limit]
+        return jsonify({"addresses": _spatial_results(matches)}), 200
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/addresses/within: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+
+# Importación masiva de direcciones (CSV o NDJSON)
+# Las filas válidas se insertan en lotes y las inválidas se devuelven en el informe de errores
+@addresses_bp.route('/api/addresses/bulk', methods=['POST'])
+def bulk_import_addresses():
+    company_id = resolve_company_id()
+    if not company_id:
+        return jsonify({"error": "Su usuario no está asignado a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+    if request.mimetype not in CSV_MIMETYPES + NDJSON_MIMETYPES:
+        return jsonify({"error": "El cuerpo debe ser CSV (text/csv) o NDJSON (application/x-ndjson)."}), 415
+
+    if not db.session.get(Company, company_id):
+        return jsonify({"error": "Compañía no encontrada."}), 404
+
+    report = {"inserted": 0, "rejected": 0, "errors": []}
+    created_at = datetime.utcnow()
+
+    # Validación en streaming: sólo las filas correctas llegan a la inserción por lotes
+    def valid_rows():
+        for line, record, error in iter_records(request.stream, request.mimetype):
+            errors = [error] if error else []
+            if record is not None:
+                values, errors = clean_record(Address, record, ['name', 'address', 'category'], ['contact', 'comments'])
+
+            if errors:
+                report["rejected"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"line": line, "errors": errors})
+                continue
+
+            values['company_id'] = company_id
+            values['created_at'] = created_at
+            yield values
+
+    try:
+        report["inserted"] = insert_in_batches(Address.__table__, valid_rows())
+        if report["inserted"]:
+            bump_collection_version(company_id, 'addresses')
+        db.session.commit()
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({"error": "El fichero debe estar codificado en UTF-8."}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error en /api/addresses/bulk: {e}")
+        return jsonify({"error": f"Ocurrió un error en el servidor: {str(e)}"}), 500
+
+    report["errors_truncated"] = report["rejected"] > len(report["errors"])
+    return jsonify(report), 200
+
+
 # Editar dirección
 @addresses_bp.route('/api/addresses/<int:id>', methods=['PUT'])
 def update_address(id):
@@ -404,14 +612,21 @@ def update_address(id):
             return jsonify({"error": "No tienes permiso para editar esta dirección."}), 403
 
         # Actualizar los campos
+        previous_address = address.address
         address.name = data.get('name', address.name)
         address.address = data.get('address', address.address)
         address.category = data.get('category', address.category)
         address.contact = data.get('contact', address.contact)
         address.comments = data.get('comentarios', address.comments)
 
+        # Si cambia la dirección se vuelve a geocodificar
+        if address.address != previous_address:
+            geocode_address(address)
+
         # Confirmar la transacción en la base de datos
+        bump_collection_version(address.company_id, 'addresses')
         db.session.commit()
+        index_address_write(address.company_id, address.id, address.latitude, address.longitude, address.category)
 
         # Retornar la dirección actualizada
         return jsonify(address.serialize()), 200
@@ -445,12 +660,14 @@ def delete_direccion(id):
             return jsonify({"error": "Dirección no encontrada."}), 404
 
         # Verificar que el company_id del usuario coincida con el de la dirección
-        if address.user_id != company_id:
+        if address.company_id != company_id:
             return jsonify({"error": "No tienes permiso para eliminar esta dirección"}), 403
 
         # Eliminar la dirección de la base de datos
         db.session.delete(address)
+        bump_collection_version(company_id, 'addresses')
         db.session.commit()
+        index_address_write(company_id, id)
 
         # Retornar un mensaje de éxito
         return jsonify({"message": "Dirección eliminada con éxito."}), 200
@@ -478,18 +695,28 @@ def get_clients():
         # return jsonify({"error": "Su usuario no está asociado a una compañía registrada. Por favor, contacte con el Administrador."}), 403
 
     try:
-        # Obtener el company_id de los parámetros de la consulta
-        company_id = request.args.get('company_id')
+        # company_id del JWT o, sin sesión iniciada, de los parámetros de la consulta
+        company_id = resolve_company_id(allow_query=True)
 
         if not company_id:
             return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
 
-        # Filtrar los clientes por el company_id
-        clients = Client.query.filtery_by(company_id=company_id).all()
-
-        # Serializar los clientes
-        return jsonify([client.serialize() for client in clients])
+        # Página de clientes de la compañía (limit, cursor y fields en la query string)
+        # Con ?q= se buscan por nombre, apellidos, NIF o dirección y se ordenan por relevancia
+        # Si el cliente ya tiene esta versión del listado se responde 304 sin consultar los clientes
+        etag, is_fresh = check_collection_etag(company_id, 'clients')
+        if is_fresh:
+            return not_modified(etag)
+
+        if request.args.get('q') is not None:
+            loader = lambda: search_page(db.session, Client, request.args, company_id)
+        else:
+            loader = lambda: keyset_page(db.session, Client, request.args, company_id=company_id)
+        page = cached_collection(company_id, 'clients', etag, loader)
+        return with_etag(json_response(page), etag)
     
+    except APIException:
+        raise
     except Exception as e:
         print(f"Error en /api/clients: {e}")
         return jsonify({"error": f"Ocurrió un error en el servidor: {str(e)}"}), 500
@@ -510,9 +737,8 @@ def add_client():
         print(f"Datos recibidos: {data}")  # Verifica qué datos está recibiendo la BD
 
         # Obtener los campos del cuerpo de la solicitud
-        id = data.get('id')
         first_name = data.get('first_name')
-        last_name = data.get('lastname')
+        last_name = data.get('last_name', data.get('lastname'))
         nif = data.get('nif')
         phone = data.get('phone')
         email = data.get('email')
@@ -533,7 +759,6 @@ def add_client():
         
         # Crear nueva instancia de Clients asociado a la compañía
         new_client = Client(
-            id=id,
             first_name=first_name, 
             last_name=last_name,
             nif=nif,
@@ -546,11 +771,15 @@ def add_client():
 
         # Añadir y confirmar la transacción en la base de datos
         db.session.add(new_client)
+        bump_collection_version(company_id, 'clients')
         db.session.commit()
 
         # Retornar la nueva dirección con el método serialize()
         return jsonify(new_client.serialize()), 201
     
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "Ya existe un cliente con ese NIF en la compañía."}), 409
     except Exception as e:
         print(f"Error en /api/clients: {e}") # Imprime el error en la consola
         return jsonify({"error": f"Ocurrió un error en el servidor: {str(e)}"}), 500
@@ -586,6 +815,8 @@ def update_client(id):
         if client.company_id != company_id:
             return jsonify({"error": "No tienes permiso para editar esta dirección."}), 403
         
+        previous_company_id = client.company_id
+
         #Actualizar los campos
         client.first_name = data.get('first_name', client.first_name)
         client.last_name = data.get('last_name', client.last_name)
@@ -597,16 +828,106 @@ def update_client(id):
         client.created_at = data.get('created_at', client.created_at)
 
         # Confirmar la transacción en la base de datos
+        bump_collection_version(previous_company_id, 'clients')
+        if client.company_id != previous_company_id:
+            bump_collection_version(client.company_id, 'clients')
         db.session.commit()
 
         # Retornar la dirección actualizada
         return jsonify(client.serialize()), 200
     
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "Ya existe un cliente con ese NIF en la compañía."}), 409
     except Exception as e:
         print(f"Error en /api/clients/{id}: {e}")
         return jsonify({"error": f"Ocurrió un error en el servidor: {str(e)}"}), 500
 
 
+# Máximo de clientes por petición en el alta/actualización masiva
+MAX_BULK_CLIENTS = 10000
+
+# Alta o actualización masiva de clientes por (company_id, nif) en una sola transacción
+# La compañía es la del JWT; un company_id distinto en el cuerpo responde 403
+@clients_bp.route('/api/clients/bulk', methods=['POST'])
+def bulk_upsert_clients():
+    data = request.get_json(silent=True) or {}
+    clients = data.get('clients')
+
+    try:
+        requested_company_id = int(data['company_id']) if data.get('company_id') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "'company_id' debe ser un número."}), 400
+
+    company_id = company_for_request(optional_identity(), requested_company_id)
+    if not company_id:
+        return jsonify({"error": "Su usuario no está asignado a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+    if not isinstance(clients, list):
+        return jsonify({"error": "'clients' debe ser una lista de clientes."}), 400
+    if len(clients) > MAX_BULK_CLIENTS:
+        return jsonify({"error": f"Se admiten como máximo {MAX_BULK_CLIENTS} clientes por petición."}), 413
+
+    if not db.session.get(Company, company_id):
+        return jsonify({"error": "Compañía no encontrada."}), 404
+
+    created_at = datetime.utcnow()
+    rows = []
+    errors = []
+    seen_nifs = {}
+
+    for index, record in enumerate(clients):
+        if not isinstance(record, dict):
+            errors.append({"index": index, "errors": ["Cada cliente debe ser un objeto JSON."]})
+            continue
+
+        values, record_errors = clean_record(Client, record, ['first_name', 'last_name'], ['nif', 'phone', 'email', 'address'])
+
+        # Un mismo NIF no puede aparecer dos veces en la misma sentencia ON CONFLICT
+        nif = values['nif']
+        if nif and nif in seen_nifs:
+            record_errors.append(f"NIF repetido en la petición (ya aparece en el índice {seen_nifs[nif]}).")
+
+        if record_errors:
+            errors.append({"index": index, "errors": record_errors})
+            continue
+
+        if nif:
+            seen_nifs[nif] = index
+        values['company_id'] = company_id
+        values['created_at'] = created_at
+        rows.append(values)
+
+    try:
+        # Los NIF que ya existen en la compañía se contarán como actualizados
+        nifs = list(seen_nifs)
+        existing = set()
+        for start in range(0, len(nifs), 1000):
+            existing.update(db.session.execute(
+                db.select(Client.nif).where(Client.company_id == company_id, Client.nif.in_(nifs[start:start + 1000]))
+            ).scalars())
+
+        if rows:
+            upsert_in_batches(Client.__table__, rows, ['company_id', 'nif'], ['first_name', 'last_name', 'phone', 'email', 'address'])
+            bump_collection_version(company_id, 'clients')
+        db.session.commit()
+    except APIException:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error en /api/clients/bulk: {e}")
+        return jsonify({"error": f"Ocurrió un error en el servidor: {str(e)}"}), 500
+
+    return jsonify({
+        "inserted": len(rows) - len(existing),
+        "updated": len(existing),
+        "rejected": len(errors),
+        "errors": errors[:MAX_REPORTED_ERRORS],
+        "errors_truncated": len(errors) > MAX_REPORTED_ERRORS
+    }), 200
+
+
 # Eliminar un cliente
 @api.route('/api/clients/<int:id>', methods=['DELETE'])
 def delete_client(id):
@@ -620,6 +941,7 @@ def delete_client(id):
 
     client = Client.query.get_or_404(id)
     db.session.delete(client)
+    bump_collection_version(client.company_id, 'clients')
     db.session.commit()
     return '', 204
 
@@ -639,21 +961,20 @@ def obtener_vehicles():
         # return jsonify({"error": "Su usuario no está asociado a una compañía registrada. Por favor, contacte con el Administrador."}), 403
 
     try:
-        vehicles = Vehicle.query.all()  # Obtiene todos los vehículos de la base de datos
-        return jsonify([{
-            'id': vehicle.id,
-            'name': vehicle.name,
-            'plate': vehicles.plate,
-            'tow': vehicle.tow,
-            'cost_km': vehicle.cost_km,
-            'cost_hour': vehicle.cost_hour,
-            'axles': vehicle.axles,
-            'weight': vehicle.weight,
-            'fuel': vehicle.fuel,
-            'emissions': vehicle.emissions,
-            'company_id': vehicle.company_id,
-            'created_at': vehicle.created_at.isoformat()  # Formatea la fecha
-        } for vehicle in vehicles]), 200
+        # Página de vehículos de la compañía: la del JWT o, sin sesión iniciada, la de la query string
+        company_id = resolve_company_id(allow_query=True)
+        if not company_id:
+            return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+        etag, is_fresh = check_collection_etag(company_id, 'vehicles')
+        if is_fresh:
+            return not_modified(etag)
+
+        page = cached_collection(company_id, 'vehicles', etag,
+                                 lambda: keyset_page(db.session, Vehicle, request.args, company_id=company_id))
+        return with_etag(json_response(page), etag)
+    except APIException:
+        raise
     except Exception as e:
         return {"error": str(e)}, 500  # Devuelve un error si ocurre un problema
 
@@ -677,29 +998,29 @@ def crear_vehicle():
 
     # Validación de campos numéricos
     try:
-        cost_km = float(data['cost_km']) if data['cost_km'] else None
-        cost_hour = float(data['cost_hour']) if data['cost_hour'] else None
-        axles = int(data['axles']) if data['axles'] else None
-        weight = float(data['weight']) if data['weight'] else None
+        cost_km = float(data['cost_km']) if data.get('cost_km') else None
+        cost_hour = float(data['cost_hour']) if data.get('cost_hour') else None
+        axles = int(data['axles']) if data.get('axles') else None
+        weight = float(data['weight']) if data.get('weight') else None
     except ValueError:
         return {"error": "Los valores de Costo por Km, Costo por hora, Ejes y Peso deben ser numéricos."}, 400
 
     nuevo_vehicle = Vehicle(
         name=data['name'],
         plate=data['plate'],
-        tow=data['tow'],
-        costkm=cost_km,
+        tow=data.get('tow'),
+        cost_km=cost_km,
         cost_hour=cost_hour,
         axles=axles,
         weight=weight,
-        fuel=data['fuel'],
-        emissions=data['emissions'],
-        company_id=data['company_id'],
-        user_id=data['user_id']
+        fuel=data.get('fuel'),
+        emissions=data.get('emissions'),
+        company_id=data.get('company_id')
     )
     
     try:
         db.session.add(nuevo_vehicle)
+        bump_collection_version(nuevo_vehicle.company_id, 'vehicles')
         db.session.commit()
         return {"message": "Vehículo creado exitosamente"}, 201
     except Exception as e:
@@ -718,23 +1039,24 @@ def editar_vehicle(id):
     # if not company_id:
         # return jsonify({"error": "Su usuario no está asociado a una compañía registrada. Por favor, contacte con el Administrador."}), 403
 
-    vehicle = vehicle.query.get(id)
+    vehicle = Vehicle.query.get(id)
     
     if not vehicle:
         return jsonify({"message": "Vehículo no encontrado"}), 404
 
     data = request.get_json()
 
-    vehicle.nombre = data.get('nombre', vehicle.nombre)
-    vehicle.placa = data.get('placa', vehicle.placa)
-    vehicle.remolque = data.get('remolque', vehicle.remolque)
-    vehicle.costo_km = data.get('costo_km', vehicle.costo_km)
-    vehicle.costo_hora = data.get('costo_hora', vehicle.costo_hora)
-    vehicle.ejes = data.get('ejes', vehicle.ejes)
-    vehicle.peso = data.get('peso', vehicle.peso)
-    vehicle.combustible = data.get('combustible', vehicle.combustible)
-    vehicle.emision = data.get('emision', vehicle.emision)
-
+    vehicle.name = data.get('name', vehicle.name)
+    vehicle.plate = data.get('plate', vehicle.plate)
+    vehicle.tow = data.get('tow', vehicle.tow)
+    vehicle.cost_km = data.get('cost_km', vehicle.cost_km)
+    vehicle.cost_hour = data.get('cost_hour', vehicle.cost_hour)
+    vehicle.axles = data.get('axles', vehicle.axles)
+    vehicle.weight = data.get('weight', vehicle.weight)
+    vehicle.fuel = data.get('fuel', vehicle.fuel)
+    vehicle.emissions = data.get('emissions', vehicle.emissions)
+
+    bump_collection_version(vehicle.company_id, 'vehicles')
     db.session.commit()
     
     return jsonify({"message": "Vehículo actualizado exitosamente"}), 200
@@ -751,9 +1073,10 @@ def delete_vehicle(id):
     # if not company_id:
         # return jsonify({"error": "Su usuario no está asociado a una compañía registrada. Por favor, contacte con el Administrador."}), 403
 
-    vehicle = vehicle.query.get(id)
+    vehicle = Vehicle.query.get(id)
     if vehicle:
         db.session.delete(vehicle)
+        bump_collection_version(vehicle.company_id, 'vehicles')
         db.session.commit()
         return jsonify({'message': 'Vehículo eliminado exitosamente.'}), 200
     else:
@@ -781,12 +1104,14 @@ def update_user(user_id):
     user.name = data.get('name', user.name)
     user.last_name = data.get('last_name', user.last_name)
     user.email = data.get('email', user.email)
-    user.company = data.get('company', user.company)
     user.location = data.get('location', user.location)
 
+    bump_collection_version(user.company_id, 'users')
     db.session.commit()
 
-    return jsonify(user.serialize()), 200
+    # Si es el propio usuario se renueva su token para que las claims reflejen el perfil nuevo
+    response = jsonify(user.serialize())
+    return refresh_identity_cookie(response, user), 200
 
 
 # COLABORADORES
@@ -806,18 +1131,24 @@ def obtener_partners():
         # return jsonify({"error": "Su usuario no está asociado a una compañía registrada. Por favor, contacte con el Administrador."}), 403
 
     try:
-        # Obtener el user_id de los parámetros de la consulta (query string)
-        user_id = request.args.get('user_id')
+        # company_id del JWT o, sin sesión iniciada, de los parámetros de la consulta (query string)
+        company_id = resolve_company_id(allow_query=True)
 
-        if not user_id:
-            return jsonify({"error": "Falta el parámetro 'user_id'"}), 400
+        if not company_id:
+            return jsonify({"error": "Falta el parámetro 'company_id'"}), 400
 
-        # Filtrar los socios por el user_id
-        partners = Partner.query.filter_by(user_id=user_id).all()
+        # Página de socios de la compañía (limit, cursor y fields en la query string)
+        # Si el cliente ya tiene esta versión del listado se responde 304 sin consultar los socios
+        etag, is_fresh = check_collection_etag(company_id, 'partners')
+        if is_fresh:
+            return not_modified(etag)
 
-        # Serializar los socios
-        return jsonify([partner.serialize() for partner in partners]), 200
+        page = cached_collection(company_id, 'partners', etag,
+                                 lambda: keyset_page(db.session, Partner, request.args, company_id=company_id))
+        return with_etag(json_response(page), etag)
 
+    except APIException:
+        raise
     except Exception as e:
         print(f"Error en /api/partners: {e}")
         return jsonify({"error": f"Ocurrió un error en el servidor: {str(e)}"}), 500
@@ -839,30 +1170,31 @@ def agregar_partner():
         data = request.get_json()
 
         # Validar si se enviaron todos los campos necesarios
-        nombre = data.get('nombre')
+        name = data.get('name')
         email = data.get('email')
-        tipo_precio = data.get('tipo_precio')
-        precio = data.get('precio')
-        periodos_espera = data.get('periodos_espera')
-        incluir_peajes = data.get('incluir_peajes')
-        user_id = data.get('user_id')
+        price_type = data.get('price_type')
+        price = data.get('price')
+        waiting_periods = data.get('waiting_periods')
+        include_tolls = data.get('include_tolls', False)
+        company_id = data.get('company_id')
 
-        if not user_id or not nombre or not email or not tipo_precio:
+        if not company_id or not name or not email or not price_type:
             return jsonify({'error': 'Faltan datos'}), 400
 
         # Crear un nuevo socio
         nuevo_partner = Partner(
-            nombre=nombre,
+            name=name,
             email=email,
-            tipo_precio=tipo_precio,
-            precio=precio,
-            periodos_espera=periodos_espera,
-            incluir_peajes=incluir_peajes,
-            user_id=user_id,
+            price_type=price_type,
+            price=price,
+            waiting_periods=waiting_periods,
+            include_tolls=include_tolls,
+            company_id=company_id,
         )
 
         # Agregar el partner a la base de datos
         db.session.add(nuevo_partner)
+        bump_collection_version(company_id, 'partners')
         db.session.commit()
 
         # Devolver respuesta
@@ -885,7 +1217,7 @@ def editar_partner(email):
 
     try:
         # Buscar el socio por su email
-        partner = partner.query.filter_by(email=email).first()
+        partner = Partner.query.filter_by(email=email).first()
 
         if not partner:
             return jsonify({'error': 'partner no encontrado'}), 404
@@ -894,15 +1226,14 @@ def editar_partner(email):
         data = request.get_json()
 
         # Actualizar los datos del socio
-        partner.nombre = data.get('nombre', partner.nombre)
-        partner.tipo_precio = data.get('tipo_precio', partner.tipo_precio)
-        partner.precio = data.get('precio', partner.precio)
-        partner.periodos_espera = data.get('periodos_espera', partner.periodos_espera)
-        partner.incluir_peajes = data.get('incluir_peajes', partner.incluir_peajes)
-        partner.user_id = data.get('user_id', partner.user_id)
-        
+        partner.name = data.get('name', partner.name)
+        partner.price_type = data.get('price_type', partner.price_type)
+        partner.price = data.get('price', partner.price)
+        partner.waiting_periods = data.get('waiting_periods', partner.waiting_periods)
+        partner.include_tolls = data.get('include_tolls', partner.include_tolls)
 
         # Guardar los cambios en la base de datos
+        bump_collection_version(partner.company_id, 'partners')
         db.session.commit()
 
         return jsonify({'mensaje': 'Socio actualizado exitosamente', 'partner': partner.serialize()}), 200
@@ -924,13 +1255,14 @@ def eliminar_partner(email):
 
     try:
         # Buscar el socio por su email
-        partner = partner.query.filter_by(email=email).first()
+        partner = Partner.query.filter_by(email=email).first()
 
         if not partner:
             return jsonify({'error': 'Socio no encontrado'}), 404
 
         # Eliminar el socio de la base de datos
         db.session.delete(partner)
+        bump_collection_version(partner.company_id, 'partners')
         db.session.commit()
 
         return jsonify({'mensaje': 'Socio eliminado exitosamente'}), 200
@@ -983,3 +1315,325 @@ def submit_contact_form():
         print(f"Error en /api/contact: {e}")  # Imprime el error completo
         return jsonify({"error": "Error interno del servidor"}), 500
 
+
+
+# PRESUPUESTOS
+
+# Define el blueprint para los presupuestos (mismas fórmulas que calculateDistance.js)
+quotes_bp = Blueprint('quotes', __name__)
+
+# Presupuesto de una ruta: distance_km y duration_hours o stops (direcciones en orden),
+# container_type, weight, tariff y options. Los presupuestos repetidos salen de la caché
+@quotes_bp.route('/api/quotes', methods=['POST'])
+def create_quote():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Datos inválidos. Se esperaba un JSON válido"}), 400
+
+    try:
+        quotes, _ = cached_quotes([data], parse_fuel_prices(data))
+        # Las direcciones geocodificadas por primera vez quedan en la caché persistente
+        db.session.commit()
+        return jsonify(quotes[0]), 200
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/quotes: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Presupuestos en bloque: {"quotes": [...], "fuel_price": ..., "base_fuel_price": ...}
+# Los que no están en caché se calculan en una sola pasada vectorizada
+@quotes_bp.route('/api/quotes/batch', methods=['POST'])
+def create_quotes_batch():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Datos inválidos. Se esperaba un JSON válido"}), 400
+
+    try:
+        quotes, cache_hits = cached_quotes(data.get('quotes'), parse_fuel_prices(data))
+        db.session.commit()
+        return json_response({"quotes": quotes, "cache_hits": cache_hits})
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/quotes/batch: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Compara, para cada ruta candidata, el coste de subcontratarla a los colaboradores de la compañía
+# o de hacerla con un vehículo propio, ordenados de más barato a más caro
+# {"routes": [{"id", "distance_km", "duration_hours", "weight", "containers", "waiting_hours", "tolls"}],
+#  "limit" (opcional), "include_partners": true, "include_vehicles": true}
+@quotes_bp.route('/api/quotes/carriers', methods=['POST'])
+def rank_route_carriers():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Datos inválidos. Se esperaba un JSON válido"}), 400
+
+    try:
+        company_id = resolve_company_id()
+        if not company_id:
+            return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+        routes = parse_carrier_routes(data.get('routes'))
+        limit = parse_limit(data)
+
+        # Los colaboradores con un tipo de precio que no se sabe valorar se devuelven aparte
+        rates, skipped_partners = CarrierRates(), []
+        if data.get('include_partners', True):
+            for partner in Partner.query.filter_by(company_id=company_id).order_by(Partner.id).limit(MAX_CARRIERS):
+                if not rates.add_partner(partner):
+                    skipped_partners.append(partner.id)
+        if data.get('include_vehicles', True):
+            for vehicle in Vehicle.query.filter_by(company_id=company_id).order_by(Vehicle.id).limit(MAX_CARRIERS):
+                rates.add_vehicle(vehicle)
+        if not rates.carriers:
+            return jsonify({"error": "La compañía no tiene colaboradores ni vehículos que comparar."}), 404
+
+        rankings = rank_carriers(carrier_costs(routes, rates.arrays()), limit)
+        route_refs = [route.get('id', index) for index, route in enumerate(data['routes'])]
+        return json_response({"routes": [
+            {"id": ref, "carriers": [dict(rates.carriers[index], cost=cost) for index, cost in ranking]}
+            for ref, ranking in zip(route_refs, rankings)
+        ], "skipped_partners": skipped_partners})
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/quotes/carriers: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+
+
+# RUTAS
+
+# Define el blueprint para la planificación de rutas (matrices de distancias...)
+routing_bp = Blueprint('routing', __name__)
+
+# Matriz de distancias (km) y duraciones (horas) estimadas entre coordenadas o direcciones de la compañía
+# {"origins": [[lat, lng], ...] o "origin_address_ids": [...],
+#  "destinations": [...] o "destination_address_ids": [...] (opcional, por defecto los orígenes),
+#  "circuity_factor": 1.3, "average_speed_kmh": 70}
+@routing_bp.route('/api/distance-matrix', methods=['POST'])
+def get_distance_matrix():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Datos inválidos. Se esperaba un JSON válido"}), 400
+
+    try:
+        company_id = None
+        if data.get('origin_address_ids') is not None or data.get('destination_address_ids') is not None:
+            company_id = resolve_company_id()
+            if not company_id:
+                return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+        if data.get('origin_address_ids') is not None:
+            origins = address_points(company_id, data['origin_address_ids'], 'origin_address_ids')
+        else:
+            origins = parse_points(data.get('origins'), 'origins')
+
+        if data.get('destination_address_ids') is not None:
+            destinations = address_points(company_id, data['destination_address_ids'], 'destination_address_ids')
+        elif data.get('destinations') is not None:
+            destinations = parse_points(data['destinations'], 'destinations')
+        else:
+            destinations = origins
+        circuity_factor = parse_positive(data, 'circuity_factor', CIRCUITY_FACTOR)
+        average_speed_kmh = parse_positive(data, 'average_speed_kmh', AVERAGE_SPEED_KMH)
+
+        distances, durations = distance_matrix(origins, destinations, circuity_factor, average_speed_kmh)
+        return json_response({
+            "distances_km": matrix_to_list(distances),
+            "durations_hours": matrix_to_list(durations),
+            "circuity_factor": circuity_factor,
+            "average_speed_kmh": average_speed_kmh,
+        })
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/distance-matrix: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+
+# Orden de visita casi óptimo de las paradas entre un inicio y un final fijos (por defecto, volver al inicio)
+# {"start": [lat, lng], "end": [lat, lng], "stops": [[lat, lng], ...]} o
+# {"start_address_id": 1, "end_address_id": 2, "stop_address_ids": [...]}, y opcionalmente
+# "time_budget_ms", "circuity_factor" y "average_speed_kmh"
+@routing_bp.route('/api/routes/optimize', methods=['POST'])
+def optimize_route_order():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Datos inválidos. Se esperaba un JSON válido"}), 400
+
+    try:
+        # La compañía sólo hace falta para resolver direcciones
+        company_id = resolve_company_id() if data.get('stop_address_ids') is not None else None
+        return jsonify(optimize_stops(data, company_id)), 200
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/routes/optimize: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+
+# Reparte los trabajos del día entre los vehículos de la compañía respetando su capacidad (weight)
+# y minimizando cost_km * km + cost_hour * horas. Los reinicios se ejecutan en paralelo en un pool de procesos
+# {"depot": [lat, lng] o "depot_address_id", "jobs": [{"id", "location" o "address_id", "weight", "service_minutes"}],
+#  "vehicle_ids" (opcional), "time_budget_ms", "circuity_factor", "average_speed_kmh"}
+@routing_bp.route('/api/routes/fleet-plan', methods=['POST'])
+def plan_fleet_routes():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Datos inválidos. Se esperaba un JSON válido"}), 400
+
+    try:
+        company_id = resolve_company_id()
+        if not company_id:
+            return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+        return jsonify(plan_fleet(data, company_id)), 200
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/routes/fleet-plan: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+
+# TRABAJOS
+
+# Define el blueprint para los trabajos en segundo plano (los ejecuta flask run-jobs)
+jobs_bp = Blueprint('jobs', __name__)
+
+# Trabajo de la compañía del usuario (404 si es de otra compañía)
+def _company_job(id):
+    company_id = resolve_company_id()
+    if not company_id:
+        raise APIException("Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador.", status_code=405)
+    job = Job.query.filter_by(id=id, company_id=company_id).first()
+    if not job:
+        raise APIException("Trabajo no encontrado.", status_code=404)
+    return job
+
+# Encola un trabajo: {"kind": "routes.fleet_plan", "params": {...}}
+# Tipos: routes.optimize, routes.fleet_plan, quotes.batch, addresses.import y addresses.export
+@jobs_bp.route('/api/jobs', methods=['POST'])
+def create_job():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Datos inválidos. Se esperaba un JSON válido"}), 400
+
+    try:
+        company_id = resolve_company_id()
+        if not company_id:
+            return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+        job = submit_job(company_id, data.get('kind'), data.get('params', {}))
+        response = jsonify(job.serialize())
+        response.headers['Location'] = f"/api/jobs/{job.id}"
+        return response, 202
+    except APIException:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error en /api/jobs: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Últimos trabajos de la compañía (?status= y ?limit=, máximo 100)
+@jobs_bp.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    try:
+        company_id = resolve_company_id()
+        if not company_id:
+            return jsonify({"error": "Su cuenta no está asignada a una compañía registrada. Por favor, contacte con el administrador."}), 405
+
+        query = Job.query.filter_by(company_id=company_id)
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        jobs = query.order_by(Job.created_at.desc(), Job.id.desc()).limit(limit).all()
+        return jsonify({"jobs": [job.serialize() for job in jobs]}), 200
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/jobs: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Estado y progreso de un trabajo
+@jobs_bp.route('/api/jobs/<int:id>', methods=['GET'])
+def get_job(id):
+    try:
+        return jsonify(_company_job(id).serialize()), 200
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/jobs/{id}: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Resultado de un trabajo terminado. Mientras está en cola o en curso responde 202 con su estado
+@jobs_bp.route('/api/jobs/<int:id>/result', methods=['GET'])
+def get_job_result(id):
+    try:
+        job = _company_job(id)
+        if job.status == JOB_SUCCEEDED and job.kind in NDJSON_RESULT_KINDS:
+            # El resultado está guardado por partes: se envía en streaming sin juntarlo en memoria
+            response = Response(stream_with_context(result_chunks(job.id)), mimetype='application/x-ndjson')
+            response.headers['Content-Disposition'] = f'attachment; filename=job-{job.id}.ndjson'
+            return response
+        if job.status == JOB_SUCCEEDED:
+            # El resultado ya está guardado como JSON
+            return current_app.response_class(job.result, status=200, mimetype='application/json')
+        if job.status == JOB_FAILED:
+            return jsonify({"error": job.error or "El trabajo ha fallado."}), 409
+        if job.status == JOB_CANCELLED:
+            return jsonify({"error": "El trabajo se ha cancelado."}), 409
+        return jsonify(job.serialize()), 202
+    except APIException:
+        raise
+    except Exception as e:
+        print(f"Error en /api/jobs/{id}/result: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Cancela un trabajo en cola (al momento) o en curso (en cuanto el trabajo lo compruebe)
+@jobs_bp.route('/api/jobs/<int:id>/cancel', methods=['POST'])
+def cancel_company_job(id):
+    try:
+        return jsonify(cancel_job(_company_job(id)).serialize()), 200
+    except APIException:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error en /api/jobs/{id}/cancel: {e}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+
+# INTERNO
+
+# Define el blueprint para los endpoints internos de operación
+# Sólo responden si INTERNAL_API_TOKEN está configurado y llega en la cabecera X-Internal-Token
+internal_bp = Blueprint('internal', __name__)
+
+@internal_bp.before_request
+def check_internal_token():
+    expected = os.getenv('INTERNAL_API_TOKEN')
+    if not expected:
+        return jsonify({"error": "No encontrado."}), 404
+    # Comparación en tiempo constante: el tiempo de respuesta no revela cuántos caracteres coinciden
+    if not hmac.compare_digest(request.headers.get('X-Internal-Token', '').encode(), expected.encode()):
+        return jsonify({"error": "No autorizado."}), 403
+
+# Estadísticas en vivo del pool de conexiones de este proceso
+@internal_bp.route('/api/internal/pool', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool_status(db.engine, current_app.config['SQLALCHEMY_ENGINE_OPTIONS'])), 200
+
+# Contadores de la caché de lecturas (aciertos, fallos, expulsiones...)
+@internal_bp.route('/api/internal/cache', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache_info()), 200
+
+# Contadores de la caché de presupuestos y métricas de ruta (tasa de aciertos...)
+@internal_bp.route('/api/internal/quote-cache', methods=['GET'])
+def get_quote_cache_stats():
+    return jsonify(quote_cache_info()), 200
+
+# Índices espaciales de direcciones cargados en este proceso
+@internal_bp.route('/api/internal/spatial', methods=['GET'])
+def get_spatial_stats():
+    return jsonify(spatial_index_info()), 200
@@ -0,0 +1,180 @@
+import base64
+import binascii
+import sqlite3
+from sqlalchemy import DDL, case, column, event, func, literal, literal_column, select, table, text
+from api.models import Address, Client
+from api.pagination import parse_fields, parse_limit
+from api.serializers import row_encoder
+from api.utils import APIException
+
+# Columnas en las que se busca con ?q= (nombre, calle, NIF...)
+SEARCH_COLUMNS = {
+    'addresses': ('name', 'address'),
+    'clients': ('first_name', 'last_name', 'nif', 'address'),
+}
+
+# El índice de trigramas sólo sirve para términos de al menos 3 caracteres
+MIN_TRIGRAM_LENGTH = 3
+
+# Longitud máxima del texto de búsqueda
+MAX_QUERY_LENGTH = 100
+
+# FTS5 con el tokenizador trigram está disponible desde SQLite 3.34
+SQLITE_HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+# Documento de búsqueda de una fila: columnas concatenadas en minúsculas
+# En PostgreSQL debe coincidir exactamente con la expresión del índice GIN
+def _document(model):
+    parts = []
+    for name in SEARCH_COLUMNS[model.__tablename__]:
+        if parts:
+            parts.append(literal_column("' '"))
+        parts.append(func.coalesce(getattr(model, name), literal_column("''")))
+    document = parts[0]
+    for part in parts[1:]:
+        document = document.op('||')(part)
+    return func.lower(document)
+
+
+def _search_table(table_name):
+    return f"{table_name}_search"
+
+
+# DDL del índice de búsqueda: GIN de trigramas (pg_trgm) con company_id (btree_gin) en PostgreSQL
+# y tabla FTS5 de contenido externo mantenida con triggers en SQLite
+def _postgresql_ddl(table_name):
+    columns = SEARCH_COLUMNS[table_name]
+    document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+    return [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        f"CREATE INDEX IF NOT EXISTS ix_{table_name}_search_trgm ON {table_name} "
+        f"USING gin (company_id, (lower({document})) gin_trgm_ops)",
+    ]
+
+
+def _sqlite_ddl(table_name):
+    columns = SEARCH_COLUMNS[table_name]
+    search = _search_table(table_name)
+    names = ', '.join(columns)
+    new_values = ', '.join(f"new.{column}" for column in columns)
+    old_values = ', '.join(f"old.{column}" for column in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING fts5({names}, content='{table_name}', "
+        f"content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {search}_ai AFTER INSERT ON {table_name} BEGIN "
+        f"INSERT INTO {search}(rowid, {names}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {search}_ad AFTER DELETE ON {table_name} BEGIN "
+        f"INSERT INTO {search}({search}, rowid, {names}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {search}_au AFTER UPDATE ON {table_name} BEGIN "
+        f"INSERT INTO {search}({search}, rowid, {names}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {search}(rowid, {names}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+# Crea los índices de búsqueda con db.create_all() (en producción los crea la migración)
+for _model in (Address, Client):
+    for _statement in _postgresql_ddl(_model.__tablename__):
+        event.listen(_model.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+    if SQLITE_HAS_TRIGRAM:
+        for _statement in _sqlite_ddl(_model.__tablename__):
+            event.listen(_model.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# Los resultados se ordenan por relevancia: el cursor codifica el desplazamiento
+def encode_offset_cursor(offset):
+    return base64.urlsafe_b64encode(f"o|{offset}".encode()).decode().rstrip('=')
+
+
+def decode_offset_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        kind, offset = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        if kind != 'o' or int(offset) < 0:
+            raise ValueError(cursor)
+        return int(offset)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise APIException("El cursor de paginación no es válido.", status_code=400)
+
+
+def parse_query(raw_query):
+    query = ' '.join((raw_query or '').split()).lower()
+    if not query:
+        raise APIException("El parámetro 'q' no puede estar vacío.", status_code=400)
+    if len(query) > MAX_QUERY_LENGTH:
+        raise APIException(f"El parámetro 'q' admite como máximo {MAX_QUERY_LENGTH} caracteres.", status_code=400)
+    return query
+
+
+# PostgreSQL: coincidencia por subcadena o por similitud de trigramas (tolera erratas),
+# ordenada por word_similarity. Ambas condiciones usan el índice GIN (company_id, documento)
+def _postgresql_select(model, columns, company_id, query):
+    document = _document(model)
+    pattern = f"%{_escape_like(query)}%"
+    matches = document.like(pattern, escape='\\')
+    if len(query) >= MIN_TRIGRAM_LENGTH:
+        matches = matches | literal(query).op('<%')(document)
+
+    score = func.word_similarity(literal(query), document)
+    return (select(*columns)
+            .where(model.company_id == company_id, matches)
+            .order_by(score.desc(), model.id))
+
+
+# SQLite: MATCH sobre la tabla FTS5 para los términos de 3 o más caracteres (ordenado por bm25)
+# y LIKE para los más cortos, que el tokenizador trigram no puede buscar
+def _sqlite_select(model, columns, company_id, query):
+    table_name = model.__tablename__
+    document = _document(model)
+    terms = query.split(' ')
+    long_terms = [term for term in terms if len(term) >= MIN_TRIGRAM_LENGTH]
+    short_terms = [term for term in terms if len(term) < MIN_TRIGRAM_LENGTH]
+
+    stmt = select(*columns).where(model.company_id == company_id)
+
+    if SQLITE_HAS_TRIGRAM and long_terms:
+        search = table(_search_table(table_name), column('rowid'))
+        match = ' '.join('"' + term.replace('"', '""') + '"' for term in long_terms)
+        stmt = (stmt
+                .join(search, search.c.rowid == model.id)
+                .where(text(f"{search.name} MATCH :match").bindparams(match=match)))
+        order = [func.bm25(literal_column(search.name)), model.id]
+    else:
+        short_terms = terms
+        # Sin índice de texto: primero las coincidencias al principio del documento
+        order = [case((document.like(f"{_escape_like(query)}%", escape='\\'), 0), else_=1), model.id]
+
+    for term in short_terms:
+        stmt = stmt.where(document.like(f"%{_escape_like(term)}%", escape='\\'))
+
+    return stmt.order_by(*order)
+
+
+# Página de resultados de búsqueda en una colección de la compañía
+# Devuelve {"items": [...], "next_cursor": "..." | None}, igual que keyset_page
+def search_page(session, model, args, company_id):
+    query = parse_query(args.get('q'))
+    fields = parse_fields(model, args.get('fields'))
+    limit = parse_limit(args.get('limit'))
+    offset = decode_offset_cursor(args['cursor']) if args.get('cursor') else 0
+
+    columns = [getattr(model, field) for field in fields]
+    if session.get_bind().dialect.name == 'postgresql':
+        stmt = _postgresql_select(model, columns, company_id, query)
+    else:
+        stmt = _sqlite_select(model, columns, company_id, query)
+
+    # Se pide una fila de más para saber si existe una página siguiente
+    rows = session.execute(stmt.limit(limit + 1).offset(offset)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_offset_cursor(offset + limit)
+
+    return {"items": row_encoder(model, fields)(rows), "next_cursor": next_cursor}
@@ -0,0 +1,68 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Método y coste del hash de contraseñas en formato de Werkzeug, por ejemplo
+# "scrypt:32768:8:1" o "pbkdf2:sha256:600000". Los hashes antiguos se actualizan al iniciar sesión
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+# Hilos que calculan hashes (hashlib libera el GIL) y peticiones que pueden esperar en cola
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', 32))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+
+class PasswordHashingBusy(Exception):
+    pass
+
+
+# Pool acotado: si hay más de workers + queue_limit hashes pendientes se rechaza en lugar de encolar
+# Un hash que no termina en PASSWORD_HASH_TIMEOUT segundos también se trata como pool ocupado (503)
+class HashingPool:
+    def __init__(self, workers, queue_limit):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHashingBusy()
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+        except FutureTimeout:
+            raise PasswordHashingBusy()
+
+
+hashing_pool = HashingPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT)
+
+
+# Prefijo completo que Werkzeug guarda para un método ("scrypt" -> "scrypt:32768:8:1")
+@lru_cache(maxsize=16)
+def _stored_method(method):
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def hash_password(password, method=None):
+    return hashing_pool.run(generate_password_hash, password, method or PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    return hashing_pool.run(check_password_hash, password_hash, password)
+
+
+# True si el hash se generó con otro método o coste que el configurado
+def needs_rehash(password_hash, method=None):
+    return password_hash.split('$', 1)[0] != _stored_method(method or PASSWORD_HASH_METHOD)
+
+
+# Huella de un token de recuperación de contraseña: es lo único que se guarda en la base de datos
+def reset_token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
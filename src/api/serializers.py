@@ -0,0 +1,56 @@
+import json
+from datetime import date, datetime
+from functools import lru_cache
+from flask import current_app
+
+# orjson es opcional: si no está instalado se usa el codificador de la librería estándar
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+# Codifica a JSON (bytes). orjson serializa datetime en ISO 8601 igual que isoformat()
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+# Genera una función que convierte tuplas de columnas en diccionarios
+# Las columnas se validan contra la metadata de la tabla y el código se compila una sola vez
+# por (tabla, campos): [{'id': r[0], 'name': r[1], ...} for r in rows]
+@lru_cache(maxsize=256)
+def _compile_encoder(table, fields):
+    for field in fields:
+        if field not in table.c:
+            raise ValueError(f"La tabla {table.name} no tiene la columna {field}")
+
+    items = ', '.join(f"{field!r}: r[{index}]" for index, field in enumerate(fields))
+    source = f"def encode_rows(rows):\n    return [{{{items}}} for r in rows]\n"
+    namespace = {}
+    exec(compile(source, f"<encoder {table.name}>", 'exec'), namespace)
+    return namespace['encode_rows']
+
+
+# Encoder de filas para un modelo. Las filas deben traer las columnas en el orden de `fields`
+# (las columnas extra al final se ignoran)
+def row_encoder(model, fields=None):
+    return _compile_encoder(model.__table__, tuple(fields or model.public_fields))
+
+
+# Respuesta JSON codificada con orjson (o con json si no está disponible)
+def json_response(payload, status=200):
+    return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
@@ -0,0 +1,220 @@
+import math
+import threading
+import numpy as np
+from api.models import db, Address
+from api.versioning import get_collection_version
+from api.geo import haversine_matrix
+from api.utils import APIException
+
+# Índice espacial en memoria de las direcciones geocodificadas de cada compañía: rejilla de celdas
+# de SPATIAL_CELL_DEG grados. Las consultas sólo recorren las celdas cercanas al punto, así que su
+# coste depende de la densidad local y no del número total de direcciones
+
+SPATIAL_CELL_DEG = 0.1
+KM_PER_DEG = 111.195
+
+MAX_NEAREST = 100
+DEFAULT_NEAREST = 10
+MAX_RADIUS_KM = 500
+MAX_WITHIN_RESULTS = 500
+
+
+class GridIndex:
+    def __init__(self, version, cell_deg=SPATIAL_CELL_DEG):
+        self.version = version
+        self.cell_deg = cell_deg
+        self.lock = threading.RLock()
+        # id -> (lat, lng, categoría, celda) y celda -> ids
+        self._points = {}
+        self._cells = {}
+        # Rango de celdas ocupadas (sólo crece: acota la búsqueda por anillos)
+        self._bounds = None
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def upsert(self, address_id, lat, lng, category):
+        with self.lock:
+            self.remove(address_id)
+            cell = self._cell(lat, lng)
+            self._points[address_id] = (lat, lng, category, cell)
+            self._cells.setdefault(cell, set()).add(address_id)
+            i, j = cell
+            if self._bounds is None:
+                self._bounds = [i, i, j, j]
+            else:
+                bounds = self._bounds
+                bounds[:] = [min(bounds[0], i), max(bounds[1], i), min(bounds[2], j), max(bounds[3], j)]
+
+    def remove(self, address_id):
+        with self.lock:
+            point = self._points.pop(address_id, None)
+            if point is None:
+                return
+            ids = self._cells[point[3]]
+            ids.discard(address_id)
+            if not ids:
+                del self._cells[point[3]]
+
+    # Distancias en línea recta (km) desde el punto a los ids candidatos que cumplen el filtro de categoría
+    def _distances(self, lat, lng, ids, category):
+        ids = [address_id for address_id in ids if category is None or self._points[address_id][2] == category]
+        if not ids:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        coordinates = [self._points[address_id][:2] for address_id in ids]
+        return np.array(ids, dtype=np.int64), haversine_matrix([(lat, lng)], coordinates)[0]
+
+    def _ring_ids(self, center, ring):
+        ci, cj = center
+        ids = []
+        for i in range(ci - ring, ci + ring + 1):
+            # En los bordes del anillo se recorren todas las columnas; en el resto, sólo las dos de los extremos
+            columns = range(cj - ring, cj + ring + 1) if abs(i - ci) == ring else (cj - ring, cj + ring)
+            for j in columns:
+                ids.extend(self._cells.get((i, j), ()))
+        return ids
+
+    # Cota inferior (km) de la distancia a cualquier punto fuera de los anillos ya recorridos
+    def _covered_km(self, lat, ring):
+        max_lat = min(abs(lat) + (ring + 1) * self.cell_deg, 89.0)
+        return ring * self.cell_deg * KM_PER_DEG * math.cos(math.radians(max_lat))
+
+    # Los k puntos más cercanos: se recorren anillos de celdas alrededor del punto hasta que el k-ésimo
+    # encontrado está más cerca que cualquier celda sin recorrer. Devuelve [(id, km)] ordenado
+    def nearest(self, lat, lng, k, category=None, max_km=None):
+        with self.lock:
+            if not self._points:
+                return []
+            center = self._cell(lat, lng)
+            min_i, max_i, min_j, max_j = self._bounds
+            last_ring = max(abs(center[0] - min_i), abs(center[0] - max_i), abs(center[1] - min_j), abs(center[1] - max_j))
+
+            found_ids, found_km = [], []
+            ring = 0
+            while ring <= last_ring:
+                # Si el anillo tiene más celdas que puntos tiene el índice, es más barato mirarlos todos
+                if 8 * ring > len(self._points):
+                    ids, km = self._distances(lat, lng, list(self._points), category)
+                    found_ids, found_km = [ids], [km]
+                    break
+                ids, km = self._distances(lat, lng, self._ring_ids(center, ring), category)
+                found_ids.append(ids)
+                found_km.append(km)
+                covered = self._covered_km(lat, ring)
+                count = sum(len(chunk) for chunk in found_km)
+                if count >= k and np.partition(np.concatenate(found_km), k - 1)[k - 1] <= covered:
+                    break
+                if max_km is not None and covered >= max_km:
+                    break
+                ring += 1
+
+        ids, km = np.concatenate(found_ids), np.concatenate(found_km)
+        if max_km is not None:
+            ids, km = ids[km <= max_km], km[km <= max_km]
+        order = np.argsort(km, kind='stable')[:k]
+        return list(zip(ids[order].tolist(), km[order].astype(np.float64).tolist()))
+
+    # Puntos a menos de radius_km, ordenados por distancia. Devuelve [(id, km)]
+    def within(self, lat, lng, radius_km, category=None, limit=MAX_WITHIN_RESULTS):
+        lat_span = radius_km / KM_PER_DEG
+        cos_lat = math.cos(math.radians(min(abs(lat) + lat_span, 89.0)))
+        lng_span = min(radius_km / (KM_PER_DEG * cos_lat), 180.0)
+        min_i, max_i = math.floor((lat - lat_span) / self.cell_deg), math.floor((lat + lat_span) / self.cell_deg)
+        min_j, max_j = math.floor((lng - lng_span) / self.cell_deg), math.floor((lng + lng_span) / self.cell_deg)
+
+        with self.lock:
+            # Se recorren las celdas del rectángulo o, si hay menos celdas ocupadas, éstas filtradas por rango
+            if (max_i - min_i + 1) * (max_j - min_j + 1) <= len(self._cells):
+                ids = [address_id for i in range(min_i, max_i + 1) for j in range(min_j, max_j + 1)
+                       for address_id in self._cells.get((i, j), ())]
+            else:
+                ids = [address_id for (i, j), cell_ids in self._cells.items()
+                       if min_i <= i <= max_i and min_j <= j <= max_j for address_id in cell_ids]
+            ids, km = self._distances(lat, lng, ids, category)
+
+        inside = km <= radius_km
+        ids, km = ids[inside], km[inside]
+        order = np.argsort(km, kind='stable')[:limit]
+        return list(zip(ids[order].tolist(), km[order].astype(np.float64).tolist()))
+
+
+# Índices por compañía de este proceso
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _build_index(company_id, version):
+    index = GridIndex(version)
+    rows = db.session.execute(
+        db.select(Address.id, Address.latitude, Address.longitude, Address.category).where(
+            Address.company_id == company_id,
+            Address.latitude.isnot(None),
+            Address.longitude.isnot(None)
+        )
+    )
+    for address_id, lat, lng, category in rows:
+        index.upsert(address_id, lat, lng, category)
+    return index
+
+
+# Índice de la compañía, construido la primera vez que se consulta
+# La versión de la colección (una lectura por clave primaria) detecta escrituras hechas en otros
+# procesos o en lote: si no coincide, el índice se reconstruye
+def company_index(company_id):
+    version = get_collection_version(company_id, 'addresses')
+    with _indexes_lock:
+        index = _indexes.get(company_id)
+    if index is not None and index.version == version:
+        return index
+
+    index = _build_index(company_id, version)
+    with _indexes_lock:
+        _indexes[company_id] = index
+    return index
+
+
+# Aplica al índice la escritura de una sola dirección, después del commit. Sin coordenadas (o al borrarla)
+# la dirección sale del índice. Si desde la construcción del índice hubo otras escrituras (la versión
+# avanzó más de una) el índice se descarta y se reconstruye en la siguiente consulta
+def index_address_write(company_id, address_id, latitude=None, longitude=None, category=None):
+    with _indexes_lock:
+        index = _indexes.get(company_id)
+    if index is None:
+        return
+
+    version = get_collection_version(company_id, 'addresses')
+    with index.lock:
+        if index.version != version - 1:
+            with _indexes_lock:
+                _indexes.pop(company_id, None)
+            return
+        if latitude is None or longitude is None:
+            index.remove(address_id)
+        else:
+            index.upsert(address_id, latitude, longitude, category)
+        index.version = version
+
+
+def spatial_index_info():
+    with _indexes_lock:
+        indexes = dict(_indexes)
+    return {"companies": len(indexes), "addresses": sum(len(index) for index in indexes.values())}
+
+
+# Punto de la consulta: ?lat=&lng= o ?address_id= (una dirección geocodificada de la compañía)
+def parse_query_point(args, company_id):
+    if args.get('address_id') is not None:
+        address = Address.query.filter_by(id=args.get('address_id', type=int), company_id=company_id).first()
+        if address is None:
+            raise APIException("Dirección no encontrada.", status_code=404)
+        if address.latitude is None or address.longitude is None:
+            raise APIException("La dirección no tiene coordenadas.", status_code=422)
+        return address.latitude, address.longitude, address.id
+
+    lat, lng = args.get('lat', type=float), args.get('lng', type=float)
+    if lat is None or lng is None or not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        raise APIException("Se esperaban 'lat' y 'lng' válidos o 'address_id'.", status_code=400)
+    return lat, lng, None
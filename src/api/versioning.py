@@ -0,0 +1,87 @@
+import hashlib
+from flask import current_app, request
+from api.models import db, CollectionVersion
+from api.bulk import dialect_insert
+from api.cache import cached, invalidate
+
+# Colecciones por compañía con versión propia (la versión cambia en cada escritura)
+VERSIONED_COLLECTIONS = ('addresses', 'clients', 'partners', 'vehicles', 'users')
+
+
+def _version_select(company_id, collection):
+    return db.select(CollectionVersion.version).where(
+        CollectionVersion.company_id == company_id,
+        CollectionVersion.collection == collection
+    )
+
+
+# Versión actual de una colección (0 si nunca se ha escrito)
+# Es una lectura por clave primaria: no toca las tablas de entidades
+def get_collection_version(company_id, collection):
+    version = db.session.execute(_version_select(company_id, collection)).scalar()
+    return version or 0
+
+
+# Lo mismo con una sesión asíncrona (servidor ASGI)
+async def get_collection_version_async(session, company_id, collection):
+    version = (await session.execute(_version_select(company_id, collection))).scalar()
+    return version or 0
+
+
+# Incrementa la versión de la colección dentro de la transacción de la escritura
+# Debe llamarse antes del commit para que el cambio y la versión sean atómicos
+def bump_collection_version(company_id, collection):
+    if company_id is None:
+        return
+    table = CollectionVersion.__table__
+    stmt = dialect_insert(table).values(company_id=company_id, collection=collection, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['company_id', 'collection'],
+        set_={'version': table.c.version + 1}
+    )
+    db.session.execute(stmt)
+
+    # Las entradas de caché llevan la versión en la clave: tras el incremento ya no se leerán,
+    # se borran para liberar memoria
+    invalidate(_cache_prefix(company_id, collection))
+
+
+# ETag de un listado: versión de la colección + parámetros de la consulta (cursor, limit, fields...)
+def collection_etag(company_id, collection, version, args):
+    params = '&'.join(f"{key}={value}" for key, value in sorted(args.items(multi=True)))
+    digest = hashlib.sha1(params.encode()).hexdigest()[:12]
+    return f"{collection}-{company_id}-v{version}-{digest}"
+
+
+# Devuelve (etag, not_modified) para la petición actual
+def check_collection_etag(company_id, collection):
+    version = get_collection_version(company_id, collection)
+    etag = collection_etag(company_id, collection, version, request.args)
+    return etag, request.if_none_match.contains(etag)
+
+
+def _cache_prefix(company_id, collection):
+    return f"list:{collection}-{company_id}-v"
+
+
+# Clave de caché de un listado y prefijo con el que se invalida
+# El ETag ya identifica compañía, versión y parámetros. El servidor ASGI usa las mismas claves
+def collection_cache_key(company_id, collection, etag):
+    return f"list:{etag}", _cache_prefix(company_id, collection)
+
+
+# Lectura de un listado a través de la caché
+def cached_collection(company_id, collection, etag, loader):
+    key, index = collection_cache_key(company_id, collection, etag)
+    return cached(key, loader, index=index)
+
+
+# Añade el ETag a la respuesta; no-cache obliga al navegador a revalidar con If-None-Match
+def with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag):
+    return with_etag(current_app.response_class(status=304), etag)
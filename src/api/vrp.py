@@ -0,0 +1,232 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+from api.optimizer import optimize_route
+
+# Asignación de los trabajos del día a la flota (VRP con capacidad y coste por km y por hora)
+# Este módulo sólo depende de NumPy: los procesos del pool no cargan la aplicación ni la base de datos
+
+MAX_VRP_JOBS = 300
+MAX_VRP_VEHICLES = 50
+DEFAULT_VRP_TIME_BUDGET_MS = 2000
+MAX_VRP_TIME_BUDGET_MS = 10000
+
+# Procesos del pool y reinicios (construcciones aleatorias independientes) por petición
+# Cada proceso de gunicorn/uvicorn tiene su propio pool: en total hay procesos web × VRP_WORKERS
+VRP_WORKERS = int(os.getenv('VRP_WORKERS', 2))
+VRP_RESTARTS = int(os.getenv('VRP_RESTARTS', VRP_WORKERS))
+
+# Segundos entre avisos de progreso mientras se esperan los reinicios del pool
+PROGRESS_INTERVAL_S = 0.5
+
+EPSILON = 1e-9
+
+
+# Datos del problema en arrays. Índice 0 de la matriz: el depósito; 1..n: los trabajos
+class FleetProblem:
+    def __init__(self, matrix, job_weights, service_hours, capacities, cost_km, cost_hour, speed_kmh):
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.job_weights = np.asarray(job_weights, dtype=np.float64)
+        self.service_hours = np.asarray(service_hours, dtype=np.float64)
+        self.capacities = np.asarray(capacities, dtype=np.float64)
+        self.cost_km = np.asarray(cost_km, dtype=np.float64)
+        self.cost_hour = np.asarray(cost_hour, dtype=np.float64)
+        self.speed_kmh = float(speed_kmh)
+
+    # Coste de recorrer `km` y atender trabajos que suman `service` horas con el vehículo v
+    def cost(self, v, km, service):
+        return self.cost_km[v] * km + self.cost_hour[v] * (km / self.speed_kmh + service)
+
+    def route_km(self, route):
+        if not route:
+            return 0.0
+        stops = [0] + route + [0]
+        return float(self.matrix[stops[:-1], stops[1:]].sum())
+
+    def route_cost(self, v, route):
+        return self.cost(v, self.route_km(route), float(self.service_hours[[job - 1 for job in route]].sum()))
+
+    # Mejor posición para insertar el trabajo en la ruta: (incremento de km, posición)
+    def best_insertion(self, route, job):
+        stops = np.array([0] + route + [0])
+        delta = self.matrix[stops[:-1], job] + self.matrix[job, stops[1:]] - self.matrix[stops[:-1], stops[1:]]
+        position = int(np.argmin(delta))
+        return float(delta[position]), position
+
+
+# Construcción por inserción más barata: cada trabajo va al vehículo y posición que menos coste añaden
+# respetando la capacidad. Devuelve (rutas, cargas, trabajos sin asignar)
+def _construct(problem, job_order):
+    vehicles = len(problem.capacities)
+    routes = [[] for _ in range(vehicles)]
+    loads = np.zeros(vehicles)
+    unassigned = []
+
+    for job in job_order:
+        weight = problem.job_weights[job - 1]
+        service = problem.service_hours[job - 1]
+        best = None
+        for v in range(vehicles):
+            if loads[v] + weight > problem.capacities[v] + EPSILON:
+                continue
+            km, position = problem.best_insertion(routes[v], job)
+            cost = problem.cost(v, km, service)
+            if best is None or cost < best[0]:
+                best = (cost, v, position)
+        if best is None:
+            unassigned.append(job)
+            continue
+        _, v, position = best
+        routes[v].insert(position, job)
+        loads[v] += weight
+    return routes, loads, unassigned
+
+
+# Reubicación entre rutas: mueve un trabajo a otro vehículo si baja el coste total
+def _relocate_pass(problem, routes, loads, deadline):
+    improved = False
+    vehicles = len(routes)
+    for a in range(vehicles):
+        i = 0
+        while i < len(routes[a]):
+            if time.perf_counter() > deadline:
+                return improved
+            route = routes[a]
+            job = route[i]
+            prev = route[i - 1] if i > 0 else 0
+            next_ = route[i + 1] if i + 1 < len(route) else 0
+            removed_km = problem.matrix[prev, job] + problem.matrix[job, next_] - problem.matrix[prev, next_]
+            gain = problem.cost(a, removed_km, problem.service_hours[job - 1])
+            weight = problem.job_weights[job - 1]
+
+            best = None
+            for b in range(vehicles):
+                if b == a or loads[b] + weight > problem.capacities[b] + EPSILON:
+                    continue
+                km, position = problem.best_insertion(routes[b], job)
+                delta = problem.cost(b, km, problem.service_hours[job - 1]) - gain
+                if delta < -EPSILON and (best is None or delta < best[0]):
+                    best = (delta, b, position)
+
+            if best is None:
+                i += 1
+                continue
+            _, b, position = best
+            del route[i]
+            routes[b].insert(position, job)
+            loads[a] -= weight
+            loads[b] += weight
+            improved = True
+    return improved
+
+
+# Reordena cada ruta con 2-opt y Or-opt (depósito como inicio y final)
+def _improve_routes(problem, routes, deadline):
+    for v, route in enumerate(routes):
+        if len(route) < 3:
+            continue
+        remaining_ms = (deadline - time.perf_counter()) * 1000
+        if remaining_ms <= 0:
+            return
+        stops = np.array([0] + route + [0])
+        order, _, _ = optimize_route(problem.matrix[np.ix_(stops, stops)], remaining_ms)
+        routes[v] = [int(stops[index]) for index in order[1:-1]]
+
+
+# Un reinicio completo: construcción con el orden de trabajos de la semilla y búsqueda local
+# hasta no mejorar o agotar el tiempo. Se ejecuta en un proceso del pool
+# `deadline_epoch` es absoluto (time.time()) para que sirva en cualquier proceso; si un reinicio
+# empieza demasiado tarde (estaba en cola) no se ejecuta
+# on_progress sólo se usa en el proceso actual (ver optimize_route): se llama tras cada pasada de mejora
+def solve_restart(problem, seed, deadline_epoch, on_progress=None):
+    remaining = deadline_epoch - time.time()
+    if seed != 0 and remaining <= 0:
+        return None
+    started = time.perf_counter()
+    deadline = started + max(remaining, 0)
+    jobs = np.arange(1, len(problem.job_weights) + 1)
+
+    if seed == 0:
+        # Semilla 0: trabajos más pesados primero (los más difíciles de encajar)
+        job_order = jobs[np.argsort(-problem.job_weights, kind='stable')]
+    else:
+        job_order = np.random.default_rng(seed).permutation(jobs)
+
+    routes, loads, unassigned = _construct(problem, [int(job) for job in job_order])
+    _improve_routes(problem, routes, deadline)
+    while time.perf_counter() < deadline:
+        if not _relocate_pass(problem, routes, loads, deadline):
+            break
+        _improve_routes(problem, routes, deadline)
+        if on_progress is not None:
+            on_progress(min((time.perf_counter() - started) / (deadline - started), 1.0))
+
+    total = sum(problem.route_cost(v, route) for v, route in enumerate(routes))
+    return {"seed": seed, "cost": total, "routes": routes, "unassigned": unassigned}
+
+
+# Pool de procesos compartido. Se usa "spawn": los procesos no heredan conexiones ni hilos de la app
+_pool = None
+# Tareas vacías lanzadas al crear el pool: terminan cuando los procesos han arrancado e importado NumPy
+_pool_ready = []
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def get_pool():
+    global _pool, _pool_ready
+    if _pool is None and VRP_WORKERS > 1:
+        _pool = ProcessPoolExecutor(max_workers=VRP_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        _pool_ready = [_pool.submit(_warm_up) for _ in range(VRP_WORKERS)]
+    return _pool
+
+
+# Resuelve el problema con varios reinicios en paralelo y devuelve el mejor resultado
+# El tiempo total está acotado: los reinicios que no terminan a tiempo se descartan
+# on_progress(fracción del presupuesto consumida) se llama tras cada pasada o, con el pool, cada
+# PROGRESS_INTERVAL_S mientras se esperan los reinicios. Si lanza una excepción se cancelan los pendientes
+def solve_fleet(problem, time_budget_ms=DEFAULT_VRP_TIME_BUDGET_MS, restarts=VRP_RESTARTS, on_progress=None):
+    budget_s = time_budget_ms / 1000
+    started = time.time()
+    pool = get_pool()
+    # El arranque del pool cuenta dentro del presupuesto: se espera como mucho la mitad y, si los
+    # procesos aún no están listos, esta petición se resuelve en el proceso actual con lo que queda
+    if pool is not None and not all(future.done() for future in _pool_ready):
+        wait(_pool_ready, timeout=budget_s * 0.5)
+        if not all(future.done() for future in _pool_ready):
+            pool = None
+
+    # El 10% del presupuesto queda como margen para repartir el trabajo y recoger los resultados
+    deadline_epoch = started + budget_s * 0.9
+
+    if pool is None:
+        results = [solve_restart(problem, 0, deadline_epoch, on_progress)]
+    else:
+        futures = [pool.submit(solve_restart, problem, seed, deadline_epoch) for seed in range(max(restarts, 1))]
+        pending = set(futures)
+        try:
+            while pending and time.time() < started + budget_s:
+                timeout = started + budget_s - time.time()
+                if on_progress is not None:
+                    on_progress(min((time.time() - started) / budget_s, 1.0))
+                    timeout = min(timeout, PROGRESS_INTERVAL_S)
+                _, pending = wait(pending, timeout=max(timeout, 0))
+        finally:
+            # Los reinicios que no han empezado no llegan a ejecutarse; los que están en marcha
+            # terminan solos en su deadline y su resultado se descarta
+            for future in pending:
+                future.cancel()
+        results = [future.result() for future in futures if future.done() and not future.cancelled()]
+        results = [result for result in results if result is not None]
+        if not results:
+            # Ningún proceso respondió a tiempo: sólo queda la construcción inicial, sin búsqueda local
+            results = [solve_restart(problem, 0, started + budget_s, on_progress)]
+
+    # Primero el que asigna más trabajos y, a igualdad, el más barato
+    best = min(results, key=lambda result: (len(result["unassigned"]), result["cost"]))
+    best["restarts"] = len(results)
+    return best
@@ -6,7 +6,10 @@ from flask_migrate import Migrate
 sys.path.append('src')
 from api.utils import APIException, generate_sitemap
 from api.models import db, User
-from api.routes import api, addresses_bp, partners_bp, companies_bp
+from api.commands import setup_commands
+from api.db_pool import build_engine_options
+from api.instrumentation import setup_request_metrics
+from api.routes import api, addresses_bp, clients_bp, partners_bp, companies_bp, quotes_bp, routing_bp, jobs_bp, internal_bp
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager             
 from itsdangerous import URLSafeTimedSerializer
@@ -20,7 +23,8 @@ app = Flask(__name__)
 
 
 # Configura CORS para permitir solicitudes desde los frontends especificados
-CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": ["http://localhost:3000", "https://rutatrack.onrender.com"]}})
+CORS_ORIGINS = ["http://localhost:3000", "https://rutatrack.onrender.com"]
+CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": CORS_ORIGINS}})
 
 
 app.url_map.strict_slashes = False
@@ -33,6 +37,10 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Pool de conexiones: tamaño, desbordamiento, reciclado, pre-ping y statement timeout por variables de entorno
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
 app.config['MAIL_SERVER'] = 'localhost'  # Configuración provisional para pruebas
 app.config['MAIL_PORT'] = 1025
 app.config['MAIL_USE_TLS'] = False
@@ -66,8 +74,19 @@ db.init_app(app)
 # Registrar los Blueprints de los endpoints
 app.register_blueprint(api)
 app.register_blueprint(addresses_bp)
+app.register_blueprint(clients_bp)
 app.register_blueprint(partners_bp)
 app.register_blueprint(companies_bp)
+app.register_blueprint(quotes_bp)
+app.register_blueprint(routing_bp)
+app.register_blueprint(jobs_bp)
+app.register_blueprint(internal_bp)
+
+# Registrar los comandos de Flask CLI (flask check-query-plans, ...)
+setup_commands(app)
+
+# Métricas por petición: consultas SQL, tiempo en BD y cabecera Server-Timing
+setup_request_metrics(app)
 
 
 # Handle/serialize errors like a JSON object
@@ -0,0 +1,47 @@
+# Servidor ASGI: los endpoints de lectura (direcciones, clientes, vehículos, socios y /api/users/me)
+# se atienden con el engine asíncrono de SQLAlchemy y el resto de la API pasa a la app Flask,
+# ejecutada en un pool de hilos. Se arranca con uvicorn en lugar de gunicorn:
+#   $ uvicorn asgi:app --app-dir src --host 0.0.0.0 --port 3001 --workers 2
+
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Mount, Route
+from app import app as flask_app, CORS_ORIGINS
+from api.async_routes import get_addresses, get_clients, get_vehicles, get_partners, get_current_user, handle_api_exception
+from api.db_pool import async_database_uri, build_async_engine_options
+from api.utils import APIException
+
+database_uri = flask_app.config['SQLALCHEMY_DATABASE_URI']
+engine = create_async_engine(async_database_uri(database_uri), **build_async_engine_options(database_uri))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+
+# CORS sólo en las rutas asíncronas: las respuestas de Flask ya traen sus cabeceras (y los preflight
+# OPTIONS, que no coinciden con las rutas GET, los responde Flask)
+cors = Middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_credentials=True, allow_methods=['*'], allow_headers=['*'])
+
+app = Starlette(
+    routes=[
+        Route('/api/addresses', get_addresses, methods=['GET'], middleware=[cors]),
+        Route('/api/clients', get_clients, methods=['GET'], middleware=[cors]),
+        Route('/api/vehicles', get_vehicles, methods=['GET'], middleware=[cors]),
+        Route('/api/partners', get_partners, methods=['GET'], middleware=[cors]),
+        Route('/api/users/me', get_current_user, methods=['GET'], middleware=[cors]),
+        # Cualquier otra ruta o método (POST /api/addresses, /api/token...) la atiende Flask
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    exception_handlers={APIException: handle_api_exception},
+    lifespan=lifespan,
+)
+app.state.sessions = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+app.state.jwt_secret_key = flask_app.config['JWT_SECRET_KEY']
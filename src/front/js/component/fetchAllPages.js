@@ -0,0 +1,17 @@
+import axios from "axios";
+
+// Los listados de la API devuelven páginas {items, next_cursor}: se piden todas y se devuelven los items juntos
+// La compañía sale de la cookie de sesión (withCredentials), no hace falta enviarla
+export const fetchAllPages = async (url, params = {}) => {
+    const items = [];
+    let cursor = null;
+    do {
+        const response = await axios.get(url, {
+            params: { ...params, limit: 500, ...(cursor ? { cursor } : {}) },
+            withCredentials: true
+        });
+        items.push(...response.data.items);
+        cursor = response.data.next_cursor;
+    } while (cursor);
+    return items;
+};
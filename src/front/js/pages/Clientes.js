@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useContext } from 'react';
 import { Context } from '../store/appContext';
 import axios from 'axios';
+import { fetchAllPages } from "../component/fetchAllPages";
 import { FaTrash } from "react-icons/fa";
 import { LuPenSquare } from "react-icons/lu";
 import { MdGroups } from "react-icons/md";
@@ -43,14 +44,8 @@ const ClientListTable = () => {
 
     // Efecto para cargar los clientes al montar el componente 
     useEffect(() => {
-        axios.get(`${BACKEND_URL}/api/clients`)
-            .then(response => {
-                if (Array.isArray(response.data)) {
-                    setClients(response.data);
-                } else {
-                    console.error('La respuesta de la API no es un array:', response.data);
-                }
-            })
+        fetchAllPages(`${BACKEND_URL}/api/clients`)
+            .then(items => setClients(items))
             .catch(error => {
                 console.error('Error fetching clients:', error);
                 setError('Hubo un error al cargar los clientes. Por favor, recargue la página.');
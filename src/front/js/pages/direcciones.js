@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useContext, useRef } from "react";
 import axios from "axios";
+import { fetchAllPages } from "../component/fetchAllPages";
 import { Loader } from '@googlemaps/js-api-loader';
 import { Context } from '../store/appContext';
 import MobileControlPanel from "../component/DesktopControlPanel";
@@ -74,15 +75,8 @@ export const Direcciones = () => {
 
     useEffect(() => {
         if (currentUserId) {
-            axios.get(`${BACKEND_URL}/api/addresses?user_id=${currentUserId}`)
-                .then(response => {
-                    if (Array.isArray(response.data)) {
-                        setDirecciones(response.data);
-                    } else {
-                        console.error("La respuesta no es un array:", response.data);
-                        setDirecciones([]); // Maneja el caso de error
-                    }
-                })
+            fetchAllPages(`${BACKEND_URL}/api/addresses`)
+                .then(items => setDirecciones(items))
                 .catch(error => {
                     console.error("Error al obtener las direcciones:", error);
                     setWarning("No se pudieron cargar las direcciones.");
@@ -3,6 +3,7 @@ import { Context } from '../store/appContext';
 import "../../styles/flota.css";
 import { Modal, Button } from 'react-bootstrap';
 import axios from 'axios';
+import { fetchAllPages } from "../component/fetchAllPages";
 import MobileControlPanel from "../component/MobileControlPanel";
 import DesktopControlPanel from "../component/DesktopControlPanel";
 
@@ -136,12 +137,7 @@ export const Flota = () => {
 
     const fetchVehiculos = async () => {
         try {
-            const response = await axios.get(`${BACKEND_URL}/api/vehicles`);
-            if (Array.isArray(response.data)) {
-                setVehiculos(response.data);
-            } else {
-                console.error('La respuesta de la API no es un array:', response.data);
-            }
+            setVehiculos(await fetchAllPages(`${BACKEND_URL}/api/vehicles`));
         } catch (error) {
             console.error('Error al obtener vehículos:', error);
         }
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# La app lee la configuración al importarse: base de datos SQLite temporal y clave JWT de pruebas
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+os.environ.setdefault('JWT_SECRET_KEY', 'test-secret')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from app import app as flask_app  # noqa: E402
+import api.cache  # noqa: E402
+from api.models import db  # noqa: E402
+
+
+# Cada prueba recrea la base de datos: ids y versiones se repiten, así que la caché de listados
+# del proceso tampoco se comparte entre pruebas
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(api.cache, '_cache', None)
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+from starlette.testclient import TestClient
+
+import api.cache
+from api.cache import LRUTTLCache, SharedCache
+from api.identity import create_user_token
+from api.models import db, Company, User, Vehicle
+from asgi import app as asgi_app
+
+
+# Cliente compatible con Redis en memoria que cuenta las llamadas hechas desde el bucle de eventos
+class LoopCheckingRedis:
+    def __init__(self):
+        self.data = {}
+        self.calls_in_loop = 0
+
+    def _check(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.calls_in_loop += 1
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self._check()
+        self.data[key] = value
+
+    def sadd(self, key, *values):
+        self._check()
+        self.data.setdefault(key, set()).update(values)
+
+    def expire(self, key, ttl):
+        self._check()
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(api.cache, '_cache', LRUTTLCache())
+
+
+@pytest.fixture
+def companies(app, fresh_cache):
+    first, second = Company(name='Transportes A'), Company(name='Transportes B')
+    db.session.add_all([first, second])
+    db.session.flush()
+    db.session.add_all([Vehicle(name='Camión A', plate='1111AAA', company_id=first.id),
+                        Vehicle(name='Camión B', plate='2222BBB', company_id=second.id)])
+    user = User(email='ana@example.com', password_hash='x', name='Ana', last_name='López', company_id=first.id)
+    db.session.add(user)
+    db.session.commit()
+    return first.id, second.id, create_user_token(user, first)
+
+
+@pytest.fixture
+def asgi_client():
+    with TestClient(asgi_app) as client:
+        yield client
+
+
+def plates(response):
+    return [vehicle['plate'] for vehicle in response.json()['items']]
+
+
+def test_vehicles_without_company_is_405(companies, asgi_client):
+    assert asgi_client.get('/api/vehicles').status_code == 405
+
+
+def test_vehicles_query_company_without_session(companies, asgi_client):
+    first, second, token = companies
+    response = asgi_client.get('/api/vehicles', params={'company_id': second})
+
+    assert response.status_code == 200
+    assert plates(response) == ['2222BBB']
+
+
+def test_vehicles_use_jwt_company(companies, asgi_client):
+    first, second, token = companies
+    asgi_client.cookies.set('access_token_cookie', token)
+
+    response = asgi_client.get('/api/vehicles')
+    assert response.status_code == 200
+    assert plates(response) == ['1111AAA']
+
+    assert asgi_client.get('/api/vehicles', params={'company_id': second}).status_code == 403
+
+
+def test_shared_cache_runs_off_the_event_loop(companies, asgi_client, monkeypatch):
+    first, second, token = companies
+    redis = LoopCheckingRedis()
+    monkeypatch.setattr(api.cache, '_cache', SharedCache(redis))
+
+    responses = [asgi_client.get('/api/vehicles', params={'company_id': first}) for _ in range(2)]
+
+    assert [plates(response) for response in responses] == [['1111AAA']] * 2
+    assert api.cache._cache.stats.snapshot()['hits'] == 1
+    assert redis.data and redis.calls_in_loop == 0
+
+
+# La app WSGI (gunicorn) no depende de Starlette: sólo lo importan asgi.py y api/async_routes.py
+def test_wsgi_app_imports_without_starlette():
+    code = "import sys; sys.modules['starlette'] = None; import app"
+    src = os.path.join(os.path.dirname(__file__), '..', 'src')
+    result = subprocess.run([sys.executable, '-c', code], cwd=src, env=dict(os.environ), capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
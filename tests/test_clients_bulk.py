@@ -0,0 +1,54 @@
+import pytest
+from flask_jwt_extended import get_csrf_token
+
+from api.identity import create_user_token
+from api.models import db, Company, User, Client
+
+
+@pytest.fixture
+def companies(app):
+    first, second = Company(name='Transportes A'), Company(name='Transportes B')
+    db.session.add_all([first, second])
+    db.session.flush()
+    user = User(email='ana@example.com', password_hash='x', name='Ana', last_name='López', company_id=first.id)
+    db.session.add(user)
+    db.session.commit()
+    return first.id, second.id, create_user_token(user, first)
+
+
+def post_bulk(client, token, body):
+    headers = {}
+    if token:
+        client.set_cookie('access_token_cookie', token)
+        headers['X-CSRF-TOKEN'] = get_csrf_token(token)
+    return client.post('/api/clients/bulk', json=body, headers=headers)
+
+
+def test_bulk_uses_jwt_company(client, companies):
+    first, second, token = companies
+    response = post_bulk(client, token, {'clients': [{'first_name': 'Luis', 'last_name': 'Pérez', 'nif': 'B123'}]})
+
+    assert response.status_code == 200
+    assert response.get_json()['inserted'] == 1
+    assert [row.company_id for row in Client.query.all()] == [first]
+
+    response = post_bulk(client, token, {'company_id': first, 'clients': [{'first_name': 'Luis', 'last_name': 'Gil', 'nif': 'B123'}]})
+
+    assert response.get_json()['updated'] == 1
+    assert Client.query.one().last_name == 'Gil'
+
+
+def test_bulk_other_company_is_403(client, companies):
+    first, second, token = companies
+    response = post_bulk(client, token, {'company_id': second, 'clients': [{'first_name': 'Luis', 'last_name': 'Pérez'}]})
+
+    assert response.status_code == 403
+    assert Client.query.count() == 0
+
+
+def test_bulk_without_session_is_401(client, companies):
+    first, second, token = companies
+    response = post_bulk(client, None, {'company_id': first, 'clients': [{'first_name': 'Luis', 'last_name': 'Pérez'}]})
+
+    assert response.status_code == 401
+    assert Client.query.count() == 0
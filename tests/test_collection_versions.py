@@ -0,0 +1,168 @@
+import pytest
+from flask_jwt_extended import get_csrf_token
+
+import api.cache
+from api.cache import LRUTTLCache, SharedCache
+from api.geocoding import geocode_pending
+from api.identity import create_user_token
+from api.jobs import claim_job, run_job, submit_job
+from api.models import db, Address, Client, Company, Partner, User, Vehicle
+
+LISTS = {
+    'addresses': '/api/addresses',
+    'clients': '/api/clients',
+    'vehicles': '/api/vehicles',
+    'partners': '/api/partners',
+    'users': '/api/users',
+}
+
+
+@pytest.fixture
+def tenant(app):
+    company, other = Company(name='Transportes A'), Company(name='Transportes B')
+    db.session.add_all([company, other])
+    db.session.flush()
+    user = User(email='ana@example.com', password_hash='x', name='Ana', last_name='López', company_id=company.id)
+    rows = {
+        'user': user,
+        'address': Address(name='Almacén', address='Madrid', category='Almacén', company_id=company.id),
+        'client': Client(first_name='Luis', last_name='Pérez', nif='B111', company_id=company.id),
+        'vehicle': Vehicle(name='Camión', plate='1111AAA', company_id=company.id),
+        'partner': Partner(name='Socio', email='socio@example.com', price_type='km', price=1.0, waiting_periods=0,
+                           include_tolls=False, company_id=company.id),
+    }
+    db.session.add_all(rows.values())
+    db.session.commit()
+    ids = {name: row.id for name, row in rows.items()}
+    return {'company_id': company.id, 'other_id': other.id, 'token': create_user_token(user, company), **ids}
+
+
+def with_session(client, tenant):
+    client.set_cookie('access_token_cookie', tenant['token'])
+    return {'X-CSRF-TOKEN': get_csrf_token(tenant['token'])}
+
+
+def run_import_job(client, tenant):
+    job = submit_job(tenant['company_id'], 'addresses.import',
+                     {'records': [{'name': 'Nave', 'address': 'Toledo', 'category': 'Almacén'}]})
+    claim_job('pruebas:1')
+    return 200 if run_job(job.id, 'pruebas:1') == 'succeeded' else 500
+
+
+def run_geocoding(client, tenant):
+    return 200 if geocode_pending()['processed'] else 500
+
+
+# Cada escritura: (colección cuyo listado debe cambiar, función que la ejecuta y devuelve el código HTTP)
+WRITES = {
+    'addresses POST': ('addresses', lambda c, t: c.post('/api/addresses', json={
+        'name': 'Nave', 'address': 'Toledo', 'category': 'Almacén', 'company_id': t['company_id']}).status_code),
+    'addresses PUT': ('addresses', lambda c, t: c.put(f"/api/addresses/{t['address']}", json={
+        'name': 'Almacén central', 'company_id': t['company_id']}).status_code),
+    'addresses DELETE': ('addresses', lambda c, t: c.delete(f"/api/addresses/{t['address']}", json={
+        'company_id': t['company_id']}).status_code),
+    'addresses bulk': ('addresses', lambda c, t: c.post('/api/addresses/bulk', headers=with_session(c, t),
+        data='name,address,category\nNave,Toledo,Almacén\n', content_type='text/csv').status_code),
+    'addresses import job': ('addresses', run_import_job),
+    'addresses geocoding': ('addresses', run_geocoding),
+    'clients POST': ('clients', lambda c, t: c.post('/api/clients', json={
+        'first_name': 'Eva', 'last_name': 'Ruiz', 'company_id': t['company_id']}).status_code),
+    'clients PUT': ('clients', lambda c, t: c.put(f"/api/clients/{t['client']}", json={
+        'last_name': 'Gil', 'company_id': t['company_id']}).status_code),
+    'clients DELETE': ('clients', lambda c, t: c.delete(f"/api/clients/{t['client']}").status_code),
+    'clients bulk': ('clients', lambda c, t: c.post('/api/clients/bulk', headers=with_session(c, t), json={
+        'clients': [{'first_name': 'Luis', 'last_name': 'Gil', 'nif': 'B111'}]}).status_code),
+    'vehicles POST': ('vehicles', lambda c, t: c.post('/api/vehicles', json={
+        'name': 'Furgoneta', 'plate': '2222BBB', 'company_id': t['company_id']}).status_code),
+    'vehicles PUT': ('vehicles', lambda c, t: c.put(f"/api/vehicles/{t['vehicle']}", json={'name': 'Tráiler'}).status_code),
+    'vehicles DELETE': ('vehicles', lambda c, t: c.delete(f"/api/vehicles/{t['vehicle']}").status_code),
+    'partners POST': ('partners', lambda c, t: c.post('/api/partners', json={
+        'name': 'Otro socio', 'email': 'otro@example.com', 'price_type': 'km', 'price': 2.0, 'waiting_periods': 0,
+        'company_id': t['company_id']}).status_code),
+    'partners PUT': ('partners', lambda c, t: c.put('/api/partners/socio@example.com', json={'price': 3.0}).status_code),
+    'partners DELETE': ('partners', lambda c, t: c.delete('/api/partners/socio@example.com').status_code),
+    'users PUT': ('users', lambda c, t: c.put(f"/api/users/{t['user']}", json={'location': 'Madrid'}).status_code),
+    'users register': ('users', lambda c, t: c.post('/api/register', json={
+        'email': 'luis@example.com', 'password': 'secreto', 'name': 'Luis', 'last_name': 'García',
+        'company_name': 'Transportes A'}).status_code),
+}
+
+
+def list_etag(client, collection, company_id, headers=None):
+    response = client.get(LISTS[collection], query_string={'company_id': company_id, 'limit': 50}, headers=headers or {})
+    return response.status_code, response.headers.get('ETag')
+
+
+@pytest.mark.parametrize('collection', LISTS)
+def test_repeated_if_none_match_is_304(client, tenant, collection):
+    status, etag = list_etag(client, collection, tenant['company_id'])
+    assert status == 200 and etag
+
+    for _ in range(2):
+        assert list_etag(client, collection, tenant['company_id'], {'If-None-Match': etag}) == (304, etag)
+
+
+@pytest.mark.parametrize('write', WRITES)
+def test_write_changes_etag(client, tenant, write):
+    collection, run = WRITES[write]
+    _, etag = list_etag(client, collection, tenant['company_id'])
+    _, other_etag = list_etag(client, collection, tenant['other_id'])
+
+    assert run(client, tenant) < 300
+
+    client.delete_cookie('access_token_cookie')
+    status, new_etag = list_etag(client, collection, tenant['company_id'], {'If-None-Match': etag})
+    assert status == 200 and new_etag != etag
+    # El listado de otra compañía no se invalida
+    assert list_etag(client, collection, tenant['other_id'], {'If-None-Match': other_etag})[0] == 304
+
+
+# Cliente compatible con Redis en memoria con las operaciones que usa SharedCache
+class MemoryRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def sadd(self, key, *values):
+        self.data.setdefault(key, set()).update(values)
+
+    def smembers(self, key):
+        return self.data.get(key, set())
+
+    def expire(self, key, ttl):
+        pass
+
+
+@pytest.mark.parametrize('backend', ['memory', 'shared'])
+def test_cached_page_is_not_served_after_write(client, tenant, monkeypatch, backend):
+    cache = LRUTTLCache() if backend == 'memory' else SharedCache(MemoryRedis())
+    monkeypatch.setattr(api.cache, '_cache', cache)
+    query = {'company_id': tenant['company_id']}
+
+    def names():
+        return [address['name'] for address in client.get('/api/addresses', query_string=query).get_json()['items']]
+
+    assert names() == ['Almacén']
+
+    # Cambio hecho por fuera de la API (sin versión): la segunda lectura sale de la caché
+    db.session.get(Address, tenant['address']).category = 'Taller'
+    db.session.commit()
+    assert names() == ['Almacén']
+    assert cache.stats.snapshot()['hits'] == 1
+
+    response = client.put(f"/api/addresses/{tenant['address']}", json={'name': 'Almacén central', **query})
+    assert response.status_code == 200
+
+    # La escritura invalida la página: se vuelve a leer de la base de datos
+    items = client.get('/api/addresses', query_string=query).get_json()['items']
+    assert [(item['name'], item['category']) for item in items] == [('Almacén central', 'Taller')]
+    assert cache.stats.snapshot()['invalidations'] == 1
@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import event
+
+from api.models import db, Company, User, Address, Vehicle, Client, Partner
+
+
+# Cuenta las sentencias SQL que se ejecutan dentro del bloque with
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def create_companies(total):
+    for number in range(total):
+        company = Company(name=f'Compañía {number}')
+        db.session.add(company)
+        db.session.flush()
+        for item in range(3):
+            db.session.add(User(email=f'u{number}-{item}@example.com', password_hash='x', name='Nombre',
+                                last_name='Apellido', company_id=company.id))
+            db.session.add(Address(name=f'Dirección {item}', address='Calle Mayor 1', category='Almacén', company_id=company.id))
+            db.session.add(Vehicle(name=f'Camión {item}', plate=f'{number:04d}ABC{item}', company_id=company.id))
+            db.session.add(Client(first_name='Cliente', last_name=str(item), company_id=company.id))
+            db.session.add(Partner(name=f'Socio {item}', email=f'p{number}-{item}@example.com', price_type='km',
+                                   price=1.0, waiting_periods=0, include_tolls=False, company_id=company.id))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+@pytest.mark.parametrize('total', [1, 5])
+@pytest.mark.parametrize('include', [['users'], ['addresses', 'vehicles'], ['users', 'addresses', 'vehicles', 'partners', 'clients']])
+def test_load_relations_one_query_per_relation(app, total, include):
+    create_companies(total)
+
+    with StatementCounter(db.engine) as counter:
+        companies = Company.query.order_by(Company.id).all()
+        Company.load_relations(companies, include, db.select(Company.id))
+        data = [company.serialize(include=include) for company in companies]
+
+    assert counter.count == 1 + len(include)
+    assert len(data) == total
+    for company in data:
+        for relation in include:
+            assert len(company[relation]) == 3
+            assert all(item['company_id'] == company['id'] for item in company[relation])
+
+
+@pytest.mark.parametrize('total', [1, 5])
+def test_get_companies_include_query_count(app, client, total):
+    create_companies(total)
+    include = ['users', 'vehicles', 'clients']
+
+    with StatementCounter(db.engine) as counter:
+        response = client.get('/api/companies?include=' + ','.join(include))
+
+    assert response.status_code == 200
+    assert counter.count == 1 + len(include)
+    companies = response.get_json()
+    assert len(companies) == total
+    assert all(len(company[relation]) == 3 for company in companies for relation in include)
+
+
+def test_get_companies_without_include_is_one_query(app, client):
+    create_companies(5)
+
+    with StatementCounter(db.engine) as counter:
+        response = client.get('/api/companies')
+
+    assert response.status_code == 200
+    assert counter.count == 1
+    assert 'users' not in response.get_json()[0]
+
+
+def test_get_companies_rejects_unknown_relation(app, client):
+    response = client.get('/api/companies?include=users,secrets')
+
+    assert response.status_code == 400
@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import create_engine
+
+from api.db_pool import build_engine_options, pool_status, InstrumentedQueuePool
+
+
+@pytest.fixture
+def internal_token(monkeypatch):
+    monkeypatch.setenv('INTERNAL_API_TOKEN', 'token-interno')
+    return 'token-interno'
+
+
+def test_internal_disabled_without_token(app, client, monkeypatch):
+    monkeypatch.delenv('INTERNAL_API_TOKEN', raising=False)
+
+    assert client.get('/api/internal/pool').status_code == 404
+
+
+@pytest.mark.parametrize('headers', [{}, {'X-Internal-Token': 'otro'}, {'X-Internal-Token': 'token-interno-mas-largo'},
+                                     {'X-Internal-Token': 'tokén'}])
+def test_internal_rejects_wrong_token(app, client, internal_token, headers):
+    assert client.get('/api/internal/pool', headers=headers).status_code == 403
+
+
+def test_internal_accepts_token(app, client, internal_token):
+    assert client.get('/api/internal/pool', headers={'X-Internal-Token': internal_token}).status_code == 200
+
+
+def test_pool_status_reports_configured_overflow(app):
+    options = build_engine_options('postgresql://usuario@localhost/rutatrack')
+    options.pop('pool_pre_ping')
+    # Sólo se inspecciona el pool: no se abre ninguna conexión
+    engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=options['pool_size'],
+                           max_overflow=options['max_overflow'], pool_timeout=options['pool_timeout'])
+
+    status = pool_status(engine, options)
+
+    assert status['max_overflow'] == options['max_overflow'] == 10
+    assert (status['size'], status['checked_out'], status['overflow']) == (5, 0, 0)
@@ -0,0 +1,182 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import api.export
+from api.identity import create_user_token
+from api.jobs import JOB_HANDLERS, JobCancelled, claim_job, job_handler, run_job, submit_job
+from api.models import db, Address, Company, Job, JobResultChunk, User
+from api.optimizer import optimize_route
+from api.serializers import loads
+from api.vrp import FleetProblem, solve_fleet
+
+WORKER = 'pruebas:1'
+
+
+class Cancelled(Exception):
+    pass
+
+
+def cancel_after(calls):
+    seen = []
+
+    def on_progress(fraction):
+        seen.append(fraction)
+        if len(seen) >= calls:
+            raise Cancelled()
+    return on_progress, seen
+
+
+def random_matrix(points, seed=1):
+    coordinates = np.random.default_rng(seed).random((points, 2)) * 100
+    return np.linalg.norm(coordinates[:, None] - coordinates[None], axis=2)
+
+
+@pytest.fixture
+def company_id(app):
+    company = Company(name='Transportes Prueba')
+    db.session.add(company)
+    db.session.commit()
+    return company.id
+
+
+@pytest.fixture
+def noop_handler():
+    @job_handler('pruebas.noop')
+    def noop(params, company_id, context):
+        return {"ok": True}
+    yield
+    del JOB_HANDLERS['pruebas.noop']
+
+
+def test_optimize_route_reports_each_pass():
+    on_progress, seen = cancel_after(1)
+
+    with pytest.raises(Cancelled):
+        optimize_route(random_matrix(200), 5000, on_progress)
+    assert len(seen) == 1 and 0 <= seen[0] <= 1
+
+
+@pytest.mark.parametrize('restarts', [1, 2])
+def test_solve_fleet_stops_when_progress_raises(restarts):
+    matrix = random_matrix(61)
+    problem = FleetProblem(matrix, np.ones(60), np.zeros(60), [30] * 3, [1.0] * 3, [10.0] * 3, 70)
+    on_progress, seen = cancel_after(1)
+
+    with pytest.raises(Cancelled):
+        solve_fleet(problem, 3000, restarts=restarts, on_progress=on_progress)
+    assert seen
+
+
+def test_cancel_requested_during_optimize_job(company_id):
+    stops = (np.random.default_rng(2).random((200, 2)) + [40, -3]).tolist()
+    job = submit_job(company_id, 'routes.optimize', {'start': [40.4, -3.7], 'stops': stops, 'time_budget_ms': 60000})
+    assert claim_job(WORKER) == job.id
+    db.session.execute(db.update(Job).where(Job.id == job.id).values(cancel_requested=True))
+    db.session.commit()
+
+    assert run_job(job.id, WORKER) == 'cancelled'
+    assert db.session.get(Job, job.id).result is None
+
+
+def test_cancel_requested_is_honoured_after_handler(company_id, noop_handler):
+    job = submit_job(company_id, 'pruebas.noop', {})
+    assert claim_job(WORKER) == job.id
+    db.session.execute(db.update(Job).where(Job.id == job.id).values(cancel_requested=True))
+    db.session.commit()
+
+    assert run_job(job.id, WORKER) == 'cancelled'
+
+
+def test_job_succeeds_without_cancel(company_id, noop_handler):
+    job = submit_job(company_id, 'pruebas.noop', {})
+    claim_job(WORKER)
+
+    assert run_job(job.id, WORKER) == 'succeeded'
+    db.session.expire_all()
+    assert db.session.get(Job, job.id).progress == 1.0
+
+
+@pytest.fixture
+def session_client(client, company_id):
+    user = User(email='ana@example.com', password_hash='x', name='Ana', last_name='López', company_id=company_id)
+    db.session.add(user)
+    db.session.commit()
+    client.set_cookie('access_token_cookie', create_user_token(user, db.session.get(Company, company_id)))
+    return client
+
+
+def test_job_timestamps_are_iso_8601(session_client, company_id, noop_handler):
+    client = session_client
+    job = submit_job(company_id, 'pruebas.noop', {})
+    queued = client.get(f"/api/jobs/{job.id}").get_json()
+    assert (queued['started_at'], queued['finished_at']) == (None, None)
+
+    claim_job(WORKER)
+    run_job(job.id, WORKER)
+    finished = client.get(f"/api/jobs/{job.id}").get_json()
+    for field in ('created_at', 'started_at', 'finished_at'):
+        assert datetime.fromisoformat(finished[field])
+    assert client.get('/api/jobs').get_json()['jobs'][0]['finished_at'] == finished['finished_at']
+
+
+def import_job(company_id):
+    records = [{'name': f'Almacén {index}', 'address': 'Calle Mayor 1', 'category': 'Almacén'} for index in range(3)]
+    job = submit_job(company_id, 'addresses.import', {'records': records})
+    assert claim_job(WORKER) == job.id
+    return job
+
+
+def test_import_job_commits_rows_with_status(company_id):
+    job = import_job(company_id)
+
+    assert run_job(job.id, WORKER) == 'succeeded'
+    assert Address.query.filter_by(company_id=company_id).count() == 3
+    assert db.session.get(Job, job.id).status == 'succeeded'
+
+
+def test_reclaimed_job_discards_handler_writes(company_id):
+    job = import_job(company_id)
+    # Mientras se ejecutaba se dio por abandonado y lo tomó otro worker
+    db.session.execute(db.update(Job).where(Job.id == job.id).values(worker='otro:2'))
+    db.session.commit()
+
+    assert run_job(job.id, WORKER) is None
+    assert Address.query.filter_by(company_id=company_id).count() == 0
+    db.session.expire_all()
+    assert (db.session.get(Job, job.id).status, db.session.get(Job, job.id).worker) == ('running', 'otro:2')
+
+
+def export_job(company_id, monkeypatch, addresses):
+    monkeypatch.setattr(api.export, 'EXPORT_BATCH_SIZE', 2)
+    db.session.add_all([Address(name=f'Almacén {index}', address='Calle Mayor 1', category='Almacén', company_id=company_id)
+                        for index in range(addresses)])
+    db.session.commit()
+    job = submit_job(company_id, 'addresses.export', {})
+    assert claim_job(WORKER) == job.id
+    return job
+
+
+def test_export_job_streams_ndjson_chunks(session_client, company_id, monkeypatch):
+    job = export_job(company_id, monkeypatch, 5)
+
+    assert run_job(job.id, WORKER) == 'succeeded'
+    assert loads(db.session.get(Job, job.id).result) == {"count": 5, "chunks": 3, "format": "ndjson"}
+    assert JobResultChunk.query.filter_by(job_id=job.id).count() == 3
+
+    response = session_client.get(f"/api/jobs/{job.id}/result")
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [loads(line) for line in response.get_data().splitlines()]
+    assert [line['type'] for line in lines] == ['addresses'] * 5
+    assert [line['data']['name'] for line in lines] == [f'Almacén {index}' for index in range(5)]
+
+
+def test_cancelled_export_job_keeps_no_chunks(company_id, monkeypatch):
+    job = export_job(company_id, monkeypatch, 5)
+    db.session.execute(db.update(Job).where(Job.id == job.id).values(cancel_requested=True))
+    db.session.commit()
+
+    assert run_job(job.id, WORKER) == 'cancelled'
+    assert JobResultChunk.query.filter_by(job_id=job.id).count() == 0
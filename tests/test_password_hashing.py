@@ -0,0 +1,53 @@
+import time
+
+import api.security
+from api.models import db, Company, User
+
+
+def slow(func):
+    def wrapper(*args, **kwargs):
+        time.sleep(0.2)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def create_user(email, password):
+    company = Company(name='Transportes Prueba')
+    db.session.add(company)
+    db.session.flush()
+    db.session.add(User(email=email, password_hash=api.security.hash_password(password), name='Nombre',
+                        last_name='Apellido', company_id=company.id))
+    db.session.commit()
+
+
+def test_login_hash_timeout_is_503(app, client, monkeypatch):
+    create_user('ana@example.com', 'secreto')
+    monkeypatch.setattr(api.security, 'PASSWORD_HASH_TIMEOUT', 0.01)
+    monkeypatch.setattr(api.security, 'check_password_hash', slow(api.security.check_password_hash))
+
+    response = client.post('/api/token', json={'email': 'ana@example.com', 'password': 'secreto'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_register_hash_timeout_is_503(app, client, monkeypatch):
+    monkeypatch.setattr(api.security, 'PASSWORD_HASH_TIMEOUT', 0.01)
+    monkeypatch.setattr(api.security, 'generate_password_hash', slow(api.security.generate_password_hash))
+
+    response = client.post('/api/register', json={'email': 'luis@example.com', 'password': 'secreto', 'name': 'Luis',
+                                                  'last_name': 'García', 'company_name': 'Transportes Prueba'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert User.query.filter_by(email='luis@example.com').first() is None
+    # El hash se calcula antes de crear la compañía: no queda una compañía huérfana
+    assert Company.query.filter_by(name='Transportes Prueba').first() is None
+
+
+def test_login_within_timeout(app, client):
+    create_user('ana@example.com', 'secreto')
+
+    response = client.post('/api/token', json={'email': 'ana@example.com', 'password': 'secreto'})
+
+    assert response.status_code == 200
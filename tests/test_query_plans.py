@@ -0,0 +1,34 @@
+import pytest
+from sqlalchemy import text
+
+from api.commands import _uses_index
+from api.models import db
+
+
+def test_check_query_plans_uses_company_indexes(app):
+    result = app.test_cli_runner().invoke(args=['check-query-plans', '--rows', '200'])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.count('OK ') == 10
+
+
+def test_check_query_plans_fails_without_index(app):
+    db.session.execute(text("DROP INDEX ix_addresses_company_created"))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['check-query-plans', '--rows', '200'])
+
+    assert result.exit_code == 1
+    assert 'FALLO addresses' in result.output
+    assert 'OK    clients' in result.output
+
+
+@pytest.mark.parametrize('plan, expected', [
+    (['SEARCH addresses USING INDEX ix_addresses_company_created (company_id=?)'], True),
+    (['Limit', '  ->  Index Scan Backward using ix_addresses_company_created on addresses'], True),
+    (['Limit', '  ->  Index Scan using ix_addresses_company_id on addresses'], False),
+    (['Limit', '  ->  Index Scan using ix_addresses_company_created_old on addresses'], False),
+    (['SCAN addresses', 'USE TEMP B-TREE FOR ORDER BY'], False),
+])
+def test_uses_index(plan, expected):
+    assert _uses_index(plan, 'ix_addresses_company_created') is expected
@@ -0,0 +1,125 @@
+import pytest
+
+from api.quotes import price_quotes, quotes_to_list, parse_quote_items, parse_fuel_prices, round_cents, QUOTE_FIELDS
+from api.utils import APIException
+
+# Valores esperados calculados con las fórmulas de src/front/js/component/calculateDistance.js
+# y Number.toFixed(2). Cada caso: (presupuesto, precios del combustible, resultado)
+JS_QUOTES = [
+    # 20' sin recargos ni ajuste de consumo por peso
+    ({'distance_km': 250, 'duration_hours': 3.2, 'container_type': '20', 'weight': 18, 'tariff': 1.5}, {},
+     {'distance_km': 250.0, 'duration_hours': 3.2, 'fuel_consumption': 70.0, 'baf_cost': 28.0, 'driver_cost': 200.0,
+      'operational_cost': 228.0, 'base_price': 375.0, 'weight_surcharge': 0.0, 'options_surcharge': 0.0,
+      'final_price': 375.0, 'profit': 147.0}),
+    # 40' con exceso de peso (recargo del 25% y +12% de consumo) y dos opciones
+    ({'distance_km': 300, 'duration_hours': 4, 'container_type': '40', 'weight': 26, 'tariff': 2,
+      'options': ['Nocturnidad', 'Festivo']}, {},
+     {'distance_km': 300.0, 'duration_hours': 4.0, 'fuel_consumption': 107.52, 'baf_cost': 43.01, 'driver_cost': 240.0,
+      'operational_cost': 283.01, 'base_price': 600.0, 'weight_surcharge': 150.0, 'options_surcharge': 60.0,
+      'final_price': 810.0, 'profit': 526.99}),
+    # 20' reefer justo en el límite de peso: sin recargo
+    ({'distance_km': 120, 'container_type': '20reefer', 'weight': 25, 'tariff': 1.8}, {},
+     {'distance_km': 120.0, 'duration_hours': 0.0, 'fuel_consumption': 36.96, 'baf_cost': 14.78, 'driver_cost': 96.0,
+      'operational_cost': 110.78, 'base_price': 216.0, 'weight_surcharge': 0.0, 'options_surcharge': 0.0,
+      'final_price': 216.0, 'profit': 105.22}),
+    # 20' reefer por encima del límite de peso
+    ({'distance_km': 120, 'container_type': '20reefer', 'weight': 25.5, 'tariff': 1.8}, {},
+     {'distance_km': 120.0, 'duration_hours': 0.0, 'fuel_consumption': 37.3, 'baf_cost': 14.92, 'driver_cost': 96.0,
+      'operational_cost': 110.92, 'base_price': 216.0, 'weight_surcharge': 54.0, 'options_surcharge': 0.0,
+      'final_price': 270.0, 'profit': 159.08}),
+    # 40' reefer justo en el límite de peso, con una opción
+    ({'distance_km': 80, 'container_type': '40reefer', 'weight': 24, 'tariff': 2.1, 'options': ['Basculante']}, {},
+     {'distance_km': 80.0, 'duration_hours': 0.0, 'fuel_consumption': 27.65, 'baf_cost': 11.06, 'driver_cost': 64.0,
+      'operational_cost': 75.06, 'base_price': 168.0, 'weight_surcharge': 0.0, 'options_surcharge': 8.4,
+      'final_price': 176.4, 'profit': 101.34}),
+    # Sin contenedor: consumo por defecto, nunca hay recargo por peso; las cuatro opciones
+    ({'distance_km': 100, 'weight': 30, 'tariff': 1.2, 'options': ['Nocturnidad', 'Mercancía peligrosa', 'Festivo', 'Basculante']}, {},
+     {'distance_km': 100.0, 'duration_hours': 0.0, 'fuel_consumption': 36.0, 'baf_cost': 14.4, 'driver_cost': 80.0,
+      'operational_cost': 94.4, 'base_price': 120.0, 'weight_surcharge': 0.0, 'options_surcharge': 24.0,
+      'final_price': 144.0, 'profit': 49.6}),
+    # Precios del combustible de la petición
+    ({'distance_km': 200, 'container_type': '40', 'weight': 10, 'tariff': 1.6}, {'base_fuel_price': 1.2, 'fuel_price': 1.8},
+     {'distance_km': 200.0, 'duration_hours': 0.0, 'fuel_consumption': 64.0, 'baf_cost': 38.4, 'driver_cost': 160.0,
+      'operational_cost': 198.4, 'base_price': 320.0, 'weight_surcharge': 0.0, 'options_surcharge': 0.0,
+      'final_price': 320.0, 'profit': 121.6}),
+    # Combustible más barato que el de referencia: BAF negativo
+    ({'distance_km': 200, 'container_type': '40', 'weight': 10, 'tariff': 1.6}, {'base_fuel_price': 1.6, 'fuel_price': 1.4},
+     {'distance_km': 200.0, 'duration_hours': 0.0, 'fuel_consumption': 64.0, 'baf_cost': -12.8, 'driver_cost': 160.0,
+      'operational_cost': 147.2, 'base_price': 320.0, 'weight_surcharge': 0.0, 'options_surcharge': 0.0,
+      'final_price': 320.0, 'profit': 172.8}),
+    # Empate exacto al redondear (125.625): toFixed sube, no redondea al par
+    ({'distance_km': 100.5, 'container_type': '20', 'tariff': 1.25}, {},
+     {'distance_km': 100.5, 'duration_hours': 0.0, 'fuel_consumption': 28.14, 'baf_cost': 11.26, 'driver_cost': 80.4,
+      'operational_cost': 91.66, 'base_price': 125.63, 'weight_surcharge': 0.0, 'options_surcharge': 0.0,
+      'final_price': 125.63, 'profit': 33.97}),
+    ({'distance_km': 0.125, 'duration_hours': 0.125, 'tariff': 1}, {'base_fuel_price': 1.5, 'fuel_price': 1.5},
+     {'distance_km': 0.13, 'duration_hours': 0.13, 'fuel_consumption': 0.04, 'baf_cost': 0.0, 'driver_cost': 0.1,
+      'operational_cost': 0.1, 'base_price': 0.13, 'weight_surcharge': 0.0, 'options_surcharge': 0.0,
+      'final_price': 0.13, 'profit': 0.02}),
+]
+
+
+def quote(item, prices):
+    return quotes_to_list(price_quotes(**parse_quote_items([item]), **parse_fuel_prices(prices)))[0]
+
+
+@pytest.mark.parametrize('item, prices, expected', JS_QUOTES)
+def test_quote_matches_frontend(item, prices, expected):
+    assert quote(item, prices) == expected
+
+
+def test_batch_matches_single_quotes():
+    items = [item for item, prices, _ in JS_QUOTES if not prices]
+    expected = [result for _, prices, result in JS_QUOTES if not prices]
+
+    assert quotes_to_list(price_quotes(**parse_quote_items(items), **parse_fuel_prices({}))) == expected
+
+
+def test_quote_fields():
+    assert list(quote(*JS_QUOTES[0][:2])) == list(QUOTE_FIELDS)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (125.625, 125.63), (0.125, 0.13), (-0.125, -0.13), (1.005, 1.0), (2.675, 2.67), (1.2349, 1.23), (-12.8, -12.8),
+])
+def test_round_cents_matches_to_fixed(value, expected):
+    assert round_cents([value]).tolist() == [expected]
+
+
+def test_repeated_options_count_once():
+    options = quote({'distance_km': 100, 'tariff': 1, 'options': ['Festivo', 'Festivo']}, {})['options_surcharge']
+
+    assert options == 5.0
+
+
+def test_fuel_prices_default_to_reference():
+    assert parse_fuel_prices({}) == {'base_fuel_price': 1.10, 'fuel_price': 1.50}
+    assert parse_fuel_prices({'fuel_price': '1.7'}) == {'base_fuel_price': 1.10, 'fuel_price': 1.7}
+
+
+@pytest.mark.parametrize('prices', [{'fuel_price': -1}, {'base_fuel_price': 'caro'}, {'fuel_price': True}])
+def test_invalid_fuel_prices(prices):
+    with pytest.raises(APIException) as error:
+        parse_fuel_prices(prices)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize('item', [
+    {'tariff': 1},
+    {'distance_km': 100},
+    {'distance_km': -5, 'tariff': 1},
+    {'distance_km': 100, 'tariff': 1, 'container_type': '45'},
+    {'distance_km': 100, 'tariff': 1, 'options': ['Urgente']},
+])
+def test_invalid_quote_items(item):
+    with pytest.raises(APIException) as error:
+        parse_quote_items([item])
+    assert error.value.status_code == 400
+
+
+def test_quote_endpoint(client):
+    item, prices, expected = JS_QUOTES[6]
+    response = client.post('/api/quotes', json=dict(item, **prices))
+
+    assert response.status_code == 200
+    assert response.get_json() == expected
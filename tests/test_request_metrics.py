@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+from api.identity import create_user_token
+from api.instrumentation import logger
+from api.models import db, Address, Company, User
+
+
+@pytest.fixture
+def log_lines(monkeypatch):
+    buffer = io.StringIO()
+    monkeypatch.setattr(logger.handlers[0], 'stream', buffer)
+    return lambda: [json.loads(line) for line in buffer.getvalue().splitlines()]
+
+
+@pytest.fixture
+def company(app):
+    company = Company(name='Transportes Prueba')
+    db.session.add(company)
+    db.session.flush()
+    db.session.add_all([Address(name=f'Almacén {index}', address='Calle Mayor 1', category='Almacén', company_id=company.id)
+                        for index in range(2500)])
+    user = User(email='ana@example.com', password_hash='x', name='Ana', last_name='López', company_id=company.id)
+    db.session.add(user)
+    db.session.commit()
+    return company.id, create_user_token(user, company)
+
+
+def test_regular_response_logs_when_sent(client, company, log_lines):
+    company_id, token = company
+    response = client.get('/api/addresses', query_string={'company_id': company_id})
+
+    assert response.status_code == 200
+    assert 'total;dur=' in response.headers['Server-Timing']
+    [line] = log_lines()
+    assert line['path'] == '/api/addresses' and line['sql_count'] >= 1 and 'streamed' not in line
+
+
+def test_streamed_response_logs_on_close(client, company, log_lines):
+    company_id, token = company
+    client.set_cookie('access_token_cookie', token)
+
+    response = client.get(f'/api/companies/{company_id}/export')
+    assert 'parcial' in response.headers['Server-Timing']
+    assert len(response.data.splitlines()) == 2502
+    assert log_lines() == []
+    response.close()
+
+    [line] = log_lines()
+    header_queries = int(response.headers['Server-Timing'].split('desc="')[1].split(' ')[0])
+    assert line['streamed'] is True
+    # Las consultas de la exportación se hacen mientras se genera el cuerpo
+    assert line['sql_count'] > header_queries
@@ -0,0 +1,131 @@
+import importlib.util
+import os
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import text
+
+import api.search
+from api.models import db, Address, Company
+
+pytestmark = pytest.mark.skipif(not api.search.SQLITE_HAS_TRIGRAM, reason="SQLite sin el tokenizador trigram")
+
+MIGRATION = os.path.join(os.path.dirname(__file__), '..', 'migrations', 'versions', '7a3f5c9e2b1d_search_indexes.py')
+
+
+@pytest.fixture
+def company_id(app):
+    company = Company(name='Transportes A')
+    db.session.add(company)
+    db.session.commit()
+    return company.id
+
+
+def add_addresses(company_id, *rows):
+    addresses = [Address(name=name, address=street, category='Cliente', company_id=company_id) for name, street in rows]
+    db.session.add_all(addresses)
+    db.session.commit()
+    return [address.id for address in addresses]
+
+
+def search(client, company_id, q, **params):
+    response = client.get('/api/addresses', query_string={'company_id': company_id, 'q': q, **params})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def names(client, company_id, q):
+    return [item['name'] for item in search(client, company_id, q)['items']]
+
+
+def sqlite_objects():
+    rows = db.session.execute(text("SELECT type, name FROM sqlite_master WHERE name LIKE 'addresses_search%'"))
+    return {(row.type, row.name) for row in rows}
+
+
+def run_migration(step):
+    spec = importlib.util.spec_from_file_location('search_indexes_migration', MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    with db.engine.begin() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            getattr(migration, step)()
+
+
+def test_create_all_builds_shadow_table_and_triggers(company_id):
+    objects = sqlite_objects()
+
+    assert ('table', 'addresses_search') in objects
+    assert {('trigger', f"addresses_search_{suffix}") for suffix in ('ai', 'ad', 'au')} <= objects
+
+
+def test_triggers_follow_insert_rename_and_delete(client, company_id):
+    address_id, = add_addresses(company_id, ('Almacén Norte', 'Calle Mayor 1, Madrid'))
+    assert names(client, company_id, 'norte') == ['Almacén Norte']
+
+    response = client.put(f"/api/addresses/{address_id}", json={'name': 'Almacén Sur', 'company_id': company_id})
+    assert response.status_code == 200
+    assert names(client, company_id, 'norte') == []
+    assert names(client, company_id, 'sur') == ['Almacén Sur']
+
+    response = client.delete(f"/api/addresses/{address_id}", json={'company_id': company_id})
+    assert response.status_code < 300
+    assert names(client, company_id, 'sur') == []
+    assert db.session.execute(text("SELECT count(*) FROM addresses_search WHERE addresses_search MATCH 'sur'")).scalar() == 0
+
+
+def test_migration_rebuild_indexes_existing_rows(client, company_id):
+    created = sqlite_objects()
+    run_migration('downgrade')
+    assert sqlite_objects() == set()
+
+    # Filas escritas sin índice: la migración las indexa con 'rebuild'
+    add_addresses(company_id, ('Nave Toledo', 'Polígono 3'), ('Oficina', 'Gran Vía 12'))
+    run_migration('upgrade')
+
+    # La migración crea los mismos objetos que db.create_all()
+    assert sqlite_objects() == created
+    assert names(client, company_id, 'toledo') == ['Nave Toledo']
+    assert names(client, company_id, 'gran vía') == ['Oficina']
+
+
+def test_short_terms_use_like(client, company_id):
+    add_addresses(company_id, ('Nave N7', 'Polígono Sur'), ('Nave N8', 'Polígono Sur'), ('Oficina', 'Calle N7'))
+
+    # Menos de 3 caracteres: el tokenizador trigram no sirve y se filtra con LIKE
+    assert sorted(names(client, company_id, 'n7')) == ['Nave N7', 'Oficina']
+    # Término largo por FTS5 y término corto por LIKE en la misma consulta
+    assert names(client, company_id, 'nave n7') == ['Nave N7']
+
+
+def test_search_without_trigram_falls_back_to_like(client, company_id, monkeypatch):
+    monkeypatch.setattr(api.search, 'SQLITE_HAS_TRIGRAM', False)
+    add_addresses(company_id, ('Almacén Norte', 'Madrid'), ('Norte Logística', 'Bilbao'), ('Oficina', 'Sevilla'))
+
+    # Sin índice de texto las coincidencias al principio del documento van primero
+    assert names(client, company_id, 'norte') == ['Norte Logística', 'Almacén Norte']
+
+
+def test_offset_cursor_pages_every_match_once(client, company_id):
+    add_addresses(company_id, *[(f"Cliente {index}", 'Polígono Industrial') for index in range(60)])
+    add_addresses(company_id, ('Oficina', 'Gran Vía 12'))
+
+    ids, cursor, pages = [], None, 0
+    while True:
+        params = {'limit': 25, **({'cursor': cursor} if cursor else {})}
+        page = search(client, company_id, 'industrial', **params)
+        ids += [item['id'] for item in page['items']]
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert len(ids) == len(set(ids)) == 60
+
+
+def test_invalid_cursor_is_400(client, company_id):
+    response = client.get('/api/addresses', query_string={'company_id': company_id, 'q': 'norte', 'cursor': 'xx'})
+
+    assert response.status_code == 400
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+import api.spatial
+from api.geo import haversine_matrix
+from api.models import db, Address, Company
+from api.spatial import GridIndex, company_index, index_address_write
+from api.versioning import bump_collection_version, get_collection_version
+
+# Tolerancia (km) para comparar distancias float32 calculadas en lotes distintos
+TOLERANCE_KM = 1e-2
+CATEGORIES = ('Cliente', 'Almacén', 'Taller')
+
+
+# Puntos agrupados alrededor de varias ciudades con dispersión distinta, más algunos aislados
+def random_points(rng, count):
+    centers = np.array([(40.42, -3.70), (41.39, 2.17), (37.39, -5.98), (43.26, -2.93)])
+    spreads = rng.choice([0.02, 0.3, 2.0], size=count)
+    points = centers[rng.integers(len(centers), size=count)] + rng.normal(size=(count, 2)) * spreads[:, None]
+    points[:count // 20] = rng.uniform([27.0, -18.0], [44.0, 5.0], size=(count // 20, 2))
+    return points
+
+
+def build(rng, count):
+    index = GridIndex(version=0)
+    points = random_points(rng, count)
+    categories = rng.choice(CATEGORIES, size=count)
+    for address_id, ((lat, lng), category) in enumerate(zip(points, categories), start=1):
+        index.upsert(address_id, float(lat), float(lng), str(category))
+    return index, points, categories
+
+
+# Distancias de fuerza bruta a todos los puntos: {id: km}
+def brute_force(points, categories, lat, lng, category):
+    km = haversine_matrix([(lat, lng)], points)[0]
+    return {address_id: float(km[address_id - 1]) for address_id in range(1, len(points) + 1)
+            if category is None or categories[address_id - 1] == category}
+
+
+def random_query(rng, points):
+    if rng.random() < 0.7:
+        lat, lng = points[rng.integers(len(points))] + rng.normal(size=2) * 0.05
+    else:
+        lat, lng = rng.uniform([25.0, -20.0], [46.0, 8.0])
+    category = str(rng.choice(CATEGORIES)) if rng.random() < 0.3 else None
+    return float(lat), float(lng), category
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_nearest_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    index, points, categories = build(rng, 2000)
+
+    for _ in range(50):
+        lat, lng, category = random_query(rng, points)
+        k = int(rng.integers(1, 40))
+        max_km = float(rng.uniform(1, 200)) if rng.random() < 0.3 else None
+
+        expected = brute_force(points, categories, lat, lng, category)
+        limit_km = max_km if max_km is not None else np.inf
+        expected_km = sorted(expected.values())[:k]
+        result = index.nearest(lat, lng, k, category, max_km)
+
+        # Con max_km, los puntos en el borde pueden quedar a cualquier lado por el redondeo float32
+        inside = [km for km in expected_km if km <= limit_km - TOLERANCE_KM]
+        assert len(inside) <= len(result) <= len([km for km in expected_km if km <= limit_km + TOLERANCE_KM])
+        # Mismas distancias que la fuerza bruta (salvo empates) y cada id a la distancia indicada
+        assert np.allclose([km for _, km in result], expected_km[:len(result)], atol=TOLERANCE_KM)
+        assert all(abs(expected[address_id] - km) <= TOLERANCE_KM for address_id, km in result)
+        assert [km for _, km in result] == sorted(km for _, km in result)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_within_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    index, points, categories = build(rng, 2000)
+
+    for _ in range(50):
+        lat, lng, category = random_query(rng, points)
+        radius_km = float(rng.choice([0.5, 5.0, 50.0, 300.0]) * rng.uniform(0.5, 1.5))
+
+        expected = brute_force(points, categories, lat, lng, category)
+        result = dict(index.within(lat, lng, radius_km, category, limit=len(points)))
+
+        # Los puntos en el borde del radio pueden quedar a cualquier lado por el redondeo float32
+        borderline = {address_id for address_id, km in expected.items() if abs(km - radius_km) <= TOLERANCE_KM}
+        inside = {address_id for address_id, km in expected.items() if km <= radius_km}
+        assert set(result) - borderline == inside - borderline
+        assert all(abs(expected[address_id] - km) <= TOLERANCE_KM for address_id, km in result.items())
+
+
+def test_index_follows_removals():
+    rng = np.random.default_rng(42)
+    index, points, categories = build(rng, 500)
+    removed = set(range(1, 501, 3))
+    for address_id in removed:
+        index.remove(address_id)
+
+    lat, lng = (float(value) for value in points[0])
+    ids = [address_id for address_id, _ in index.nearest(lat, lng, 500)]
+
+    assert len(ids) == 500 - len(removed)
+    assert not removed & set(ids)
+
+
+@pytest.fixture
+def geocoded(app, monkeypatch):
+    monkeypatch.setattr(api.spatial, '_indexes', {})
+    company = Company(name='Transportes A')
+    db.session.add(company)
+    db.session.flush()
+    address = Address(name='Almacén', address='Madrid', category='Almacén', company_id=company.id)
+    address.latitude, address.longitude = 40.42, -3.70
+    db.session.add(address)
+    bump_collection_version(company.id, 'addresses')
+    db.session.commit()
+    return company.id, address.id
+
+
+def write_address(company_id):
+    address = Address(name='Nave', address='Getafe', category='Almacén', company_id=company_id)
+    address.latitude, address.longitude = 40.31, -3.73
+    db.session.add(address)
+    bump_collection_version(company_id, 'addresses')
+    db.session.commit()
+    return address
+
+
+def test_index_address_write_applies_next_version(geocoded):
+    company_id, address_id = geocoded
+    index = company_index(company_id)
+
+    address = write_address(company_id)
+    index_address_write(company_id, address.id, address.latitude, address.longitude, address.category)
+
+    assert api.spatial._indexes[company_id] is index
+    assert index.version == get_collection_version(company_id, 'addresses')
+    assert [found for found, _ in index.nearest(40.31, -3.73, 2)] == [address.id, address_id]
+
+
+def test_index_address_write_drops_index_on_version_skew(geocoded):
+    company_id, address_id = geocoded
+    company_index(company_id)
+
+    # Otra escritura (otro proceso, importación en lote...) sin pasar por el índice de este proceso
+    write_address(company_id)
+    address = write_address(company_id)
+    index_address_write(company_id, address.id, address.latitude, address.longitude, address.category)
+
+    assert company_id not in api.spatial._indexes
+    # La siguiente consulta reconstruye el índice con todas las direcciones
+    assert len(company_index(company_id)) == 3